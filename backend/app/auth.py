@@ -0,0 +1,177 @@
+# app/auth.py
+
+"""
+無狀態簽章 token（HMAC-SHA256）
+
+格式（全部是 URL-safe 字元，可以直接放 query string）：
+    v1.<user_id>.<server_id>.<exp>.<signature>
+
+- signature = base64url(HMAC-SHA256(PET_TOKEN_SECRET, "v1.<user_id>.<server_id>.<exp>"))
+- 驗證只需要 secret，不查 DB；比對簽章用 hmac.compare_digest（constant time）
+- 最近驗證過的 token 放在一個小 LRU，同一個 token 重複打 API 時只剩一次 dict 查詢 + 過期檢查
+- ws-server/common/auth.py 是同一份驗證邏輯，兩邊必須設定同一個 PET_TOKEN_SECRET；
+  改的時候兩邊一起改（tests/test_shared_modules.py 會比對）
+
+環境變數：
+- PET_TOKEN_SECRET   簽章金鑰（必填；沒設定就拒絕啟動）
+- PET_ALLOW_DEV_SECRETS=1  本機開發才設：沒設定的密鑰改用公開的 "dev-only-change-me"，啟動時印 CRITICAL 警告
+- PET_TOKEN_TTL      token 有效秒數，預設 43200（12 小時）
+- PET_INTERNAL_TOKEN 後端呼叫 ws-server 內部 API 的共用密鑰（必填，同上）
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from fastapi import Header
+
+from app.metrics import Counter
+
+TOKEN_VERSION = "v1"
+
+# 公開的開發用預設值：只有明確設定 PET_ALLOW_DEV_SECRETS=1 才會用（誰都能拿它簽 token）
+DEV_SECRET = "dev-only-change-me"
+ALLOW_DEV_SECRETS = os.environ.get("PET_ALLOW_DEV_SECRETS") == "1"
+
+
+def _required_secret(name: str) -> str:
+    """讀必填的密鑰；沒設定（或設成公開的預設值）時直接拒絕啟動，除非明確打開開發模式"""
+    value = os.environ.get(name, "")
+    if value and value != DEV_SECRET:
+        return value
+    if not ALLOW_DEV_SECRETS:
+        raise RuntimeError(f"{name} 沒有設定，拒絕用公開的預設值啟動（本機開發請設定 PET_ALLOW_DEV_SECRETS=1）")
+    logging.getLogger("pet.auth").critical(
+        "%s 沒有設定，使用公開的開發用預設值：任何人都能偽造，絕對不能用在正式環境", name,
+    )
+    return DEV_SECRET
+
+
+TOKEN_SECRET = _required_secret("PET_TOKEN_SECRET").encode("utf-8")
+TOKEN_TTL_SECONDS = int(os.environ.get("PET_TOKEN_TTL", "43200"))
+
+# 後端 -> ws-server 的內部呼叫（例如 /internal/evict）用的共用密鑰，放在 X-Internal-Token header
+INTERNAL_TOKEN = _required_secret("PET_INTERNAL_TOKEN")
+
+VERIFIED_CACHE_SIZE = 4096
+
+AUTH_TOKEN_VERIFY = Counter(
+    "pet_auth_token_verify_total",
+    "token 驗證次數（cached = 命中 LRU，不用重算 HMAC）",
+    ("result",),
+)
+
+
+class TokenClaims(NamedTuple):
+    user_id: int
+    server_id: str
+    exp: int
+
+
+class AuthError(Exception):
+    """token 缺少 / 格式錯誤 / 簽章不符 / 過期；main.py 會轉成 401 的 APIResponse"""
+
+    def __init__(self, code: str, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _sign(body: str) -> str:
+    digest = hmac.new(TOKEN_SECRET, body.encode("ascii"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def issue_token(user_id: int, server_id: str, ttl: Optional[int] = None) -> str:
+    exp = int(time.time()) + (TOKEN_TTL_SECONDS if ttl is None else ttl)
+    body = f"{TOKEN_VERSION}.{int(user_id)}.{server_id}.{exp}"
+    return f"{body}.{_sign(body)}"
+
+
+class _VerifiedTokens:
+    """token -> claims 的 LRU（sync route 跑在 threadpool，所以要鎖）"""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._items: "OrderedDict[str, TokenClaims]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[TokenClaims]:
+        with self._lock:
+            claims = self._items.get(token)
+            if claims is not None:
+                self._items.move_to_end(token)
+            return claims
+
+    def put(self, token: str, claims: TokenClaims) -> None:
+        with self._lock:
+            self._items[token] = claims
+            self._items.move_to_end(token)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_verified = _VerifiedTokens(VERIFIED_CACHE_SIZE)
+
+
+def verify_token(token: str, now: Optional[float] = None) -> TokenClaims:
+    """驗證 token 並回傳 claims；不合法時丟 AuthError。"""
+    if now is None:
+        now = time.time()
+
+    claims = _verified.get(token)
+    if claims is not None:
+        if claims.exp < now:
+            AUTH_TOKEN_VERIFY.inc("expired")
+            raise AuthError("TOKEN_EXPIRED", "Token has expired.")
+        AUTH_TOKEN_VERIFY.inc("cached")
+        return claims
+
+    body, _, signature = token.rpartition(".")
+    parts = body.split(".")
+    # 合法的 token 只有 ASCII：非 ASCII 先擋掉，不然 _sign 的 encode("ascii") 會丟 UnicodeEncodeError
+    if not token.isascii() or len(parts) != 4 or parts[0] != TOKEN_VERSION:
+        AUTH_TOKEN_VERIFY.inc("invalid")
+        raise AuthError("INVALID_TOKEN", "Malformed token.")
+
+    # 比 bytes：compare_digest 遇到非 ASCII 的 str 會丟 TypeError
+    if not hmac.compare_digest(_sign(body).encode("ascii"), signature.encode("ascii")):
+        AUTH_TOKEN_VERIFY.inc("invalid")
+        raise AuthError("INVALID_TOKEN", "Token signature mismatch.")
+
+    try:
+        claims = TokenClaims(user_id=int(parts[1]), server_id=parts[2], exp=int(parts[3]))
+    except ValueError:
+        AUTH_TOKEN_VERIFY.inc("invalid")
+        raise AuthError("INVALID_TOKEN", "Malformed token.")
+
+    if claims.exp < now:
+        AUTH_TOKEN_VERIFY.inc("expired")
+        raise AuthError("TOKEN_EXPIRED", "Token has expired.")
+
+    _verified.put(token, claims)
+    AUTH_TOKEN_VERIFY.inc("ok")
+    return claims
+
+
+def require_user(authorization: Optional[str] = Header(default=None)) -> TokenClaims:
+    """
+    FastAPI 相依注入：從 Authorization: Bearer <token> 取出身分。
+    不查 DB；user_id 一律以 token 為準，不再相信 query string / body 帶的 user_id。
+    """
+    if not authorization:
+        raise AuthError("UNAUTHORIZED", "Missing Authorization header.")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise AuthError("UNAUTHORIZED", "Authorization header must be 'Bearer <token>'.")
+    return verify_token(token.strip())
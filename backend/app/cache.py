@@ -0,0 +1,107 @@
+# app/cache.py
+
+"""
+程序內的小型 TTL + LRU 快取（給 login / 路由查詢這類「讀很多、寫很少」的資料用）
+
+- 每個 uvicorn worker process 各自一份；寫入路徑（register / 改密碼 / 換伺服器）要自己呼叫 invalidate
+- 其他 worker 的舊資料最多活 ttl 秒，所以 ttl 不要設太長
+- 支援 negative cache：查不到的 key 也記一下（較短的 negative_ttl），帳號打錯 / 惡意亂試不會每次都打 DB
+
+用法：
+    USERS = TTLCache("user_login", ttl=60, max_size=10000, negative_ttl=5)
+
+    cached = USERS.get(username)
+    if cached is MISSING:
+        row = 查 DB
+        if row is None:
+            USERS.put_negative(username)
+        else:
+            USERS.put(username, row)
+    elif cached is None:
+        # negative hit：確定不存在
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, Tuple, TypeVar
+
+from app.metrics import Counter
+
+V = TypeVar("V")
+
+CACHE_REQUESTS = Counter(
+    "pet_cache_requests_total",
+    "程序內快取查詢次數（hit / negative_hit / miss）",
+    ("cache", "result"),
+)
+
+
+class _Missing:
+    def __repr__(self) -> str:
+        return "MISSING"
+
+    def __bool__(self) -> bool:
+        # `if cache.get(k):` 只在真的有值時成立（miss 跟 negative hit 都是 False）
+        return False
+
+
+# get() 查不到（或過期）時回傳；跟 negative hit 的 None 區分開
+MISSING: Any = _Missing()
+
+
+class TTLCache(Generic[V]):
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_size: int,
+        negative_ttl: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        # key -> (過期時間, 值)；值是 None 代表 negative entry
+        self._items: "OrderedDict[Hashable, Tuple[float, Optional[V]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """回傳值；negative entry 回傳 None；查不到 / 過期回傳 MISSING"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._items.move_to_end(key)
+                    CACHE_REQUESTS.inc(self.name, "hit" if entry[1] is not None else "negative_hit")
+                    return entry[1]
+                del self._items[key]
+        CACHE_REQUESTS.inc(self.name, "miss")
+        return MISSING
+
+    def put(self, key: Hashable, value: V) -> None:
+        self._set(key, value, self.ttl)
+
+    def put_negative(self, key: Hashable) -> None:
+        if self.negative_ttl:
+            self._set(key, None, self.negative_ttl)
+
+    def _set(self, key: Hashable, value: Optional[V], ttl: float) -> None:
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._items[key] = (expires_at, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,234 @@
+# app/metrics.py
+
+"""
+輕量版 Prometheus 指標（text exposition format 0.0.4）
+與 ws-server/common/metrics.py 同一份實作，改的時候兩邊一起改（tests/test_shared_modules.py 會比對）
+
+設計重點：
+- 熱路徑（inc / observe）只寫「目前 thread 自己的格子」，不拿鎖
+- /metrics 被抓取時才把各 thread 的格子加總
+- Gauge 可以直接給一個 callback，抓取時才計算（例如目前連線數），熱路徑零成本
+
+用法：
+    REQUESTS = Counter("http_requests_total", "HTTP 請求數", ("method", "route"))
+    REQUESTS.inc("GET", "/api/health")
+
+    LATENCY = Histogram("http_request_seconds", "HTTP 延遲", ("route",))
+    LATENCY.observe(0.012, "/api/health")
+
+    print(REGISTRY.render())
+"""
+
+import bisect
+import math
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """給 node_exporter textfile collector 用（短命的 cron 程序）：先寫暫存檔再 rename。"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        registry: Optional[Registry] = REGISTRY,
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._local = threading.local()
+        self._cells: List[dict] = []
+        self._cells_lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _cell(self) -> dict:
+        # 每個 thread 第一次寫入時才註冊自己的格子；之後完全不用鎖
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell: dict = {}
+            with self._cells_lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+            return cell
+
+    def _snapshots(self) -> List[dict]:
+        # dict.copy() 在 CPython 持有 GIL 完成，不會跟寫入端撞到「迭代中改變大小」
+        with self._cells_lock:
+            cells = list(self._cells)
+        return [cell.copy() for cell in cells]
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        cell = self._cell()
+        cell[labels] = cell.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return sum(snap.get(labels, 0.0) for snap in self._snapshots())
+
+    def collect(self) -> List[str]:
+        totals: Dict[LabelValues, float] = {}
+        for snap in self._snapshots():
+            for labels, v in snap.items():
+                totals[labels] = totals.get(labels, 0.0) + v
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(v)}"
+            for labels, v in sorted(totals.items())
+        ]
+
+
+class Gauge(_Metric):
+    """
+    兩種用法：
+    - set / inc / dec：單一寫入者（例如 asyncio event loop）自己維護數值
+    - callback：抓取時才呼叫，回傳數值，或 {label tuple: 數值}
+    """
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        callback: Optional[Callable[[], object]] = None,
+        registry: Optional[Registry] = REGISTRY,
+    ) -> None:
+        super().__init__(name, help_text, label_names, registry)
+        self._values: Dict[LabelValues, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def collect(self) -> List[str]:
+        values = dict(self._values)
+        if self._callback is not None:
+            result = self._callback()
+            if isinstance(result, dict):
+                values.update(result)
+            else:
+                values[()] = float(result)  # type: ignore[arg-type]
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(v)}"
+            for labels, v in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Optional[Registry] = REGISTRY,
+    ) -> None:
+        super().__init__(name, help_text, label_names, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        cell = self._cell()
+        state = cell.get(labels)
+        if state is None:
+            # [各 bucket 次數（最後一格是 +Inf）, sum, count]
+            state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            cell[labels] = state
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def collect(self) -> List[str]:
+        merged: Dict[LabelValues, list] = {}
+        for snap in self._snapshots():
+            for labels, (counts, total, count) in snap.items():
+                agg = merged.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                for i, c in enumerate(list(counts)):
+                    agg[0][i] += c
+                agg[1] += total
+                agg[2] += count
+
+        lines: List[str] = []
+        names = self.label_names + ("le",)
+        for labels, (counts, total, count) in sorted(merged.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                le = _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (le,))} {cumulative}")
+            label_str = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
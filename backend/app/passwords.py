@@ -0,0 +1,234 @@
+# app/passwords.py
+
+"""
+密碼雜湊（scrypt）+ 背景 process pool
+
+為什麼要獨立一個模組：
+- scrypt 刻意很吃 CPU（預設參數一次約 50ms），直接在 route 裡算，上課一開始大家同時登入時
+  會把 threadpool 跟 GIL 都佔滿，Pi 的 /api/pet/update 也跟著卡住
+- 所以實際運算丟到獨立的 process pool，route 只是等結果
+- 同時在等的數量有上限（PET_HASH_MAX_INFLIGHT），超過就直接丟 HashingBusy，
+  main.py 轉成 503 SERVER_BUSY，前端稍後重試；不會讓登入潮把 threadpool 全部卡住
+
+雜湊格式：
+    scrypt$<n>$<r>$<p>$<salt base64>$<hash base64>
+舊資料是 64 字元的 sha256 hex：登入驗證成功時順便升級成 scrypt（verify_and_upgrade）
+
+環境變數：
+- PET_SCRYPT_N / PET_SCRYPT_R / PET_SCRYPT_P   成本參數，預設 16384 / 8 / 1
+- PET_HASH_WORKERS                            pool 的 process 數，預設 min(2, CPU 數)
+- PET_HASH_MAX_INFLIGHT                       同時排隊 + 計算中的上限，預設 workers * 4
+- PET_HASH_TIMEOUT                            等待結果的秒數上限，預設 10（超過也回 SERVER_BUSY；
+                                              名額要等 worker 真的算完才釋放）
+"""
+
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from app.metrics import Counter, Histogram
+
+SCRYPT_N = int(os.environ.get("PET_SCRYPT_N", "16384"))
+SCRYPT_R = int(os.environ.get("PET_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("PET_SCRYPT_P", "1"))
+SCRYPT_DKLEN = 32
+SALT_BYTES = 16
+
+HASH_WORKERS = int(os.environ.get("PET_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+HASH_MAX_INFLIGHT = int(os.environ.get("PET_HASH_MAX_INFLIGHT", str(HASH_WORKERS * 4)))
+HASH_TIMEOUT = float(os.environ.get("PET_HASH_TIMEOUT", "10"))
+
+PASSWORD_HASH_SECONDS = Histogram(
+    "pet_password_hash_seconds",
+    "密碼雜湊 / 驗證花的時間（含排隊）",
+    ("op",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "pet_password_hash_rejected_total",
+    "pool 滿載被直接拒絕的雜湊請求數",
+    ("op",),
+)
+PASSWORD_HASH_TIMEOUTS = Counter(
+    "pet_password_hash_timeout_total",
+    "等超過 PET_HASH_TIMEOUT 秒還沒算完、先回 SERVER_BUSY 的雜湊請求數",
+    ("op",),
+)
+PASSWORD_HASH_UPGRADED = Counter(
+    "pet_password_hash_upgraded_total",
+    "登入時把舊 sha256 / 舊參數雜湊升級成目前 scrypt 參數的次數",
+)
+
+
+class HashingBusy(Exception):
+    """pool 已滿（排隊數到達 HASH_MAX_INFLIGHT）或等太久，呼叫端應回 SERVER_BUSY"""
+
+
+# ------------------------------------------------------------
+# 純函式：在 worker process 裡跑（也可以直接呼叫，例如 bench / 測試）
+# ------------------------------------------------------------
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode("ascii")
+
+
+def _scrypt(plain: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        plain.encode("utf-8"),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * n * r + 1024 * 1024,
+        dklen=SCRYPT_DKLEN,
+    )
+
+
+def _is_legacy_sha256(stored: str) -> bool:
+    return len(stored) == 64 and all(c in "0123456789abcdef" for c in stored)
+
+
+def hash_password_sync(plain: str) -> str:
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(plain, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password_sync(plain: str, stored: str) -> bool:
+    if _is_legacy_sha256(stored):
+        legacy = hashlib.sha256(plain.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(legacy, stored)
+
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != "scrypt":
+        return False
+    try:
+        n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+        salt = base64.b64decode(parts[4])
+        expected = base64.b64decode(parts[5])
+    except ValueError:
+        return False
+    return hmac.compare_digest(_scrypt(plain, salt, n, r, p), expected)
+
+
+def needs_rehash(stored: str) -> bool:
+    if _is_legacy_sha256(stored):
+        return True
+    return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+def verify_and_upgrade_sync(plain: str, stored: str) -> Tuple[bool, Optional[str]]:
+    """
+    驗證密碼；通過且雜湊是舊格式時，順便算好新的 scrypt 雜湊一起回傳
+    （同一次 pool 往返完成，不用再排一次隊）
+    """
+    if not verify_password_sync(plain, stored):
+        return False, None
+    if needs_rehash(stored):
+        return True, hash_password_sync(plain)
+    return True, None
+
+
+# ------------------------------------------------------------
+# process pool（第一次用到才建立）
+# ------------------------------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_inflight = threading.BoundedSemaphore(HASH_MAX_INFLIGHT)
+
+# 帳號不存在時也跑一次驗證，回應時間跟「密碼錯」一樣，不會洩漏帳號是否存在
+_DUMMY_HASH: Optional[str] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn：worker 不繼承父 process 的 DB 連線 / thread 狀態
+                _pool = ProcessPoolExecutor(
+                    max_workers=HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def _run(op: str, fn, *args):
+    if not _inflight.acquire(blocking=False):
+        PASSWORD_HASH_REJECTED.inc(op)
+        raise HashingBusy(op)
+    start = time.perf_counter()
+    pool = _get_pool()
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        # 沒有請求在等結果時 worker 死掉，要到下一次 submit 才會發現：一樣丟掉重建，請 client 重試
+        _inflight.release()
+        _discard_pool(pool)
+        raise HashingBusy(op)
+    except BaseException:
+        _inflight.release()
+        raise
+    # 名額等 worker 真的算完（或被取消）才還：route 等太久先回 503 時，scrypt 其實還在 pool 裡跑，
+    # 在 finally 就還的話，排進 pool 的工作會超過 HASH_MAX_INFLIGHT
+    future.add_done_callback(lambda _future: _inflight.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeoutError:
+        PASSWORD_HASH_TIMEOUTS.inc(op)
+        raise HashingBusy(op)
+    except BrokenProcessPool:
+        # worker 被 OOM killer 等砍掉：丟掉整個 pool，下一個請求重建；這次請 client 重試
+        _discard_pool(pool)
+        raise HashingBusy(op)
+    finally:
+        PASSWORD_HASH_SECONDS.observe(time.perf_counter() - start, op)
+
+
+def hash_password(plain: str) -> str:
+    """註冊 / 改密碼用：在 pool 裡算 scrypt。滿載時丟 HashingBusy。"""
+    return _run("hash", hash_password_sync, plain)
+
+
+def verify_and_upgrade(plain: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """
+    登入用：回傳 (是否通過, 需要寫回 DB 的新雜湊或 None)。
+    stored 是 None（帳號不存在）時對假雜湊驗證一次，一律回傳失敗。
+    """
+    global _DUMMY_HASH
+    if stored is None:
+        if _DUMMY_HASH is None:
+            _DUMMY_HASH = _run("hash", hash_password_sync, "not-a-real-password")
+        _run("verify", verify_password_sync, "", _DUMMY_HASH)
+        return False, None
+
+    ok, new_hash = _run("verify", verify_and_upgrade_sync, plain, stored)
+    if new_hash is not None:
+        PASSWORD_HASH_UPGRADED.inc()
+    return ok, new_hash
+
+
+def _discard_pool(broken: ProcessPoolExecutor) -> None:
+    """只丟掉壞掉的那個 pool：別的請求可能已經重建了新的，不能一起丟"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
@@ -0,0 +1,187 @@
+# app/placement.py
+
+"""
+ws shard（A / B / C）的負載查詢與分配
+
+- 各 ws-server 的 GET / 會回報即時負載：connections、lobby_size、battles、loop_lag_ms、messages_per_sec
+- 分配依據是連線使用率（connections / capacity）；event loop lag 超過上限的 shard 視同已滿
+  （那台已經卡住了，再塞人只會更糟）；正在重啟（draining）的 shard 也不分配
+- 後端平行去問三台（短 timeout），結果快取 LOAD_CACHE_SECONDS 秒，
+  換伺服器 / 註冊潮不會每個 request 都打三次 HTTP
+- 快取期間內的搬移用 note_move() 先在本地加減，避免 2 秒內所有人都被分到「同一台最空的」
+- 連不上的 shard 視為不可用；三台都連不上（監控本身壞了）時不擋，照使用者指定的走
+
+環境變數：
+- PET_WS_SHARDS        各 shard 的內部位址，預設 "A=http://127.0.0.1:8001,B=http://127.0.0.1:8002,C=http://127.0.0.1:8003"
+- PET_SHARD_CAPACITY   每台 shard 的連線上限，預設 200
+- PET_SHARD_MAX_LAG_MS event loop lag 超過這個值就不再分配新玩家過去，預設 250
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+SHARD_IDS = ("A", "B", "C")
+
+SHARD_CAPACITY = int(os.environ.get("PET_SHARD_CAPACITY", "200"))
+MAX_LOOP_LAG_MS = float(os.environ.get("PET_SHARD_MAX_LAG_MS", "250"))
+LOAD_CACHE_SECONDS = 2.0
+HTTP_TIMEOUT_SECONDS = 0.5
+
+
+def _parse_shard_urls(raw: str) -> Dict[str, str]:
+    urls: Dict[str, str] = {}
+    for item in raw.split(","):
+        server_id, _, url = item.partition("=")
+        if server_id.strip() and url.strip():
+            urls[server_id.strip()] = url.strip().rstrip("/")
+    return urls
+
+
+WS_SHARD_URLS = _parse_shard_urls(
+    os.environ.get(
+        "PET_WS_SHARDS",
+        "A=http://127.0.0.1:8001,B=http://127.0.0.1:8002,C=http://127.0.0.1:8003",
+    )
+)
+
+
+class ShardLoad(NamedTuple):
+    server_id: str
+    reachable: bool
+    connections: int
+    capacity: int
+    lobby_size: int = 0
+    battles: int = 0
+    loop_lag_ms: float = 0.0
+    messages_per_sec: float = 0.0
+    # 重啟中（drain）：不收新連線，也不分配新玩家過去
+    draining: bool = False
+
+    @property
+    def utilization(self) -> float:
+        return self.connections / self.capacity if self.capacity else 1.0
+
+    @property
+    def has_room(self) -> bool:
+        return (
+            self.reachable
+            and not self.draining
+            and self.connections < self.capacity
+            and self.loop_lag_ms <= MAX_LOOP_LAG_MS
+        )
+
+
+class PlacementError(Exception):
+    """指定的 shard 滿了 / 連不上；code 直接當 APIResponse 的 error.code"""
+
+    def __init__(self, code: str, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+_executor = ThreadPoolExecutor(max_workers=len(SHARD_IDS), thread_name_prefix="shard-load")
+_lock = threading.Lock()
+_cached_at = 0.0
+_cached: Dict[str, ShardLoad] = {}
+
+
+def _fetch_one(server_id: str) -> ShardLoad:
+    url = WS_SHARD_URLS.get(server_id)
+    if not url:
+        return ShardLoad(server_id, False, 0, SHARD_CAPACITY)
+    try:
+        with urllib.request.urlopen(f"{url}/", timeout=HTTP_TIMEOUT_SECONDS) as resp:
+            data = json.loads(resp.read())
+        return ShardLoad(
+            server_id,
+            True,
+            int(data.get("connections", 0)),
+            SHARD_CAPACITY,
+            lobby_size=int(data.get("lobby_size", 0)),
+            battles=int(data.get("battles", 0)),
+            loop_lag_ms=float(data.get("loop_lag_ms", 0.0)),
+            messages_per_sec=float(data.get("messages_per_sec", 0.0)),
+            draining=bool(data.get("draining", False)),
+        )
+    except (OSError, ValueError, TypeError):
+        return ShardLoad(server_id, False, 0, SHARD_CAPACITY)
+
+
+def get_shard_loads(max_age: float = LOAD_CACHE_SECONDS) -> Dict[str, ShardLoad]:
+    """回傳各 shard 目前負載（最多 max_age 秒前的資料）"""
+    global _cached_at, _cached
+    with _lock:
+        if _cached and time.monotonic() - _cached_at < max_age:
+            return dict(_cached)
+
+    loads = {load.server_id: load for load in _executor.map(_fetch_one, SHARD_IDS)}
+    with _lock:
+        _cached = loads
+        _cached_at = time.monotonic()
+        return dict(loads)
+
+
+def note_move(from_server: Optional[str], to_server: str) -> None:
+    """搬移成功後先在本地快取加減連線數，下一次重新抓取前的分配才不會全擠到同一台"""
+    with _lock:
+        if to_server in _cached:
+            _cached[to_server] = _cached[to_server]._replace(connections=_cached[to_server].connections + 1)
+        if from_server in _cached and from_server != to_server:
+            load = _cached[from_server]
+            _cached[from_server] = load._replace(connections=max(0, load.connections - 1))
+
+
+def choose_shard(requested: Optional[str] = None, current: Optional[str] = None) -> str:
+    """
+    - requested 有值：檢查那台還有空位，沒有就丟 PlacementError
+    - requested 沒給：挑使用率最低的一台（平手時留在 current，減少無謂搬移）
+    - 三台都連不上：不擋，回傳 requested / current / "A"
+    """
+    loads = get_shard_loads()
+    reachable: List[ShardLoad] = [load for load in loads.values() if load.reachable]
+    if not reachable:
+        return requested or current or SHARD_IDS[0]
+
+    if requested is not None:
+        load = loads.get(requested)
+        if load is None or not load.reachable:
+            raise PlacementError("SERVER_UNAVAILABLE", f"Server {requested} is not reachable.")
+        if not load.has_room and requested != current:
+            raise PlacementError("SERVER_FULL", f"Server {requested} is full.")
+        return requested
+
+    def score(load: ShardLoad):
+        # 目前所在的 shard 扣掉自己那一條連線，才不會因為「自己佔了一格」就被搬走
+        connections = load.connections - 1 if load.server_id == current and load.connections else load.connections
+        return (connections / load.capacity if load.capacity else 1.0, load.server_id != current, load.server_id)
+
+    candidates = [load for load in reachable if load.has_room] or reachable
+    return min(candidates, key=score).server_id
+
+
+def evict_from_shard(server_id: str, user_id: int, new_server_id: str, internal_token: str) -> bool:
+    """
+    通知舊 shard 把這個 user 的連線踢掉（會先送 server_moved 給前端）。
+    回傳是否成功通知；失敗不影響搬移本身（DB 已經改好，舊連線斷線重連時會拿新 token 連到新 shard）。
+    """
+    url = WS_SHARD_URLS.get(server_id)
+    if not url:
+        return False
+    body = json.dumps({"user_id": user_id, "new_server_id": new_server_id}).encode("utf-8")
+    req = urllib.request.Request(
+        f"{url}/internal/evict",
+        data=body,
+        method="POST",
+        headers={"Content-Type": "application/json", "X-Internal-Token": internal_token},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT_SECONDS) as resp:
+            return resp.status == 200
+    except OSError:
+        return False
@@ -64,6 +64,10 @@ CREATE TABLE IF NOT EXISTS battles (
     created_at     TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- 冪等鍵：ws-server 的 battle_id；重送同一場結果時 ON CONFLICT 直接略過
+ALTER TABLE battles ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_battles_idempotency_key ON battles (idempotency_key);
+
 CREATE INDEX IF NOT EXISTS idx_battles_server_id ON battles (server_id);
 CREATE INDEX IF NOT EXISTS idx_battles_players   ON battles (player1_id, player2_id);
 CREATE INDEX IF NOT EXISTS idx_battles_winner    ON battles (winner_user_id);
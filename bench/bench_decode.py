@@ -0,0 +1,122 @@
+# bench/bench_decode.py
+
+"""
+ws-server 訊息解碼吞吐量（單核、單 thread）：舊做法 vs. msgspec Struct + dispatch table
+
+- json+dict：json.loads 整個 frame → if/elif 比對 type → handler 裡 int(message.get(...)) / payload.get(...)
+- msgspec：先只解 envelope（payload 留成 Raw），查 dispatch table，再用該 type 的 Decoder 解成 Struct
+
+訊息組合模擬大廳尖峰：大部分是 update_position，少量聊天 / 狀態更新 / 對戰分數。
+另外量「超過大小上限」與「未知 type」被拒絕的成本（都不會解 payload）。
+
+執行方式：
+    python bench/bench_decode.py
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ws-server"))
+
+from common import protocol  # noqa: E402
+
+N = 200_000
+
+FRAMES = [
+    json.dumps(m) for m in (
+        [{"type": "update_position", "server_id": "A", "user_id": 7, "payload": {"x": 101.5, "y": 42.25}}] * 16
+        + [{"type": "pet_state_update", "server_id": "A", "user_id": 7,
+            "payload": {"energy": 80, "status": "ACTIVE", "score": 12}}] * 2
+        + [{"type": "chat_message", "server_id": "A", "user_id": 7,
+            "payload": {"to_user_id": "8", "content": "要不要來對戰？"}}]
+        + [{"type": "battle_update", "server_id": "A", "user_id": 7,
+            "payload": {"battle_id": "3f2b9c1e-6a0d-4c55-9f51-5b2f9d1d7a10", "score": 37, "state": "running"}}]
+    )
+]
+
+
+async def _noop(server_id, user_id, payload) -> None:
+    return None
+
+
+def build_router() -> protocol.MessageRouter:
+    router = protocol.MessageRouter()
+    router.on("update_position", protocol.PositionPayload)(_noop)
+    router.on("pet_state_update", protocol.PetStatePayload)(_noop)
+    router.on("chat_message", protocol.ChatMessagePayload)(_noop)
+    router.on("battle_update", protocol.BattleUpdatePayload)(_noop)
+    return router
+
+
+def decode_dict(raw: str):
+    """改版前 websocket_endpoint + handler 開頭做的事"""
+    message = json.loads(raw)
+    msg_type = message.get("type")
+    user_id = int(message.get("user_id"))
+    payload = message.get("payload") or {}
+    if msg_type == "update_position":
+        x = payload.get("x")
+        y = payload.get("y")
+        return user_id, float(x), float(y)
+    elif msg_type == "pet_state_update":
+        return user_id, int(payload["energy"]), str(payload["status"]), int(payload["score"])
+    elif msg_type == "chat_message":
+        return user_id, int(payload.get("to_user_id")), str(payload.get("content", ""))
+    elif msg_type == "battle_update":
+        return (
+            user_id,
+            str(payload.get("battle_id")),
+            int(payload.get("score", 0)),
+            str(payload.get("state", "running")),
+        )
+    return None
+
+
+def decode_struct(router: protocol.MessageRouter, raw: str):
+    envelope = router.decode_envelope(raw)
+    route = router.get(envelope.type)
+    return envelope.user_id, route.decode(envelope.payload)
+
+
+def report(name: str, elapsed: float, n: int) -> None:
+    print(f"{name:<28} {elapsed * 1e6 / n:8.2f} us/msg  ({n / elapsed:>12,.0f} msgs/s/core)")
+
+
+def main() -> None:
+    router = build_router()
+    frames = [FRAMES[i % len(FRAMES)] for i in range(N)]
+
+    # 暖機，順便確認每種 frame 兩邊都解得出來
+    for raw in FRAMES:
+        decode_struct(router, raw)
+        decode_dict(raw)
+
+    start = time.perf_counter()
+    for raw in frames:
+        decode_dict(raw)
+    report("json+dict", time.perf_counter() - start, N)
+
+    start = time.perf_counter()
+    for raw in frames:
+        decode_struct(router, raw)
+    report("msgspec envelope+payload", time.perf_counter() - start, N)
+
+    oversized = json.dumps({"type": "chat_message", "payload": {"content": "x" * (router.max_bytes + 1)}})
+    unknown = json.dumps({"type": "battle_reject", "payload": {"from_user_id": 8, "padding": "y" * 2000}})
+    rejected = 0
+    start = time.perf_counter()
+    for i in range(N):
+        try:
+            envelope = router.decode_envelope(oversized if i % 2 else unknown)
+            if router.get(envelope.type) is None:
+                rejected += 1
+        except protocol.MessageRejected:
+            rejected += 1
+    report("rejected (size / unknown)", time.perf_counter() - start, N)
+    assert rejected == N
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# bench/bench_lobby_state.py
+
+"""
+大廳玩家狀態：dict vs. LobbyPlayer（msgspec Struct，slots）
+
+量兩件事（預設 10k 位玩家）：
+- 記憶體：tracemalloc 量整個 {user_id: 玩家} 的大小（每位玩家平均多少 bytes）
+- 完整 snapshot：新玩家 join 時把整個大廳切成 LOBBY_CHUNK_SIZE 一段、每段編成 JSON 的時間
+  - dict：改版前的 get_lobby_players（每次 sorted keys）+ json.dumps
+  - LobbyPlayer：dict 保持 join 順序直接取 values + encode_json（msgspec 在 C 裡直接走 Struct 欄位）
+
+另外量 pet_state_update / update_position 的改值（dict 要查 key，Struct 是 slot 存取）。
+
+執行方式：
+    python bench/bench_lobby_state.py [玩家數]
+"""
+
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ws-server"))
+
+from common.protocol import LobbyPlayer, encode_json  # noqa: E402
+
+PLAYERS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+LOBBY_CHUNK_SIZE = 100
+ROUNDS = 20
+
+
+def make_fields(user_id: int) -> dict:
+    return {
+        "user_id": user_id,
+        "display_name": f"Player{user_id}",
+        "pet_id": user_id,
+        "pet_name": "MyPet",
+        "energy": random.randint(0, 100),
+        "status": "ACTIVE",
+        "score": random.randint(0, 5000),
+        "x": random.uniform(0, 200),
+        "y": random.uniform(0, 200),
+    }
+
+
+def build_dicts(rows):
+    return {row["user_id"]: dict(row) for row in rows}
+
+
+def build_structs(rows):
+    return {row["user_id"]: LobbyPlayer(**row) for row in rows}
+
+
+def measure_memory(build, rows) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = build(rows)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+    return after - before
+
+
+def snapshot_dicts(store) -> int:
+    players = [store[uid] for uid in sorted(store.keys())]
+    size = 0
+    for start in range(0, len(players), LOBBY_CHUNK_SIZE):
+        chunk = players[start:start + LOBBY_CHUNK_SIZE]
+        size += len(json.dumps({
+            "type": "lobby_state", "server_id": "A", "user_id": 1,
+            "payload": {"players": chunk, "total": len(players), "has_more": True},
+        }, ensure_ascii=False))
+    return size
+
+
+def snapshot_structs(store) -> int:
+    players = list(store.values())
+    size = 0
+    for start in range(0, len(players), LOBBY_CHUNK_SIZE):
+        chunk = players[start:start + LOBBY_CHUNK_SIZE]
+        size += len(encode_json({
+            "type": "lobby_state", "server_id": "A", "user_id": 1,
+            "payload": {"players": chunk, "total": len(players), "has_more": True},
+        }))
+    return size
+
+
+def update_dicts(store, uids) -> None:
+    for uid in uids:
+        state = store.get(uid) or {}
+        state["x"] = state.get("x", 0.0) + 1.0
+        state["y"] = state.get("y", 0.0) + 1.0
+        state["energy"] = 50
+
+
+def update_structs(store, uids) -> None:
+    for uid in uids:
+        state = store.get(uid)
+        state.x = state.x + 1.0
+        state.y = state.y + 1.0
+        state.energy = 50
+
+
+def best_of(fn, *args, rounds: int = ROUNDS) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    random.seed(7)
+    rows = [make_fields(uid) for uid in random.sample(range(1, PLAYERS * 10), PLAYERS)]
+
+    dict_mem = measure_memory(build_dicts, rows)
+    struct_mem = measure_memory(build_structs, rows)
+
+    dicts = build_dicts(rows)
+    structs = build_structs(rows)
+    assert json.loads(encode_json(list(structs.values()))) == list(dicts.values())
+    uids = list(dicts.keys())
+
+    print(f"{PLAYERS:,} players, snapshot chunk {LOBBY_CHUNK_SIZE}")
+    print(f"{'':<14}{'memory':>12}{'B/player':>10}{'snapshot ms':>13}{'update us/player':>18}")
+    for name, mem, store, snap, update in (
+        ("dict", dict_mem, dicts, snapshot_dicts, update_dicts),
+        ("LobbyPlayer", struct_mem, structs, snapshot_structs, update_structs),
+    ):
+        snapshot_ms = best_of(snap, store) * 1000
+        update_us = best_of(update, store, uids) * 1e6 / len(uids)
+        print(
+            f"{name:<14}{mem / 1e6:>10.2f}MB{mem / PLAYERS:>10.0f}"
+            f"{snapshot_ms:>13.2f}{update_us:>18.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# bench/bench_logging.py
+
+"""
+比較 ws-server 舊的 print log 與新的 queue/抽樣 logging，在「呼叫端（event loop）」花的時間
+
+執行方式（stdout 導到 pipe，模擬 systemd / docker 收 log 的情況）：
+    python bench/bench_logging.py | cat > /dev/null
+
+結果印在 stderr。
+"""
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ws-server"))
+
+from common import logs  # noqa: E402
+
+N = 50_000
+
+STATE = {
+    "user_id": 42,
+    "display_name": "Player42",
+    "pet_id": 42,
+    "pet_name": "MyPet",
+    "energy": 80,
+    "status": "ACTIVE",
+    "score": 120,
+    "x": 101.5,
+    "y": 87.25,
+}
+
+
+def bench_print() -> float:
+    start = time.perf_counter()
+    for _ in range(N):
+        print(f"[wsA][PET_STATE_UPDATE] server=A, user_id=42, state={STATE}")
+    sys.stdout.flush()
+    return time.perf_counter() - start
+
+
+def bench_logger(log, level: int) -> float:
+    start = time.perf_counter()
+    for _ in range(N):
+        log(
+            "PET_STATE_UPDATE",
+            "server=%s, user_id=%s, energy=%s, status=%s, score=%s",
+            "A", 42, STATE["energy"], STATE["status"], STATE["score"],
+            level=level,
+        )
+    return time.perf_counter() - start
+
+
+def report(name: str, elapsed: float) -> None:
+    print(f"{name:<36} {elapsed * 1e6 / N:8.2f} us/call  ({N / elapsed:>12,.0f} calls/s)", file=sys.stderr)
+
+
+def main() -> None:
+    os.environ.setdefault("PET_LOG_LEVEL", "INFO")
+    report("before: print + f-string", bench_print())
+
+    log = logs.setup_logging("bench")
+    report("after: INFO, every record", bench_logger(log, logging.INFO))
+    drain_start = time.perf_counter()
+    logs.stop_logging()
+    report("  (background drain of the above)", time.perf_counter() - drain_start)
+
+    sampled = logs.setup_logging("bench", default_samples={"PET_STATE_UPDATE": 10})
+    report("after: INFO, sampled 1/10", bench_logger(sampled, logging.INFO))
+    report("after: DEBUG (gated off)", bench_logger(sampled, logging.DEBUG))
+    logs.stop_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# bench/bench_login_hashing.py
+
+"""
+登入潮壓測：scrypt 在 route thread 裡直接算 vs. 丟到 process pool
+
+FastAPI 的 sync route 都跑在同一個 threadpool（anyio 預設 40 條 thread）。
+模擬上課開始時 CONCURRENCY 個人同時登入，同時 Pi 每 10ms 打一次 /api/pet/update，兩者共用 SERVER_THREADS：
+- inline：scrypt 直接在 route thread 算，登入把 thread 全佔滿，Pi 的請求只能排在後面
+- pool：scrypt 在 process pool 算，同時在等的登入數有上限，超過的立刻回 SERVER_BUSY 把 thread 還回來，
+  client 等 Retry-After（加 jitter）再重試
+
+量：
+- 登入吞吐量（logins/s）與 p50 / p99 延遲（含被 SERVER_BUSY 退回後重試的時間）
+- 被拒絕（SERVER_BUSY）的次數
+- Pi 請求的 p99（從送出到處理完，含在 threadpool 排隊的時間）
+
+執行方式：
+    python bench/bench_login_hashing.py --logins 200 --concurrency 64 --target-p99-ms 5000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from app import passwords  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+SERVER_THREADS = 40  # anyio 預設 threadpool 大小
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def pi_update_route() -> None:
+    """/api/pet/update 的替身：一點點純 Python 工作"""
+    payload = {"user_id": 1, "pet_id": 1, "server_id": "A", "exercise_count": 3}
+    for _ in range(20):
+        json.loads(json.dumps(payload))
+
+
+class PiProbe(threading.Thread):
+    """每 10ms 丟一個 Pi 請求進 server threadpool，記錄送出到完成的時間"""
+
+    def __init__(self, server: ThreadPoolExecutor) -> None:
+        super().__init__(daemon=True)
+        self.server = server
+        self.samples = []
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            self.server.submit(pi_update_route).result()
+            self.samples.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+
+def run_storm(mode: str, stored: str, logins: int, concurrency: int) -> dict:
+    latencies = []
+    rejected = 0
+    lock = threading.Lock()
+    server = ThreadPoolExecutor(max_workers=SERVER_THREADS)
+
+    def login_route() -> bool:
+        if mode == "inline":
+            return passwords.verify_password_sync(PASSWORD, stored)
+        ok, _ = passwords.verify_and_upgrade(PASSWORD, stored)
+        return ok
+
+    def one_client(_: int) -> None:
+        nonlocal rejected
+        start = time.perf_counter()
+        while True:
+            try:
+                ok = server.submit(login_route).result()
+                break
+            except passwords.HashingBusy:
+                with lock:
+                    rejected += 1
+                time.sleep(random.uniform(0.05, 0.25))
+        assert ok
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    probe = PiProbe(server)
+    probe.start()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        list(clients.map(one_client, range(logins)))
+    wall = time.perf_counter() - wall_start
+    probe.stop_event.set()
+    probe.join()
+    server.shutdown()
+
+    return {
+        "mode": mode,
+        "logins_per_s": logins / wall,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rejected": rejected,
+        "probe_p99_ms": percentile(probe.samples, 99) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--target-p99-ms", type=float, default=5000.0)
+    args = parser.parse_args()
+
+    stored = passwords.hash_password_sync(PASSWORD)
+    # 先暖機：建立 pool、worker import 完成，不算進結果
+    passwords.verify_and_upgrade(PASSWORD, stored)
+
+    print(
+        f"scrypt n={passwords.SCRYPT_N} r={passwords.SCRYPT_R} p={passwords.SCRYPT_P}, "
+        f"workers={passwords.HASH_WORKERS}, max_inflight={passwords.HASH_MAX_INFLIGHT}, "
+        f"logins={args.logins}, concurrency={args.concurrency}"
+    )
+    for mode in ("inline", "pool"):
+        r = run_storm(mode, stored, args.logins, args.concurrency)
+        verdict = "PASS" if r["p99_ms"] <= args.target_p99_ms else "FAIL"
+        print(
+            f"{r['mode']:<7} {r['logins_per_s']:7.1f} logins/s  "
+            f"p50 {r['p50_ms']:8.1f} ms  p99 {r['p99_ms']:8.1f} ms ({verdict} @ {args.target_p99_ms:.0f})  "
+            f"busy {r['rejected']:5d}  pi update p99 {r['probe_p99_ms']:6.2f} ms"
+        )
+
+    passwords.shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# bench/bench_protocol.py
+
+"""
+JSON vs. 二進位子協定 pet.bin.v2：每則訊息大小與編解碼 CPU
+
+量三種最高頻的訊息：
+- update_position（client → server）
+- other_pet_moved（server → 大廳其他人，broadcast）
+- battle_update（雙向）
+
+CPU 的部分：
+- decode：server 收到一則 update_position / battle_update 解成 payload Struct 的時間
+- encode：server 送出 other_pet_moved / battle_update 的時間（broadcast 時每種格式只編碼一次）
+
+頻寬估算：大廳 PLAYERS 人、每人每秒 POSITION_HZ 次移動，other_pet_moved 要送給其他 PLAYERS - 1 人。
+這裡只算 WebSocket payload，不含 frame header（2~4 bytes，兩種格式一樣）與 TLS / TCP。
+
+執行方式：
+    python bench/bench_protocol.py
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ws-server"))
+
+from common import protocol  # noqa: E402
+
+N = 200_000
+PLAYERS = 200
+POSITION_HZ = 10
+
+BATTLE_ID = "12_57_1760000000000"
+
+INBOUND_JSON = {
+    "update_position": {
+        "type": "update_position", "server_id": "A", "user_id": 12,
+        "payload": {"x": 101.53125, "y": 42.25},
+    },
+    "battle_update": {
+        "type": "battle_update", "server_id": "A", "user_id": 12,
+        "payload": {"battle_id": BATTLE_ID, "score": 37, "state": "running"},
+    },
+}
+INBOUND_BINARY = {
+    "update_position": protocol._POSITION_IN.pack(protocol.OP_UPDATE_POSITION, 101.53125, 42.25),
+    "battle_update": protocol._BATTLE_UPDATE_IN.pack(protocol.OP_BATTLE_UPDATE, 37, 1) + BATTLE_ID.encode(),
+}
+OUTBOUND = {
+    "other_pet_moved": {
+        "type": "other_pet_moved", "server_id": "A", "user_id": 12,
+        "payload": {"player": {"user_id": 12, "x": 101.53125, "y": 42.25, "ts": 3_210_987_654}},
+    },
+    "battle_update": {
+        "type": "battle_update", "server_id": "A", "user_id": 12,
+        "payload": {"battle_id": BATTLE_ID, "user_id": 12, "score": 37, "state": "running"},
+    },
+}
+
+
+async def _noop(server_id, user_id, payload) -> None:
+    return None
+
+
+def timeit(fn, n: int = N) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) * 1e6 / n
+
+
+def main() -> None:
+    router = protocol.MessageRouter()
+    router.on("update_position", protocol.PositionPayload)(_noop)
+    router.on("battle_update", protocol.BattleUpdatePayload)(_noop)
+
+    print(f"{'message':<28}{'json B':>8}{'bin B':>8}{'json us':>10}{'bin us':>9}")
+
+    for msg_type, msg in INBOUND_JSON.items():
+        text = json.dumps(msg, ensure_ascii=False)
+        data = INBOUND_BINARY[msg_type]
+        assert protocol.decode_binary(data)[1] == router.get(msg_type).decode(router.decode_envelope(text).payload)
+
+        def decode_json(text=text):
+            envelope = router.decode_envelope(text)
+            router.get(envelope.type).decode(envelope.payload)
+
+        def decode_bin(data=data):
+            protocol.decode_binary(data)
+
+        print(
+            f"{'in  ' + msg_type:<28}{len(text.encode()):>8}{len(data):>8}"
+            f"{timeit(decode_json):>10.2f}{timeit(decode_bin):>9.2f}"
+        )
+
+    sizes = {}
+    for msg_type, msg in OUTBOUND.items():
+        text = json.dumps(msg, ensure_ascii=False)
+        data = protocol.encode_binary(msg)
+        sizes[msg_type] = (len(text.encode()), len(data))
+        print(
+            f"{'out ' + msg_type:<28}{len(text.encode()):>8}{len(data):>8}"
+            f"{timeit(lambda: json.dumps(msg, ensure_ascii=False)):>10.2f}"
+            f"{timeit(lambda: protocol.encode_binary(msg)):>9.2f}"
+        )
+
+    json_size, bin_size = sizes["other_pet_moved"]
+    per_second = PLAYERS * POSITION_HZ * (PLAYERS - 1)
+    print()
+    print(
+        f"lobby {PLAYERS} players @ {POSITION_HZ} Hz: other_pet_moved {per_second:,} msgs/s out, "
+        f"json {json_size * per_second / 1e6:.1f} MB/s vs binary {bin_size * per_second / 1e6:.1f} MB/s "
+        f"({json_size / bin_size:.1f}x)"
+    )
+
+    # broadcast 以前每個收件者都 json.dumps 一次；現在每種格式只編碼一次
+    msg = OUTBOUND["other_pet_moved"]
+    per_recipient = timeit(lambda: [json.dumps(msg, ensure_ascii=False) for _ in range(PLAYERS - 1)], N // 1000)
+    once = timeit(lambda: json.dumps(msg, ensure_ascii=False)) + timeit(lambda: protocol.encode_binary(msg))
+    print(
+        f"broadcast encode to {PLAYERS - 1}: per-recipient json.dumps {per_recipient:,.0f} us, "
+        f"encode-once (json + binary) {once:.2f} us"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,574 @@
+# bench/ws_load.py
+
+"""
+ws-server 壓力測試：一台 shard 撐得住多少玩家
+
+預設自己在本機起一台 wsA（uvicorn，WS_DATABASE_URL="" 不需要 DB），再開幾千個 asyncio client 連 /ws/：
+- 每個 client：join_lobby → 持續 update_position（預設 10 Hz，跟前端一樣的速度隨機走）
+- 一部分配對聊天：chat_request → chat_request_accept → 每 CHAT_INTERVAL 秒互傳 chat_message
+- 一部分配對對戰，整個流程跑完再重來：
+  battle_invite → battle_accept → battle_start → battle_ready ×2 → battle_go
+  → battle_update ×BATTLE_UPDATES → battle_result
+client 依速率（--ramp 個/秒）陸續連上，分散在 --procs 個 process（client 端的 CPU 不要先成為瓶頸）。
+
+回報：
+- 每秒一行：已連線數、client 收發訊息數、server CPU% / RSS（讀 /proc，所以只支援 Linux）、server 自己回報的 loop lag
+- 容量：最多同時在線幾人、連線失敗數；loop lag 第一次超過 --max-lag-ms（跟 backend placement 視同已滿的門檻一樣）時有幾人在線
+- 延遲（p50 / p90 / p99 / max，ms）：
+  - join：連線到收到 lobby_state
+  - position：A 送出 update_position → 同一個 process 裡的其他 client 收到 other_pet_moved
+  - chat：chat_message 送出 → 對方收到
+  - battle_update：送出 → 對手收到
+  - battle：battle_invite → 雙方收到 battle_result
+
+大廳的 other_pet_moved 是廣播給全部人（N 人 × N-1 × position Hz），人數一多 server 的出站量是平方成長，
+先看 server CPU 與 loop lag，client 端跟不上時加 --procs。
+
+執行方式：
+    python bench/ws_load.py --clients 500 --duration 60
+    python bench/ws_load.py --url ws://127.0.0.1:8001 --pid 12345   # 打已經在跑的 shard（token 密鑰要一樣）
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import secrets
+import struct
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ws-server"))
+
+import websockets  # noqa: E402
+
+# client 自己簽 token，起的 wsA 繼承同一組環境變數：沒設定時用這次跑 bench 才有的隨機密鑰
+os.environ.setdefault("PET_TOKEN_SECRET", secrets.token_urlsafe(32))
+os.environ.setdefault("PET_INTERNAL_TOKEN", secrets.token_urlsafe(32))
+
+from common.auth import issue_token  # noqa: E402
+
+WS_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ws-server")
+
+WORLD_SIZE = 200.0
+# 比前端（60 units/s）慢一點，不會被 server 的速度檢查修正
+MOVE_SPEED = 50.0
+CHAT_INTERVAL = 2.0
+BATTLE_UPDATES = 10
+BATTLE_UPDATE_INTERVAL = 0.5
+BATTLE_PAUSE = 1.0
+SAMPLES_PER_METRIC = 50_000
+LATENCY_METRICS = ("join", "position", "chat", "battle_update", "battle")
+
+# pet.bin.v2（同 common/protocol.py）
+SUBPROTOCOL_BINARY = "pet.bin.v2"
+SUBPROTOCOL_JSON = "pet.json.v1"
+_POSITION_IN = struct.Struct("<Bff")
+_BATTLE_UPDATE_IN = struct.Struct("<BiB")
+_PET_MOVED_OUT = struct.Struct("<BIffI")
+_BATTLE_UPDATE_OUT = struct.Struct("<BIiB")
+OP_UPDATE_POSITION = 0x01
+OP_BATTLE_UPDATE = 0x02
+OP_OTHER_PET_MOVED = 0x81
+OP_BATTLE_UPDATE_OUT = 0x82
+BATTLE_STATES = ("waiting", "running", "finished")
+
+
+class Reservoir:
+    """固定大小的隨機抽樣（收到幾百萬則 other_pet_moved 也不會吃光記憶體）"""
+
+    def __init__(self, size: int = SAMPLES_PER_METRIC) -> None:
+        self.size = size
+        self.count = 0
+        self.samples: List[float] = []
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            i = random.randrange(self.count)
+            if i < self.size:
+                self.samples[i] = value
+
+
+class Worker:
+    """一個 process 裡的所有 client 共用：統計、各 client 最近送出的位置（算 position 延遲用）"""
+
+    def __init__(self, args, live) -> None:
+        self.args = args
+        self.live = live
+        self.latency = {name: Reservoir() for name in LATENCY_METRICS}
+        self.counters: Dict[str, int] = {}
+        # user_id → {(x, y): 送出時間}，只留最近幾筆
+        self.sent_positions: Dict[int, Dict[tuple, float]] = {}
+        # (user_id, score) → battle_update 送出時間
+        self.battle_sent: Dict[tuple, float] = {}
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+
+class SimClient:
+    def __init__(self, worker: Worker, user_id: int, role: str, peer_id: Optional[int], leader: bool) -> None:
+        self.worker = worker
+        self.args = worker.args
+        self.user_id = user_id
+        self.role = role
+        self.peer_id = peer_id
+        self.leader = leader
+        self.peer: Optional["SimClient"] = None
+        self.ws = None
+        self.binary = False
+        self.joined = asyncio.Event()
+        self.deadline = 0.0
+        self.tasks: List[asyncio.Task] = []
+        self.battle_id: Optional[str] = None
+        self.battle_started_at = 0.0
+        self.x = random.uniform(0, WORLD_SIZE)
+        self.y = random.uniform(0, WORLD_SIZE)
+        self.heading = random.uniform(0, 2 * math.pi)
+
+    # ------------------ 送 ------------------ #
+    async def send(self, msg_type: str, payload: dict) -> None:
+        await self.ws.send(json.dumps({
+            "type": msg_type,
+            "server_id": "A",
+            "user_id": self.user_id,
+            "payload": payload,
+        }))
+        self.worker.live["sent"].value += 1
+
+    async def send_position(self) -> None:
+        if self.binary:
+            await self.ws.send(_POSITION_IN.pack(OP_UPDATE_POSITION, self.x, self.y))
+            self.worker.live["sent"].value += 1
+        else:
+            await self.send("update_position", {"x": self.x, "y": self.y})
+
+    async def send_battle_update(self, score: int, state: str) -> None:
+        self.worker.battle_sent[(self.user_id, score)] = time.perf_counter()
+        if self.binary:
+            await self.ws.send(
+                _BATTLE_UPDATE_IN.pack(OP_BATTLE_UPDATE, score, BATTLE_STATES.index(state)) + self.battle_id.encode()
+            )
+            self.worker.live["sent"].value += 1
+        else:
+            await self.send("battle_update", {"battle_id": self.battle_id, "score": score, "state": state})
+
+    # ------------------ 主流程 ------------------ #
+    async def run(self, deadline: float) -> None:
+        self.deadline = deadline
+        worker = self.worker
+        url = f"{self.args.url}/ws/?token={issue_token(self.user_id, 'A')}"
+        protocols = [SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON] if self.args.binary else [SUBPROTOCOL_JSON]
+        started = time.perf_counter()
+        try:
+            self.ws = await websockets.connect(
+                url, subprotocols=protocols, open_timeout=30, max_queue=None, ping_interval=None,
+            )
+        except Exception as e:  # noqa: BLE001
+            worker.count(f"connect_error:{type(e).__name__}")
+            return
+        self.binary = self.ws.subprotocol == SUBPROTOCOL_BINARY
+        worker.live["connected"].value += 1
+        try:
+            await self.send("join_lobby", {
+                "display_name": f"Load{self.user_id}",
+                "pet_id": self.user_id,
+                "pet_name": "LoadPet",
+                "energy": 100,
+                "status": "ACTIVE",
+                "score": 0,
+                "x": round(self.x, 2),
+                "y": round(self.y, 2),
+            })
+            reader = asyncio.create_task(self.reader(started))
+            try:
+                await asyncio.wait_for(self.joined.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                worker.count("join_timeout")
+                reader.cancel()
+                return
+            self.tasks.append(asyncio.create_task(self.position_loop()))
+            if self.leader and self.role in ("chat", "battle"):
+                self.tasks.append(asyncio.create_task(self.start_pair()))
+            await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+            reader.cancel()
+        except websockets.ConnectionClosed as e:
+            worker.count(f"closed:{e.rcvd.code if e.rcvd else 'none'}")
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            worker.live["connected"].value -= 1
+            await self.ws.close()
+
+    async def position_loop(self) -> None:
+        interval = 1.0 / self.args.position_hz
+        step = MOVE_SPEED * interval
+        await asyncio.sleep(random.uniform(0, interval))
+        sent = self.worker.sent_positions.setdefault(self.user_id, {})
+        while True:
+            if random.random() < 0.05:
+                self.heading = random.uniform(0, 2 * math.pi)
+            nx = self.x + math.cos(self.heading) * step
+            ny = self.y + math.sin(self.heading) * step
+            if not (0 <= nx <= WORLD_SIZE and 0 <= ny <= WORLD_SIZE):
+                self.heading += math.pi
+                continue
+            # 取到小數 2 位：JSON / float32 回來的值都能對得上
+            self.x, self.y = round(nx, 2), round(ny, 2)
+            sent[(self.x, self.y)] = time.perf_counter()
+            if len(sent) > 32:
+                del sent[next(iter(sent))]
+            await self.send_position()
+            await asyncio.sleep(interval)
+
+    async def start_pair(self) -> None:
+        # 對方還沒 join 時邀請會被拒（TARGET_OFFLINE）
+        await self.peer.joined.wait()
+        if self.role == "chat":
+            await self.send("chat_request", {"to_user_id": self.peer_id})
+        else:
+            await self.start_battle()
+
+    async def chat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(CHAT_INTERVAL * random.uniform(0.8, 1.2))
+            await self.send("chat_message", {"to_user_id": self.peer_id, "content": repr(time.perf_counter())})
+
+    async def start_battle(self, delay: float = 0.0) -> None:
+        await asyncio.sleep(delay)
+        self.battle_started_at = time.perf_counter()
+        await self.send("battle_invite", {"to_user_id": self.peer_id})
+
+    async def battle_loop(self) -> None:
+        for score in range(1, BATTLE_UPDATES + 1):
+            await asyncio.sleep(BATTLE_UPDATE_INTERVAL)
+            await self.send_battle_update(score, "running")
+        if self.leader:
+            await self.send("battle_result", {"battle_id": self.battle_id})
+
+    # ------------------ 收 ------------------ #
+    async def reader(self, started: float) -> None:
+        worker = self.worker
+        received = worker.live["received"]
+        try:
+            async for frame in self.ws:
+                received.value += 1
+                now = time.perf_counter()
+                if isinstance(frame, bytes):
+                    self.on_binary(frame, now)
+                else:
+                    await self.on_message(json.loads(frame), now, started)
+        except websockets.ConnectionClosed as e:
+            worker.count(f"closed:{e.rcvd.code if e.rcvd else 'none'}")
+
+    def on_binary(self, frame: bytes, now: float) -> None:
+        op = frame[0]
+        if op == OP_OTHER_PET_MOVED:
+            _, uid, x, y, _ = _PET_MOVED_OUT.unpack_from(frame)
+            self.on_moved(uid, x, y, now)
+        elif op == OP_BATTLE_UPDATE_OUT:
+            _, uid, score, _ = _BATTLE_UPDATE_OUT.unpack_from(frame)
+            self.on_battle_update(uid, score, now)
+        else:
+            self.worker.count(f"binary_op:{op:#x}")
+
+    def on_moved(self, uid: int, x: float, y: float, now: float) -> None:
+        sent = self.worker.sent_positions.get(uid)
+        if sent is None:
+            return
+        sent_at = sent.get((round(x, 2), round(y, 2)))
+        if sent_at is not None:
+            self.worker.latency["position"].add(now - sent_at)
+
+    def on_battle_update(self, uid: int, score: int, now: float) -> None:
+        if uid == self.user_id:
+            return
+        sent_at = self.worker.battle_sent.pop((uid, score), None)
+        if sent_at is not None:
+            self.worker.latency["battle_update"].add(now - sent_at)
+
+    async def on_message(self, msg: dict, now: float, started: float) -> None:
+        worker = self.worker
+        msg_type = msg.get("type")
+        payload = msg.get("payload") or {}
+        if msg_type == "other_pet_moved":
+            player = payload.get("player") or {}
+            self.on_moved(player.get("user_id"), player.get("x", 0.0), player.get("y", 0.0), now)
+        elif msg_type == "lobby_state":
+            if not self.joined.is_set():
+                worker.latency["join"].add(now - started)
+                self.joined.set()
+        elif msg_type == "chat_request":
+            await self.send("chat_request_accept", {"from_user_id": payload.get("from_user_id")})
+        elif msg_type == "chat_approved":
+            worker.count("chat_approved")
+            self.tasks.append(asyncio.create_task(self.chat_loop()))
+        elif msg_type == "chat_message":
+            worker.count("chat_message")
+            worker.latency["chat"].add(now - float(payload.get("content") or now))
+        elif msg_type == "battle_invite":
+            await self.send("battle_accept", {"from_user_id": payload.get("from_user_id")})
+        elif msg_type == "battle_start":
+            self.battle_id = payload.get("battle_id")
+            await self.send("battle_ready", {"battle_id": self.battle_id})
+        elif msg_type == "battle_go":
+            self.tasks.append(asyncio.create_task(self.battle_loop()))
+        elif msg_type == "battle_update":
+            self.on_battle_update(payload.get("user_id"), payload.get("score"), now)
+        elif msg_type == "battle_result":
+            if self.leader:
+                worker.count("battle_completed")
+                worker.latency["battle"].add(now - self.battle_started_at)
+                if now + BATTLE_PAUSE + BATTLE_UPDATES * BATTLE_UPDATE_INTERVAL + 5 < self.deadline:
+                    self.tasks.append(asyncio.create_task(self.start_battle(BATTLE_PAUSE)))
+        elif msg_type in ("chat_not_allowed", "battle_not_allowed", "position_corrected", "error"):
+            worker.count(msg_type)
+
+
+def assign_roles(args, user_ids: List[int]) -> List[tuple]:
+    """相鄰兩個 user_id 一組：依比例分成 chat / battle / 只走路；同一組一定在同一個 process"""
+    rng = random.Random(args.seed)
+    roles = []
+    for i in range(0, len(user_ids) - 1, 2):
+        pick = rng.random()
+        role = "chat" if pick < args.chat_fraction else (
+            "battle" if pick < args.chat_fraction + args.battle_fraction else "walk"
+        )
+        a, b = user_ids[i], user_ids[i + 1]
+        roles.append((a, role, b, True))
+        roles.append((b, role, a, False))
+    if len(user_ids) % 2:
+        roles.append((user_ids[-1], "walk", None, False))
+    return roles
+
+
+async def worker_main(args, live, user_ids: List[int], start_at: float, deadline: float, results) -> None:
+    worker = Worker(args, live)
+    clients = [SimClient(worker, *role) for role in assign_roles(args, user_ids)]
+    by_id = {client.user_id: client for client in clients}
+    for client in clients:
+        if client.peer_id is not None:
+            client.peer = by_id[client.peer_id]
+    interval = args.procs / args.ramp
+    tasks = []
+    for i, client in enumerate(clients):
+        delay = start_at + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(client.run(deadline)))
+    await asyncio.gather(*tasks, return_exceptions=True)
+    results.put({
+        "counters": worker.counters,
+        "latency": {name: (r.count, r.samples) for name, r in worker.latency.items()},
+    })
+
+
+def run_worker(args, live, user_ids, start_at, deadline, results) -> None:
+    asyncio.run(worker_main(args, live, user_ids, start_at, deadline, results))
+
+
+# ------------------ server 端監控 ------------------ #
+def read_proc(pid: int) -> tuple:
+    """(累計 CPU 秒數, RSS MB)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    return cpu, rss / 1024
+
+
+def read_health(http_url: str) -> dict:
+    try:
+        with urllib.request.urlopen(f"{http_url}/", timeout=1) as resp:
+            return json.loads(resp.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def start_server(port: int) -> subprocess.Popen:
+    env = dict(os.environ, WS_DATABASE_URL="", PET_LOG_LEVEL=os.environ.get("PET_LOG_LEVEL", "WARNING"))
+    proc = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=os.path.join(WS_ROOT, "wsA"),
+        env=env,
+    )
+    for _ in range(100):
+        if read_health(f"http://127.0.0.1:{port}"):
+            return proc
+        time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("ws-server 沒有起來")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    k = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def raise_fd_limit() -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=60.0, help="從第一個 client 連線開始算（秒）")
+    parser.add_argument("--ramp", type=float, default=100.0, help="每秒新增幾個連線")
+    parser.add_argument("--procs", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--position-hz", type=float, default=10.0)
+    parser.add_argument("--chat-fraction", type=float, default=0.2)
+    parser.add_argument("--battle-fraction", type=float, default=0.2)
+    parser.add_argument("--json", dest="binary", action="store_false", help="只用 JSON（預設協商 pet.bin.v2，跟瀏覽器一樣）")
+    parser.add_argument("--url", default=None, help="打已經在跑的 shard，例如 ws://127.0.0.1:8001")
+    parser.add_argument("--pid", type=int, default=None, help="--url 那台的 pid（量 CPU / RSS）")
+    parser.add_argument("--port", type=int, default=8011, help="自己起 server 時用的 port")
+    parser.add_argument("--user-base", type=int, default=1_000_000, help="模擬玩家的 user_id 從這裡開始")
+    parser.add_argument("--max-lag-ms", type=float, default=250.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default=None, help="結果另外寫成 JSON")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    server = None
+    if args.url is None:
+        server = start_server(args.port)
+        args.url = f"ws://127.0.0.1:{args.port}"
+        pid = server.pid
+    else:
+        pid = args.pid
+    http_url = args.url.replace("ws://", "http://").replace("wss://", "https://")
+
+    args.procs = max(1, min(args.procs, args.clients))
+    user_ids = list(range(args.user_base, args.user_base + args.clients))
+    # 每個 process 拿連續的一段（配對的兩人一定在同一個 process）
+    per_proc = math.ceil(args.clients / args.procs / 2) * 2
+    start_at = time.perf_counter() + 1.0
+    deadline = start_at + args.duration
+    results = multiprocessing.Queue()
+    lives = []
+    procs = []
+    for i in range(args.procs):
+        chunk = user_ids[i * per_proc:(i + 1) * per_proc]
+        if not chunk:
+            continue
+        live = {name: multiprocessing.RawValue("q", 0) for name in ("connected", "received", "sent")}
+        lives.append(live)
+        proc = multiprocessing.Process(target=run_worker, args=(args, live, chunk, start_at, deadline, results))
+        proc.start()
+        procs.append(proc)
+
+    print(
+        f"{args.clients} clients on {len(procs)} procs, ramp {args.ramp:g}/s, "
+        f"position {args.position_hz:g} Hz, {'binary' if args.binary else 'json'}, target {args.url}"
+    )
+    print(f"{'t':>5}{'connected':>11}{'in/s':>11}{'out/s':>9}{'cpu%':>8}{'rss MB':>9}{'lag ms':>9}")
+    peak = 0
+    saturated_at = None
+    timeline = []
+    last = (time.perf_counter(), 0, 0, read_proc(pid)[0] if pid else 0.0)
+    collected = []
+    try:
+        # 子 process 要等 Queue 裡的結果被讀走才會結束：邊監控邊收
+        while len(collected) < len(procs):
+            time.sleep(1.0)
+            while True:
+                try:
+                    collected.append(results.get_nowait())
+                except queue.Empty:
+                    break
+            if not any(proc.is_alive() for proc in procs) and results.empty():
+                break
+            now = time.perf_counter()
+            connected = sum(live["connected"].value for live in lives)
+            received = sum(live["received"].value for live in lives)
+            sent = sum(live["sent"].value for live in lives)
+            cpu, rss = read_proc(pid) if pid else (0.0, 0.0)
+            lag = read_health(http_url).get("loop_lag_ms", float("nan"))
+            elapsed = now - last[0]
+            row = {
+                "t": round(now - start_at, 1),
+                "connected": connected,
+                "in_per_s": round((received - last[1]) / elapsed),
+                "out_per_s": round((sent - last[2]) / elapsed),
+                "cpu_pct": round((cpu - last[3]) / elapsed * 100, 1),
+                "rss_mb": round(rss, 1),
+                "loop_lag_ms": lag,
+            }
+            timeline.append(row)
+            print(
+                f"{row['t']:>5.0f}{connected:>11}{row['in_per_s']:>11,}{row['out_per_s']:>9,}"
+                f"{row['cpu_pct']:>8.1f}{rss:>9.1f}{lag:>9.1f}"
+            )
+            peak = max(peak, connected)
+            if saturated_at is None and lag > args.max_lag_ms:
+                saturated_at = connected
+            last = (now, received, sent, cpu)
+    finally:
+        for proc in procs:
+            proc.join()
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+
+    counters: Dict[str, int] = {}
+    latency: Dict[str, List[float]] = {name: [] for name in LATENCY_METRICS}
+    totals = {name: 0 for name in LATENCY_METRICS}
+    for result in collected:
+        for name, value in result["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+        for name, (count, samples) in result["latency"].items():
+            totals[name] += count
+            latency[name].extend(samples)
+
+    print()
+    print(f"peak connected: {peak} / {args.clients}")
+    print(
+        "saturation (loop lag > %g ms): %s" % (
+            args.max_lag_ms, f"at {saturated_at} connected" if saturated_at is not None else "not reached",
+        )
+    )
+    print(f"{'latency ms':<16}{'count':>12}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    summary = {}
+    for name in LATENCY_METRICS:
+        values = sorted(v * 1000 for v in latency[name])
+        stats = {p: percentile(values, p) for p in (50, 90, 99, 100)}
+        summary[name] = {"count": totals[name], **{f"p{p}": round(v, 2) for p, v in stats.items()}}
+        print(
+            f"{name:<16}{totals[name]:>12,}{stats[50]:>9.1f}{stats[90]:>9.1f}{stats[99]:>9.1f}{stats[100]:>9.1f}"
+        )
+    if counters:
+        print("counters:", ", ".join(f"{k}={v}" for k, v in sorted(counters.items())))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "args": vars(args),
+                "peak_connected": peak,
+                "saturated_at": saturated_at,
+                "latency_ms": summary,
+                "counters": counters,
+                "timeline": timeline,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -37,14 +37,32 @@ if project_root not in sys.path:
 ... (略) ...
 """
 
+import logging
+import time
+
 # 現在，Python 就能找到 app.main 模組了！
-from app.main import SessionLocal, Pet, energy_to_status
+from app.main import SessionLocal, Pet, energy_to_status, notify_pets_invalidated, DECAY_JOB_SECONDS
+from app.metrics import REGISTRY
+
+# 若有設定，執行完把指標寫成 node_exporter textfile（cron 程序是短命的，抓不到 /metrics）
+METRICS_TEXTFILE = os.environ.get("PET_METRICS_TEXTFILE")
+
+# 每隻寵物的變化是 DEBUG；平常只印總結（PET_LOG_LEVEL=DEBUG 可打開逐筆紀錄）
+logging.basicConfig(
+    level=os.environ.get("PET_LOG_LEVEL", "INFO").upper(),
+    format="[CRON][%(levelname)s] %(message)s",
+)
+logger = logging.getLogger("pet.cron.energy_decay")
+
 
 def run_energy_decay():
+    start = time.perf_counter()
     db = SessionLocal()
     try:
         pets = db.query(Pet).all()
-        print(f"[CRON] 找到 {len(pets)} 隻寵物，開始更新體力 ...")
+        logger.info("找到 %d 隻寵物，開始更新體力 ...", len(pets))
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        changed = 0
 
         for pet in pets:
             old_energy = pet.energy
@@ -53,26 +71,36 @@ def run_energy_decay():
             if new_energy != old_energy:
                 pet.energy = new_energy
                 pet.status = energy_to_status(new_energy)
+                changed += 1
 
                 # 🔻 從 >0 掉到 0 → score -1
                 if old_energy > 0 and new_energy == 0:
                     pet.score -= 1
-                    print(
-                        f"[CRON] pet_id={pet.pet_id} {old_energy}->{new_energy}, score-1 => {pet.score}"
-                    )
-                else:
-                    print(
-                        f"[CRON] pet_id={pet.pet_id} {old_energy}->{new_energy}, score={pet.score}"
+                    if debug_enabled:
+                        logger.debug(
+                            "pet_id=%s %s->%s, score-1 => %s",
+                            pet.pet_id, old_energy, new_energy, pet.score,
+                        )
+                elif debug_enabled:
+                    logger.debug(
+                        "pet_id=%s %s->%s, score=%s",
+                        pet.pet_id, old_energy, new_energy, pet.score,
                     )
 
+        # 通知 ws-server 大廳重新載入（跟著同一個 transaction，commit 後才送出）
+        if changed:
+            notify_pets_invalidated(db, source="decay")
         db.commit()
-        print("[CRON] 體力更新完成，已寫入資料庫。")
+        logger.info("體力更新完成，%d 隻寵物有變化，已寫入資料庫。", changed)
 
-    except Exception as exc:
+    except Exception:
         db.rollback()
-        print("[CRON][ERROR] 體力更新失敗：", exc)
+        logger.exception("體力更新失敗")
     finally:
         db.close()
+        DECAY_JOB_SECONDS.observe(time.perf_counter() - start)
+        if METRICS_TEXTFILE:
+            REGISTRY.write_textfile(METRICS_TEXTFILE)
 
 
 if __name__ == "__main__":
@@ -14,14 +14,23 @@
 - Cron 整合 DB 排行並寫回 leaderboard table
 """
 
+import logging
+import os
+
 from app.main import SessionLocal, User, Pet, Leaderboard
 
+logging.basicConfig(
+    level=os.environ.get("PET_LOG_LEVEL", "INFO").upper(),
+    format="[CRON][%(levelname)s] %(message)s",
+)
+logger = logging.getLogger("pet.cron.update_leaderboard")
+
 
 SERVER_IDS = ["A", "B", "C"]
 
 
 def update_leaderboard_for_server(db, server_id: str):
-    print(f"[CRON] 更新伺服器 {server_id} 的排行榜 ...")
+    logger.info("更新伺服器 %s 的排行榜 ...", server_id)
 
     # 1. 找出該 server 的所有玩家 + score
     rows = (
@@ -35,7 +44,8 @@ def update_leaderboard_for_server(db, server_id: str):
     # 2. 清空該 server 原本的 leaderboard
     db.query(Leaderboard).filter(Leaderboard.server_id == server_id).delete()
 
-    # 3. 重新寫入排行資料
+    # 3. 重新寫入排行資料（逐筆紀錄只在 DEBUG 才印）
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
     for idx, row in enumerate(rows, start=1):
         lb = Leaderboard(
             user_id=row.user_id,
@@ -44,9 +54,12 @@ def update_leaderboard_for_server(db, server_id: str):
             rank=idx,
         )
         db.add(lb)
-        print(
-            f"[CRON] server={server_id} rank={idx} user_id={row.user_id} score={row.score}"
-        )
+        if debug_enabled:
+            logger.debug(
+                "server=%s rank=%s user_id=%s score=%s",
+                server_id, idx, row.user_id, row.score,
+            )
+    logger.info("伺服器 %s 共 %d 名玩家寫入排行榜", server_id, len(rows))
 
 
 def run_update_leaderboard():
@@ -55,10 +68,10 @@ def run_update_leaderboard():
         for sid in SERVER_IDS:
             update_leaderboard_for_server(db, sid)
         db.commit()
-        print("[CRON] 所有伺服器排行榜更新完成。")
-    except Exception as exc:
+        logger.info("所有伺服器排行榜更新完成。")
+    except Exception:
         db.rollback()
-        print("[CRON][ERROR] 更新排行榜失敗：", exc)
+        logger.exception("更新排行榜失敗")
     finally:
         db.close()
 
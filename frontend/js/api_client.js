@@ -6,6 +6,14 @@
 // 統一的基礎 URL，用於處理 Nginx 反向代理
 const BASE_URL = window.location.origin;
 
+// 還沒選伺服器也能呼叫的 API（不加 /serverX 前綴）
+const NO_SERVER_ENDPOINTS = [
+    '/api/register',
+    '/api/login',
+    '/api/servers',
+    '/api/user/switch_server',
+];
+
 /**
  * 統一處理所有 REST API 請求
  * @param {string} endpoint - 應用程式內部的 API 路徑 (例如: /api/login)
@@ -17,8 +25,8 @@ async function callApi(endpoint, method = 'GET', data = null) {
     const server_id = localStorage.getItem('selected_server_id');
     const token = localStorage.getItem('user_token');
     
-    // 登入 / 註冊 以外的 API，都需要先選好伺服器
-    if (!server_id && endpoint !== '/api/register' && endpoint !== '/api/login') {
+    // 登入 / 註冊 / 伺服器選擇頁用到的 API 以外，都需要先選好伺服器
+    if (!server_id && !NO_SERVER_ENDPOINTS.includes(endpoint)) {
         throw new Error("SERVER_NOT_SELECTED: 請先選擇伺服器。");
     }
 
@@ -82,6 +90,19 @@ export async function register(username, password, display_name) {
     });
 }
 
+// 各伺服器即時負載（連線數 / 容量 / 是否推薦），伺服器選擇頁用
+export async function getServers() {
+    return callApi('/api/servers', 'GET');
+}
+
+// 換伺服器：後端依各 shard 即時連線數檢查容量，成功會回傳新的 token（ws 連線要用新 token）
+// serverId 不給就由後端挑最空的一台
+export async function switchServer(serverId = null) {
+    return callApi('/api/user/switch_server', 'POST', {
+        server_id: serverId,
+    });
+}
+
 // 取得寵物狀態（大廳＆遊戲用）
 // ⭐⭐ 這裡是重點修改處：會帶 user_id 當 query string ⭐⭐
 export async function getPetStatus(userId = null) {
@@ -344,7 +344,8 @@ function getOrCreateOtherPet(userId, displayName, initialX, initialY) {
     wrapper.appendChild(nameTag);
     wrapper.addEventListener('click', handlePetClick);
     worldLayerEl.appendChild(wrapper);
-    otherPets[userId] = { el: wrapper, x: initialX, y: initialY, display_name: displayName };
+    // snapshots：server 送來的 { t, x, y }（t 已換成本地 performance.now() 時間軸），renderOtherPets 用來插值
+    otherPets[userId] = { el: wrapper, x: initialX, y: initialY, display_name: displayName, snapshots: [] };
     return wrapper;
 }
 
@@ -438,7 +439,27 @@ actionBattleBtn.addEventListener('click', () => {
     }); 
 });
 
-const MOVE_SPEED = 1;
+// 移動速度改成以時間計（world units / 秒），不再是「每個 frame 走 1」，高更新率螢幕不會跑比較快
+// server 端上限是 WS_MAX_MOVE_SPEED（預設 90），超過會被拉回
+const MOVE_SPEED = 60;
+// 一個 frame 最多算多久（分頁切回來時 dt 會很大，不要一次瞬移）
+const MAX_FRAME_DT_MS = 100;
+// 移動中每 100ms 回報一次位置（以前是每個 frame 都送，60Hz 螢幕 = 每秒 60 則）
+const POSITION_SEND_INTERVAL_MS = 100;
+// 兩則 update_position 至少隔這麼久（server 會丟掉太密的），停下來那一則會延後補送
+const POSITION_MIN_GAP_MS = 50;
+// 其他玩家畫在「現在 - 150ms」的位置，前後兩個 snapshot 之間內插，網路抖動時看起來也是平滑移動
+const INTERP_DELAY_MS = 150;
+// 超過這麼久沒收到某人的移動，下次移動從他目前畫面上的位置重新開始內插
+const SNAPSHOT_STALE_MS = 1000;
+const MAX_SNAPSHOTS = 20;
+
+let lastFrameAt = null;
+let lastDirection = 'idle';
+let lastSentAt = -Infinity;
+let lastSentX = null;
+let lastSentY = null;
+let positionSendTimer = null;
 document.addEventListener('keydown', (e) => { 
     if (globalModalOverlay.style.display === 'flex' || chatBox.style.display === 'flex') return; 
     if (e.key in keysPressed) { keysPressed[e.key] = true; e.preventDefault(); } 
@@ -447,15 +468,40 @@ document.addEventListener('keyup', (e) => {
     if (e.key in keysPressed) { keysPressed[e.key] = false; e.preventDefault(); } 
 });
 
-function updateMovement() {
+// 送出目前位置；離上一則太近就延後到 POSITION_MIN_GAP_MS 之後（只保留一個計時器，送的是當下最新位置）
+function sendPosition() {
+    if (positionSendTimer) return;
+    const now = performance.now();
+    const wait = lastSentAt + POSITION_MIN_GAP_MS - now;
+    if (wait > 0) {
+        positionSendTimer = setTimeout(() => { positionSendTimer = null; sendPosition(); }, wait);
+        return;
+    }
+    if (myWorldX === lastSentX && myWorldY === lastSentY) return;
+    lastSentAt = now;
+    lastSentX = myWorldX;
+    lastSentY = myWorldY;
+    sendMessage('update_position', { x: myWorldX, y: myWorldY });
+}
+
+function updateMovement(now) {
+    const dt = lastFrameAt === null ? 0 : Math.min(now - lastFrameAt, MAX_FRAME_DT_MS) / 1000;
+    lastFrameAt = now;
+    const step = MOVE_SPEED * dt;
+
     let moved = false; let newDirection = 'idle';
-    if (keysPressed.ArrowUp) { myWorldY -= MOVE_SPEED; newDirection = 'up'; moved = true; }
-    if (keysPressed.ArrowDown) { myWorldY += MOVE_SPEED; newDirection = 'down'; moved = true; }
-    if (keysPressed.ArrowLeft) { myWorldX -= MOVE_SPEED; newDirection = 'left'; moved = true; }
-    if (keysPressed.ArrowRight) { myWorldX += MOVE_SPEED; newDirection = 'right'; moved = true; }
-    
+    if (keysPressed.ArrowUp) { myWorldY -= step; newDirection = 'up'; moved = true; }
+    if (keysPressed.ArrowDown) { myWorldY += step; newDirection = 'down'; moved = true; }
+    if (keysPressed.ArrowLeft) { myWorldX -= step; newDirection = 'left'; moved = true; }
+    if (keysPressed.ArrowRight) { myWorldX += step; newDirection = 'right'; moved = true; }
+
+    // 方向改變（含停下來）時馬上送一次，其他人看到的停止點才會準
+    const inputChanged = newDirection !== lastDirection;
+    lastDirection = newDirection;
+
     if (!moved) { 
         if (!moveIdleTimer) moveIdleTimer = setTimeout(() => { setPetSprite('idle'); moveIdleTimer = null; }, 150); 
+        if (inputChanged) sendPosition();
         return; 
     }
     
@@ -472,10 +518,70 @@ function updateMovement() {
     updateCamera(myWorldX, myWorldY);
     updateMyPetScreenPosition(myWorldX, myWorldY);
     
-    // [修正] 傳送座標訊息
-    sendMessage('update_position', { x: myWorldX, y: myWorldY });
+    if (inputChanged || now - lastSentAt >= POSITION_SEND_INTERVAL_MS) sendPosition();
 }
-function gameLoop() { updateMovement(); requestAnimationFrame(gameLoop); }
+
+// server 認為位置不合理（超出地圖 / 移動太快）時，以 server 給的位置為準
+function handlePositionCorrected(msg) {
+    const { x, y } = msg.payload;
+    if (typeof x !== 'number' || typeof y !== 'number') return;
+    myWorldX = x;
+    myWorldY = y;
+    lastSentX = x;
+    lastSentY = y;
+    myPetEl.dataset.worldX = myWorldX;
+    myPetEl.dataset.worldY = myWorldY;
+    updateCamera(myWorldX, myWorldY);
+    updateMyPetScreenPosition(myWorldX, myWorldY);
+}
+
+// other_pet_moved 的 ts 是 server 的毫秒時間（只有低 32 bits），換成本地 performance.now() 的時間軸
+// offset 取「本地時間 - server 時間」的最小值（延遲最小的那則最準），每則最多往上調 1ms 跟上時鐘漂移
+let serverClock = null;
+function toLocalTime(rawTs) {
+    const now = performance.now();
+    if (typeof rawTs !== 'number') return now;
+    if (serverClock === null) {
+        serverClock = { raw: rawTs, unwrapped: rawTs, offset: now - rawTs };
+    } else {
+        serverClock.unwrapped += (rawTs - serverClock.raw) | 0;
+        serverClock.raw = rawTs;
+        serverClock.offset = Math.min(now - serverClock.unwrapped, serverClock.offset + 1);
+    }
+    return serverClock.unwrapped + serverClock.offset;
+}
+
+function renderOtherPets(now) {
+    const renderAt = now - INTERP_DELAY_MS;
+    Object.keys(otherPets).forEach((uid) => {
+        const pet = otherPets[uid];
+        const snaps = pet.snapshots;
+        if (!snaps || snaps.length === 0) return;
+
+        // 丟掉 renderAt 之前、已經用不到的 snapshot（留一個當內插起點）
+        while (snaps.length >= 2 && snaps[1].t <= renderAt) snaps.shift();
+
+        let x; let y;
+        if (snaps.length === 1 || renderAt <= snaps[0].t) {
+            x = snaps[0].x;
+            y = snaps[0].y;
+            if (snaps.length === 1 && renderAt >= snaps[0].t) snaps.length = 0;
+        } else {
+            const a = snaps[0];
+            const b = snaps[1];
+            const k = (renderAt - a.t) / (b.t - a.t);
+            x = a.x + (b.x - a.x) * k;
+            y = a.y + (b.y - a.y) * k;
+        }
+
+        if (x === pet.x && y === pet.y) return;
+        pet.x = x;
+        pet.y = y;
+        updateOtherPetScreenPosition(pet.el, x, y);
+    });
+}
+
+function gameLoop(now) { updateMovement(now); renderOtherPets(now); requestAnimationFrame(gameLoop); }
 
 // [修正] 恢復排行榜邏輯
 function updateLeaderboard() {
@@ -508,9 +614,36 @@ function updateLeaderboard() {
     });
 }
 
+// 分段送來的 lobby_state：收齊（has_more=false）才套用。
+// 收集期間到的 join / leave 先記下來，套用時合併，避免被舊 snapshot 蓋掉
+let lobbySnapshot = null;
+
 function handleLobbyState(msg) {
+    const payload = msg.payload || {};
+    lobbySnapshot = { players: [...(payload.players || [])], joined: new Map(), left: new Set() };
+    if (!payload.has_more) finishLobbySnapshot();
+}
+
+function handleLobbyStateChunk(msg) {
+    if (!lobbySnapshot) return;
+    const payload = msg.payload || {};
+    lobbySnapshot.players.push(...(payload.players || []));
+    if (!payload.has_more) finishLobbySnapshot();
+}
+
+function finishLobbySnapshot() {
+    const { players, joined, left } = lobbySnapshot;
+    lobbySnapshot = null;
+    const merged = players.filter((p) => {
+        const uid = Number(p.user_id);
+        return !left.has(uid) && !joined.has(uid);
+    });
+    merged.push(...joined.values());
+    applyLobbyState(merged);
+}
+
+function applyLobbyState(players) {
     const myId = currentMyUserId;
-    const players = msg.payload.players || [];
 
     // 1. 更新 allPlayers & 自己的狀態 / 積分
     allPlayers = {};
@@ -604,6 +737,7 @@ function handleLobbyState(msg) {
         const petEl = getOrCreateOtherPet(uid, p.display_name, worldX, worldY);
         otherPets[uid].x = worldX;
         otherPets[uid].y = worldY;
+        otherPets[uid].snapshots = [];
 
         updateOtherPetScreenPosition(petEl, worldX, worldY);
     });
@@ -617,12 +751,27 @@ function handleLobbyState(msg) {
 }
 
 function handlePlayerJoined(msg) {
+    addPlayer(msg.payload.player);
+    updateLeaderboard();
+}
+
+// server 把短時間內的多個 join 合併成一則（裡面可能包含自己）
+function handlePlayersJoined(msg) {
+    (msg.payload.players || []).forEach((player) => {
+        if (Number(player.user_id) !== currentMyUserId) addPlayer(player);
+    });
+    updateLeaderboard();
+}
+
+function addPlayer(player) {
     const myId = currentMyUserId;
-    const player = msg.payload.player;
     const uid = Number(player.user_id);
-    
+
     allPlayers[uid] = player;
-    updateLeaderboard();
+    if (lobbySnapshot) {
+        lobbySnapshot.joined.set(uid, player);
+        lobbySnapshot.left.delete(uid);
+    }
 
     if (!uid || uid === myId) return;
 
@@ -636,12 +785,17 @@ function handlePlayerJoined(msg) {
     const petEl = getOrCreateOtherPet(uid, player.display_name, px, py);
     otherPets[uid].x = px;
     otherPets[uid].y = py;
+    otherPets[uid].snapshots = [];
     updateOtherPetScreenPosition(petEl, px, py);
 }
 
 function handlePlayerLeft(msg) {
     const uid = Number(msg.user_id);
     if (uid === currentMyUserId) return;
+    if (lobbySnapshot) {
+        lobbySnapshot.left.add(uid);
+        lobbySnapshot.joined.delete(uid);
+    }
     
     // 從 allPlayers 和 otherPets 移除
     delete allPlayers[uid];
@@ -702,6 +856,37 @@ function handlePetStateUpdate(msg) {
     }
 }
 
+// 後端（Pi 回報 / 體力衰減 / 對戰積分）改了 DB 裡的寵物狀態，ws-server 推給本人與附近的玩家
+// 這是 DB 的值，直接蓋掉本機 localStorage 的紀錄（不跟本機取最大值）
+function handlePetEnergyChanged(msg) {
+    const { user_id: rawUid, energy, status, score } = msg.payload;
+    const uid = Number(rawUid);
+    if (typeof energy !== 'number') return;
+    const safeScore = normalizeScore(score);
+
+    allPlayers[uid] = { ...allPlayers[uid], user_id: uid, energy, status, score: safeScore };
+    updateLeaderboard();
+
+    const { statusName } = getSpiritInfo(energy);
+    if (uid === currentMyUserId) {
+        localStorage.setItem('my_spirit_value', String(energy));
+        localStorage.setItem('my_total_score', String(safeScore));
+        petLevelEl.textContent = `狀態：${energy} (${statusName})`;
+        updateSpiritBadge(energy);
+        if (playerScoreEl) {
+            playerScoreEl.textContent = `積分：${safeScore} Pts`;
+        }
+        // 正在看別人的卡片時，聊天 / 對戰按鈕跟著自己的新體力更新
+        if (petInfoCard.style.display === 'block') {
+            actionBattleBtn.disabled = energy < 70;
+            actionChatBtn.disabled = energy <= 30;
+        }
+    } else if (targetUserId === uid && petInfoCard.style.display === 'block') {
+        targetPetStatus.innerHTML =
+            `精神狀態: ${energy} (${statusName})<br>積分: ${safeScore} Pts`;
+    }
+}
+
 function handleOtherPetMoved(msg) {
     const player = msg.payload.player;
     const uid = Number(player.user_id);
@@ -720,10 +905,27 @@ function handleOtherPetMoved(msg) {
     }
 
     const name = allPlayers[uid] ? allPlayers[uid].display_name : `Player${uid}`;
+    const isNew = !otherPets[uid];
     const petEl = getOrCreateOtherPet(uid, name, px, py);
-    otherPets[uid].x = px;
-    otherPets[uid].y = py;
-    updateOtherPetScreenPosition(petEl, px, py);
+    const pet = otherPets[uid];
+    const t = toLocalTime(player.ts);
+    if (isNew) {
+        updateOtherPetScreenPosition(petEl, px, py);
+        pet.snapshots = [{ t, x: px, y: py }];
+        return;
+    }
+
+    // 停了一陣子才又開始動：從畫面上目前的位置開始內插，不要從很久以前的點滑過來
+    const snaps = pet.snapshots;
+    const last = snaps[snaps.length - 1];
+    if (!last || t - last.t > SNAPSHOT_STALE_MS) {
+        snaps.length = 0;
+        snaps.push({ t: t - POSITION_SEND_INTERVAL_MS, x: pet.x, y: pet.y });
+    } else if (t <= last.t) {
+        return;
+    }
+    snaps.push({ t, x: px, y: py });
+    if (snaps.length > MAX_SNAPSHOTS) snaps.splice(0, snaps.length - MAX_SNAPSHOTS);
 }
 
 // 聊天與對戰回呼
@@ -875,7 +1077,7 @@ function handleBattleResult(msg) {
             '可惜！',
             `您輸了與 ${opponentName} 的對戰。\n` +
             `本場您的遊戲得分：${currentMyUserId === player1_id ? player1_score : player2_score} 分\n` +
-            `本次獲得：+${myGain} Pts（對手的一半）`
+            `本次獲得：+${myGain} Pts`
         );
     } else {
         showCustomAlert(
@@ -1025,10 +1227,14 @@ async function initializeLobby() {
 
     // 註冊 WebSocket 回呼
     registerCallback('lobby_state', handleLobbyState);
+    registerCallback('lobby_state_chunk', handleLobbyStateChunk);
     registerCallback('player_joined', handlePlayerJoined);
+    registerCallback('players_joined', handlePlayersJoined);
     registerCallback('player_left', handlePlayerLeft);
     registerCallback('pet_state_update', handlePetStateUpdate);
+    registerCallback('pet_energy_changed', handlePetEnergyChanged);
     registerCallback('other_pet_moved', handleOtherPetMoved);
+    registerCallback('position_corrected', handlePositionCorrected);
     registerCallback('chat_request', handleChatRequest);
     registerCallback('chat_approved', handleChatApproved);
     registerCallback('chat_message', handleChatMessage);
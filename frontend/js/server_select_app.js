@@ -1,19 +1,68 @@
 // frontend/js/server_select_app.js
+import { getServers, switchServer } from './api_client.js';
+
 const serverBtns = document.querySelectorAll('.server-btn');
 
+// 顯示各伺服器的即時負載；滿了 / 連不上的按鈕直接停用
+async function showServerLoads() {
+    let servers;
+    try {
+        servers = await getServers();
+    } catch (err) {
+        console.warn('取得伺服器負載失敗：', err.message);
+        return;
+    }
+
+    servers.forEach(info => {
+        const btn = document.querySelector(`.server-btn[data-server-id="${info.server_id}"]`);
+        if (!btn) return;
+
+        let label = btn.querySelector('.server-load');
+        if (!label) {
+            label = document.createElement('span');
+            label.className = 'server-load';
+            btn.appendChild(label);
+        }
+
+        if (!info.reachable) {
+            label.textContent = '維護中';
+        } else {
+            label.textContent = `在線 ${info.connections} / ${info.capacity}` +
+                (info.recommended ? '・推薦' : '') +
+                (info.has_room ? '' : '・已滿');
+        }
+        btn.disabled = !info.reachable || !info.has_room;
+    });
+}
+
 serverBtns.forEach(btn => {
-    btn.addEventListener('click', (e) => {
+    btn.addEventListener('click', async (e) => {
+        const target = e.currentTarget;
+        // data-server-id 空字串 = 自動分配，由後端挑最空的一台
+        const requested = target.getAttribute('data-server-id') || null;
+
         // 1. 視覺標記
         serverBtns.forEach(b => b.classList.remove('selected'));
-        e.target.classList.add('selected');
+        target.classList.add('selected');
 
-        // 2. 儲存選擇
-        const server_id = e.target.getAttribute('data-server-id');
-        localStorage.setItem('selected_server_id', server_id);
+        // 2. 先請後端把帳號搬到這台（滿了會被拒絕），拿新 token
+        let result;
+        try {
+            result = await switchServer(requested);
+        } catch (err) {
+            target.classList.remove('selected');
+            alert(`無法進入伺服器：${err.message}`);
+            showServerLoads();
+            return;
+        }
+        localStorage.setItem('user_token', result.token);
+        localStorage.setItem('selected_server_id', result.server_id);
 
-        console.log(`已選擇伺服器: ${server_id}，直接進入大廳...`);
-        
-        // 3. 移除 alert，直接跳轉到大廳
-        window.location.href = 'lobby.html'; 
+        console.log(`已選擇伺服器: ${result.server_id}，直接進入大廳...`);
+
+        // 3. 直接跳轉到大廳
+        window.location.href = 'lobby.html';
     });
-});
\ No newline at end of file
+});
+
+showServerLoads();
@@ -4,9 +4,155 @@ const callbacks = {};
 let ws = null;
 let isConnected = false;
 
+// =========================================================
+// 自動重連 + 斷線續連（ws-server/common/session.py）
+// - 連線不正常斷掉就重連：指數退避 + full jitter（0 ~ min(RECONNECT_MAX_MS, BASE * 2^n)），
+//   大家同時斷線時不會同一瞬間一起打回來
+// - join 後 server 送 session_started（resume_token）；之後每收到一個 frame 就 lastSeq + 1
+//   （session_started / session_resumed 不算）。重連時 join_lobby 帶 resume_token + last_seq，
+//   server 在寬限期內就只補送漏掉的訊息（session_resumed），不用重新拿整個 lobby_state；
+//   不能續連時 server 照一般 join 處理（新的 session_started + lobby_state）
+// - ws-server 重啟：先送 server_restart（reconnect_after_ms：server 幫每個人抽好的隨機延遲）再用 1012 關閉；
+//   只收到 1012 時自己在 0 ~ RESTART_JITTER_MS 之間抽。重啟後舊 session 不在了，不帶 resume_token
+// =========================================================
+const RESTART_JITTER_MS = 5000;
+const RECONNECT_BASE_MS = 1000;
+const RECONNECT_MAX_MS = 30000;
+// 這些 close code 重連也沒用（正常關閉 / token 無效 / 帳號換 shard）
+const NO_RECONNECT_CODES = [1000, 1008, 4001, 4003];
+const CONTROL_TYPES = ["session_started", "session_resumed"];
+
+let connectArgs = null;
+let restartDelayMs = null;
+let reconnectAttempt = 0;
+let reconnectTimer = null;
+let resumeToken = null;
+let lastSeq = 0;
+
+function scheduleReconnect(code) {
+    let delay;
+    if (restartDelayMs !== null) {
+        delay = restartDelayMs;
+    } else if (code === 1012 && reconnectAttempt === 0) {
+        delay = Math.random() * RESTART_JITTER_MS;
+    } else {
+        delay = Math.random() * Math.min(RECONNECT_MAX_MS, RECONNECT_BASE_MS * 2 ** reconnectAttempt);
+    }
+    restartDelayMs = null;
+    reconnectAttempt += 1;
+    console.warn(`[WS] 連線中斷（code=${code}），${Math.round(delay)}ms 後重連（第 ${reconnectAttempt} 次）`);
+    clearTimeout(reconnectTimer);
+    reconnectTimer = setTimeout(() => initWebSocket(...connectArgs), delay);
+}
+
+// =========================================================
+// 二進位子協定 pet.bin.v2（跟 ws-server/common/protocol.py 一起改）
+// 最高頻的訊息改走固定格式 binary frame，little-endian，第一個 byte 是 opcode：
+//   client → server
+//     0x01 update_position  [u8 op][f32 x][f32 y]
+//     0x02 battle_update    [u8 op][i32 score][u8 state][battle_id UTF-8 到結尾]
+//   server → client
+//     0x81 other_pet_moved  [u8 op][u32 user_id][f32 x][f32 y][u32 ts]
+//     0x82 battle_update    [u8 op][u32 user_id][i32 score][u8 state][battle_id UTF-8 到結尾]
+//     0x90 compressed JSON  [u8 op][deflate-raw(JSON 文字)]
+//          （大型 lobby_state，跟子協定無關；join_lobby 帶 compress: "deflate-raw" 才會收到）
+// server 沒選 pet.bin.v2（舊版 ws-server）時全部照舊走 JSON。
+// =========================================================
+const SUBPROTOCOL_BINARY = "pet.bin.v2";
+const SUBPROTOCOL_JSON = "pet.json.v1";
+
+const OP_UPDATE_POSITION = 0x01;
+const OP_BATTLE_UPDATE = 0x02;
+const OP_OTHER_PET_MOVED = 0x81;
+const OP_BATTLE_UPDATE_OUT = 0x82;
+const OP_COMPRESSED_JSON = 0x90;
+
+// 瀏覽器能解 deflate-raw 才跟 server 要壓縮過的 snapshot
+const SUPPORTS_DEFLATE_RAW = typeof DecompressionStream !== "undefined";
+
+const BATTLE_STATES = ["waiting", "running", "finished"];
+
+const textEncoder = new TextEncoder();
+const textDecoder = new TextDecoder();
+
+/** 支援的 type 回傳 ArrayBuffer，不支援（或欄位不合格式）回傳 null → 改送 JSON */
+function encodeBinary(type, payload) {
+    if (type === "update_position") {
+        if (typeof payload.x !== "number" || typeof payload.y !== "number") return null;
+        const buf = new ArrayBuffer(9);
+        const view = new DataView(buf);
+        view.setUint8(0, OP_UPDATE_POSITION);
+        view.setFloat32(1, payload.x, true);
+        view.setFloat32(5, payload.y, true);
+        return buf;
+    }
+    if (type === "battle_update") {
+        const state = BATTLE_STATES.indexOf(payload.state || "running");
+        if (state < 0 || !payload.battle_id || !Number.isInteger(payload.score)) return null;
+        const id = textEncoder.encode(String(payload.battle_id));
+        const buf = new ArrayBuffer(6 + id.length);
+        const view = new DataView(buf);
+        view.setUint8(0, OP_BATTLE_UPDATE);
+        view.setInt32(1, payload.score, true);
+        view.setUint8(5, state);
+        new Uint8Array(buf, 6).set(id);
+        return buf;
+    }
+    return null;
+}
+
+async function inflateJson(bytes) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("deflate-raw"));
+    return JSON.parse(await new Response(stream).text());
+}
+
+/**
+ * server 送來的 binary frame → 跟 JSON 版本一樣形狀的物件（callback 不用分兩套）
+ * 壓縮的 snapshot 回傳 Promise
+ */
+function decodeBinary(buf) {
+    const view = new DataView(buf);
+    const serverId = localStorage.getItem("selected_server_id");
+    const op = view.getUint8(0);
+    if (op === OP_COMPRESSED_JSON) {
+        return inflateJson(new Uint8Array(buf, 1));
+    }
+    if (op === OP_OTHER_PET_MOVED) {
+        const userId = view.getUint32(1, true);
+        return {
+            type: "other_pet_moved",
+            server_id: serverId,
+            user_id: userId,
+            payload: {
+                player: {
+                    user_id: userId,
+                    x: view.getFloat32(5, true),
+                    y: view.getFloat32(9, true),
+                    ts: view.getUint32(13, true),
+                },
+            },
+        };
+    }
+    if (op === OP_BATTLE_UPDATE_OUT) {
+        const userId = view.getUint32(1, true);
+        return {
+            type: "battle_update",
+            server_id: serverId,
+            user_id: userId,
+            payload: {
+                battle_id: textDecoder.decode(new Uint8Array(buf, 10)),
+                user_id: userId,
+                score: view.getInt32(5, true),
+                state: BATTLE_STATES[view.getUint8(9)] || "running",
+            },
+        };
+    }
+    return null;
+}
+
 /**
  * 初始化 Web Socket 連線
- * @param {string} token 使用者 JWT Token
+ * @param {string} token 登入時後端簽發的 token（HMAC 簽章）
  * @param {string} userId 使用者 ID
  * @param {object} initialData 包含玩家初始資訊 (pet_id, score, x, y 等)
  */
@@ -21,18 +167,23 @@ export function initWebSocket(token, userId, initialData = {}) {
         console.error("[WS] 尚未選擇伺服器，無法連線！");
         return;
     }
+    connectArgs = [token, userId, initialData];
 
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     const host = window.location.host; 
-    const wsUrl = `${protocol}//${host}/server${serverId}/ws/`;
+    // 瀏覽器的 WebSocket 不能帶 Authorization header，token 改放 query string，
+    // ws-server 在 handshake 時驗證簽章，身分以 token 為準
+    const wsUrl = `${protocol}//${host}/server${serverId}/ws/?token=${encodeURIComponent(token)}`;
 
-    console.log(`[WS] 正在連線至: ${wsUrl}`);
+    console.log(`[WS] 正在連線至: ${protocol}//${host}/server${serverId}/ws/`);
 
-    ws = new WebSocket(wsUrl);
+    // 提供兩種子協定：新版 ws-server 會選 pet.bin.v2
+    ws = new WebSocket(wsUrl, [SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON]);
+    ws.binaryType = "arraybuffer";
 
     // --- 連線開啟 ---
     ws.onopen = () => {
-        console.log(`%c[WS] 連線成功！Server: ${serverId}, User: ${userId}`, "color: green; font-weight: bold;");
+        console.log(`%c[WS] 連線成功！Server: ${serverId}, User: ${userId}, protocol: ${ws.protocol || "json"}`, "color: green; font-weight: bold;");
         isConnected = true;
 
         // ★★ 關鍵：優先使用 lobby_app 傳進來的 initialData.x / initialData.y
@@ -61,6 +212,7 @@ export function initWebSocket(token, userId, initialData = {}) {
                         ? initialData.energy
                         : 100,
                 status: initialData.status || "ACTIVE",
+                compress: SUPPORTS_DEFLATE_RAW ? "deflate-raw" : undefined,
                 score:
                     typeof initialData.score === "number"
                         ? initialData.score
@@ -68,6 +220,8 @@ export function initWebSocket(token, userId, initialData = {}) {
                 // ❌ 不再自己決定 x, y
                 // x: 100,
                 // y: 100,
+                resume_token: resumeToken || undefined,
+                last_seq: resumeToken ? lastSeq : undefined,
             },
         };
 
@@ -76,17 +230,46 @@ export function initWebSocket(token, userId, initialData = {}) {
     };
 
     // --- 收到訊息 ---
+    // 壓縮過的 snapshot 要非同步解壓；解壓期間收到的訊息排在它後面，維持 server 送出的順序
+    let queued = 0;
+    let inbound = Promise.resolve();
     ws.onmessage = (event) => {
+        let data;
         try {
-            const data = JSON.parse(event.data);
-            // console.log("[WS] 收到訊息:", data);
-
-            if (data.type && callbacks[data.type]) {
-                callbacks[data.type](data);
-            }
+            data = (event.data instanceof ArrayBuffer)
+                ? decodeBinary(event.data)
+                : JSON.parse(event.data);
         } catch (e) {
             console.error("[WS] 解析訊息失敗:", event.data, e);
+            lastSeq += 1;
+            return;
         }
+        // 收得到訊息才算重連成功（還在 drain 的舊 process 會 accept 後馬上用 1012 關掉）
+        reconnectAttempt = 0;
+        const type = data && !(data instanceof Promise) ? data.type : null;
+        if (type === "session_started") {
+            resumeToken = data.payload?.resume_token || null;
+            lastSeq = 0;
+        } else if (type === "session_resumed") {
+            console.log(`[WS] 續連成功，補送 ${data.payload.seq - data.payload.last_seq} 則訊息`);
+        } else {
+            lastSeq += 1;
+        }
+        if (type === "server_restart") {
+            restartDelayMs = Number(data.payload?.reconnect_after_ms) || 0;
+        }
+        if (CONTROL_TYPES.includes(type)) return;
+
+        if (queued === 0 && !(data instanceof Promise)) {
+            dispatch(data);
+            return;
+        }
+        queued += 1;
+        inbound = inbound
+            .then(() => data)
+            .then(dispatch)
+            .catch((e) => console.error("[WS] 解壓縮失敗:", e))
+            .finally(() => { queued -= 1; });
     };
 
     // --- 連線關閉 ---
@@ -94,6 +277,24 @@ export function initWebSocket(token, userId, initialData = {}) {
         console.warn("[WS] 連線已斷開", event);
         isConnected = false;
         ws = null;
+
+        // 4001：帳號被搬到別台 shard；4003：token 不屬於這台 → 回伺服器選擇頁重新分配
+        if (event.code === 4001 || event.code === 4003) {
+            localStorage.removeItem('selected_server_id');
+            window.location.href = 'server-select.html';
+            return;
+        }
+
+        if (NO_RECONNECT_CODES.includes(event.code)) {
+            restartDelayMs = null;
+            resumeToken = null;
+            return;
+        }
+        // 1012：ws-server 重啟，舊 session 跟著消失
+        if (event.code === 1012 || restartDelayMs !== null) {
+            resumeToken = null;
+        }
+        scheduleReconnect(event.code);
     };
 
     // --- 連線錯誤 ---
@@ -102,6 +303,16 @@ export function initWebSocket(token, userId, initialData = {}) {
     };
 }
 
+function dispatch(data) {
+    if (data && data.type && callbacks[data.type]) {
+        try {
+            callbacks[data.type](data);
+        } catch (e) {
+            console.error(`[WS] 處理 ${data.type} 失敗:`, e);
+        }
+    }
+}
+
 /**
  * 註冊回呼函數
  */
@@ -121,6 +332,14 @@ export function sendMessage(type, payload = {}) {
     const serverId = localStorage.getItem("selected_server_id");
     const userId   = Number(localStorage.getItem("user_id"));
 
+    if (ws.protocol === SUBPROTOCOL_BINARY) {
+        const buf = encodeBinary(type, payload);
+        if (buf) {
+            ws.send(buf);
+            return;
+        }
+    }
+
     const message = {
         type,
         server_id: serverId,
@@ -128,7 +347,6 @@ export function sendMessage(type, payload = {}) {
         payload,
     };
 
-    console.log("[WS] 發送訊息:", message);
     ws.send(JSON.stringify(message));
 }
 
@@ -8,9 +8,6 @@ from typing import Optional, Dict
 from config import (
     BASE_URL,
     SERVER_STATUS_URL,
-    PET_STATUS_PATH,
-    UPDATE_PATH,
-    SERVER_PREFIX_MAP,
 )
 
 USER_FILE = "detector_user.json"
@@ -39,7 +36,7 @@ def load_detector_config(force_refresh: bool = False) -> Optional[Dict]:
         print("[CONFIG][ERROR] 尚未設定 user_id！請先由前端呼叫 /set_user。")
         return None
 
-    # Step 1: 查 server_id
+    # 一次查齊：server_id、pet_id、update_path（含 /serverX 前綴）
     resp = requests.get(SERVER_STATUS_URL, params={"user_id": user_id}, timeout=3)
     resp_json = resp.json()
 
@@ -47,28 +44,12 @@ def load_detector_config(force_refresh: bool = False) -> Optional[Dict]:
         print("[CONFIG][ERROR] server_status 錯誤：", resp_json.get("error"))
         return None
 
-    server_id = resp_json["data"]["server_id"]
-    prefix = SERVER_PREFIX_MAP.get(server_id)
-
-    # Step 2: 查 pet_id
-    pet_status_url = f"{BASE_URL}{prefix}{PET_STATUS_PATH}"
-    resp2 = requests.get(pet_status_url, params={"user_id": user_id}, timeout=3)
-    pet_json = resp2.json()
-
-    if not pet_json.get("success", False):
-        print("[CONFIG][ERROR] pet_status 錯誤：", pet_json.get("error"))
-        return None
-
-    pet_id = pet_json["data"]["pet_id"]
-
-    # Step 3: 組 update_url
-    update_url = f"{BASE_URL}{prefix}{UPDATE_PATH}"
-
+    data = resp_json["data"]
     cfg = {
         "user_id": user_id,
-        "pet_id": pet_id,
-        "server_id": server_id,
-        "update_url": update_url,
+        "pet_id": data["pet_id"],
+        "server_id": data["server_id"],
+        "update_url": f"{BASE_URL}{data['update_path']}",
     }
 
     _detector_config_cache = cfg
@@ -77,9 +58,17 @@ def load_detector_config(force_refresh: bool = False) -> Optional[Dict]:
 
 
 def send_exercise(exercise_count: int = 1, source: str = "webcam") -> bool:
-    cfg = load_detector_config()
+    ok, error_code = _post_exercise(load_detector_config(), exercise_count, source)
+    if not ok and error_code == "USER_NOT_FOUND":
+        # 使用者換了伺服器：重新查一次路由再送
+        print("[SENDER] server_id 不符，重新查詢所在伺服器")
+        ok, _ = _post_exercise(load_detector_config(force_refresh=True), exercise_count, source)
+    return ok
+
+
+def _post_exercise(cfg: Optional[Dict], exercise_count: int, source: str):
     if not cfg:
-        return False
+        return False, None
 
     payload = {
         "user_id": cfg["user_id"],
@@ -95,4 +84,5 @@ def send_exercise(exercise_count: int = 1, source: str = "webcam") -> bool:
     resp_json = resp.json()
 
     print("[SENDER] 回應：", resp_json)
-    return resp_json.get("success", False)
+    error = resp_json.get("error") or {}
+    return resp_json.get("success", False), error.get("code")
@@ -0,0 +1,159 @@
+# tests/test_auth.py
+
+"""
+token 驗證（backend/app/auth.py 與 ws-server/common/auth.py 兩份都測）：
+亂送的 token 一律是 AuthError(INVALID_TOKEN)，不能變成 500 / handshake 噴例外
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from conftest import ROOT
+
+# ws-server 不連 DB（要在 import common.shard 之前設定）
+os.environ["WS_DATABASE_URL"] = ""
+
+from app import auth as backend_auth  # noqa: E402
+from common import auth as ws_auth  # noqa: E402
+
+AUTH_MODULES = pytest.mark.parametrize("auth", [backend_auth, ws_auth], ids=["backend", "ws"])
+
+MALFORMED_TOKENS = [
+    "",
+    ".",
+    "garbage",
+    "v1.1.A.9999999999",
+    "v2.1.A.9999999999.sig",
+    "v1.1.A.9999999999.",
+    "v1.x.A.9999999999.sig",
+    "v1.1.A.B.9999999999.sig",
+]
+
+
+def _with_signature(auth, body: str) -> str:
+    return f"{body}.{auth._sign(body)}"
+
+
+@AUTH_MODULES
+def test_roundtrip(auth):
+    claims = auth.verify_token(auth.issue_token(7, "B"))
+    assert (claims.user_id, claims.server_id) == (7, "B")
+
+
+@AUTH_MODULES
+@pytest.mark.parametrize("token", MALFORMED_TOKENS)
+def test_malformed_token(auth, token):
+    with pytest.raises(auth.AuthError) as excinfo:
+        auth.verify_token(token)
+    assert excinfo.value.code == "INVALID_TOKEN"
+
+
+@AUTH_MODULES
+def test_non_ascii_body(auth):
+    token = auth.issue_token(7, "A")
+    body, _, signature = token.rpartition(".")
+    with pytest.raises(auth.AuthError) as excinfo:
+        auth.verify_token(body.replace(".A.", ".é.") + "." + signature)
+    assert excinfo.value.code == "INVALID_TOKEN"
+
+
+@AUTH_MODULES
+def test_non_ascii_signature(auth):
+    token = auth.issue_token(7, "A")
+    with pytest.raises(auth.AuthError) as excinfo:
+        auth.verify_token(token[:-1] + "€")
+    assert excinfo.value.code == "INVALID_TOKEN"
+
+
+@AUTH_MODULES
+def test_non_integer_claims_with_valid_signature(auth):
+    with pytest.raises(auth.AuthError) as excinfo:
+        auth.verify_token(_with_signature(auth, "v1.x.A.9999999999"))
+    assert excinfo.value.code == "INVALID_TOKEN"
+
+
+@AUTH_MODULES
+def test_expired(auth):
+    token = auth.issue_token(7, "A", ttl=-1)
+    with pytest.raises(auth.AuthError) as excinfo:
+        auth.verify_token(token, now=time.time())
+    assert excinfo.value.code == "TOKEN_EXPIRED"
+
+
+@pytest.mark.parametrize("header", [
+    "Bearer v1.1.é.9999999999.sig",
+    "Bearer " + "v1.1.A.9999999999.sig€",
+    "Bearer garbage",
+])
+def test_require_user_route_returns_401(header):
+    from app.main import app
+
+    client = TestClient(app)
+    response = client.get("/api/pet/status", headers={"Authorization": header.encode("utf-8")})
+    assert response.status_code == 401
+    assert response.json()["error"]["code"] == "INVALID_TOKEN"
+
+
+@pytest.mark.parametrize("token", ["v1.1.%C3%A9.9999999999.sig", "v1.1.A.9999999999.%E2%82%AC", "garbage"])
+def test_ws_handshake_rejects_bad_token(token):
+    from common.shard import app
+
+    # 不跑 lifespan（writer / listener 不用啟動）：handshake 驗證在那之前就結束了
+    client = TestClient(app)
+    with pytest.raises(WebSocketDisconnect) as excinfo:
+        with client.websocket_connect(f"/ws/?token={token}"):
+            pass
+    assert excinfo.value.code == 1008
+
+
+def _import_auth(module: str, **env: str) -> subprocess.CompletedProcess:
+    """在乾淨的環境變數下 import auth 模組（TOKEN_SECRET 在 import 時就讀）"""
+    clean = {k: v for k, v in os.environ.items() if not k.startswith("PET_")}
+    clean.update(env)
+    return subprocess.run(
+        [sys.executable, "-c", f"import {module}"],
+        cwd=ROOT,
+        env=dict(clean, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, "backend"), os.path.join(ROOT, "ws-server")])),
+        capture_output=True,
+        text=True,
+    )
+
+
+@pytest.mark.parametrize("module", ["app.auth", "common.auth"])
+@pytest.mark.parametrize("secret", [None, "", "dev-only-change-me"])
+def test_refuses_to_start_without_secret(module, secret):
+    env = {} if secret is None else {"PET_TOKEN_SECRET": secret}
+    result = _import_auth(module, **env)
+    assert result.returncode != 0
+    assert "PET_TOKEN_SECRET" in result.stderr
+
+
+@pytest.mark.parametrize("module", ["app.auth", "common.auth"])
+def test_refuses_to_start_without_internal_token(module):
+    result = _import_auth(module, PET_TOKEN_SECRET="s3cret")
+    assert result.returncode != 0
+    assert "PET_INTERNAL_TOKEN" in result.stderr
+
+
+@pytest.mark.parametrize("module", ["app.auth", "common.auth"])
+def test_dev_default_needs_explicit_flag_and_warns(module):
+    result = _import_auth(module, PET_ALLOW_DEV_SECRETS="1")
+    assert result.returncode == 0, result.stderr
+    assert "PET_TOKEN_SECRET" in result.stderr and "PET_INTERNAL_TOKEN" in result.stderr
+
+
+@pytest.mark.parametrize("path", ["/internal/drain", "/internal/evict"])
+@pytest.mark.parametrize("token", [None, "dev-only-change-me"])
+def test_internal_endpoints_reject_default_token(path, token):
+    from common.shard import app
+
+    client = TestClient(app)
+    headers = {} if token is None else {"X-Internal-Token": token}
+    response = client.post(path, json={"user_id": 1}, headers=headers)
+    assert response.status_code == 403
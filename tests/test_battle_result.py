@@ -0,0 +1,152 @@
+# tests/test_battle_result.py
+
+"""
+POST /api/battle/result 的併發正確性（需要 PostgreSQL，見 conftest.py 的 PET_TEST_DATABASE_URL）：
+
+- 同一個 idempotency_key 同時回報兩次：只記一筆、只加一次分，兩邊拿到同一個 battle_id
+- 同一位勝者的多場結果同時回報：score = score + 5 由 DB 原子完成，不會 lost update
+- 一場新的結果只送一個 SQL（REPORT_BATTLE_RESULT_SQL），用 before_cursor_execute 的計數器確認
+"""
+
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import text
+
+from conftest import TEST_DATABASE_URL
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="PET_TEST_DATABASE_URL 沒有設定")
+
+SERVER_ID = "A"
+
+
+@pytest.fixture(scope="module")
+def main():
+    from sqlalchemy.exc import OperationalError
+
+    from app import main
+
+    try:
+        with main.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError as e:
+        pytest.skip(f"連不上測試資料庫：{e}")
+    return main
+
+
+@pytest.fixture
+def players(main):
+    """建兩位同一台 server 的玩家（各一隻寵物），測完連同對戰紀錄一起刪掉"""
+    prefix = f"t_{uuid.uuid4().hex[:12]}_"
+    with main.engine.begin() as conn:
+        user_ids = [
+            conn.execute(
+                text("""
+                    INSERT INTO users (username, display_name, password_hash, server_id)
+                    VALUES (:username, :username, 'x', :server_id)
+                    RETURNING user_id
+                """),
+                {"username": f"{prefix}{i}", "server_id": SERVER_ID},
+            ).scalar_one()
+            for i in (1, 2)
+        ]
+        for user_id in user_ids:
+            conn.execute(
+                text("INSERT INTO pets (user_id, pet_name, energy, status, score) VALUES (:u, 'p', 100, 'ACTIVE', 0)"),
+                {"u": user_id},
+            )
+    yield user_ids
+    with main.engine.begin() as conn:
+        conn.execute(text("DELETE FROM users WHERE user_id = ANY(:ids)"), {"ids": user_ids})
+
+
+def report(main, player1_id, player2_id, player1_score, player2_score, key):
+    db = main.SessionLocal()
+    try:
+        request = main.BattleResultRequest(
+            player1_id=player1_id,
+            player2_id=player2_id,
+            player1_score=player1_score,
+            player2_score=player2_score,
+            server_id=SERVER_ID,
+            idempotency_key=key,
+        )
+        return main.report_battle_result(request, db=db)
+    finally:
+        db.close()
+
+
+def run_concurrently(calls):
+    """所有呼叫在 barrier 之後同時開始"""
+    barrier = threading.Barrier(len(calls))
+
+    def run(call):
+        barrier.wait()
+        return call()
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        return list(pool.map(run, calls))
+
+
+def pet_score(main, user_id):
+    with main.engine.connect() as conn:
+        return conn.execute(text("SELECT score FROM pets WHERE user_id = :u"), {"u": user_id}).scalar_one()
+
+
+def battle_count(main, user_id):
+    with main.engine.connect() as conn:
+        return conn.execute(
+            text("SELECT COUNT(*) FROM battles WHERE player1_id = :u OR player2_id = :u"), {"u": user_id}
+        ).scalar_one()
+
+
+def test_same_idempotency_key_scored_once(main, players):
+    p1, p2 = players
+    key = f"test_{uuid.uuid4().hex}"
+    results = run_concurrently([lambda: report(main, p1, p2, 10, 3, key)] * 2)
+
+    assert all(r.success for r in results)
+    assert {r.data["battle_id"] for r in results} == {results[0].data["battle_id"]}
+    assert {r.data["winner_user_id"] for r in results} == {p1}
+    assert battle_count(main, p1) == 1
+    assert pet_score(main, p1) == main.BATTLE_WIN_BONUS
+    assert pet_score(main, p2) == 0
+
+
+def test_concurrent_wins_do_not_lose_updates(main, players):
+    p1, p2 = players
+    battles = 8
+    results = run_concurrently([
+        (lambda key=f"test_{uuid.uuid4().hex}": report(main, p1, p2, 10, 3, key))
+        for _ in range(battles)
+    ])
+
+    assert all(r.success for r in results)
+    assert len({r.data["battle_id"] for r in results}) == battles
+    assert battle_count(main, p1) == battles
+    assert pet_score(main, p1) == battles * main.BATTLE_WIN_BONUS
+
+
+def test_tie_has_no_winner(main, players):
+    p1, p2 = players
+    result = report(main, p1, p2, 5, 5, f"test_{uuid.uuid4().hex}")
+
+    assert result.success and result.data["winner_user_id"] is None
+    assert pet_score(main, p1) == pet_score(main, p2) == 0
+
+
+def test_new_result_is_one_round_trip(main, players):
+    p1, p2 = players
+    report(main, p1, p2, 1, 0, f"test_{uuid.uuid4().hex}")  # 先把連線建好（連線初始化的查詢不算）
+
+    counter = [0]
+    token = main._db_query_counter.set(counter)
+    try:
+        result = report(main, p1, p2, 10, 3, f"test_{uuid.uuid4().hex}")
+    finally:
+        main._db_query_counter.reset(token)
+
+    assert result.success
+    assert counter[0] == 1
@@ -0,0 +1,82 @@
+# tests/test_login.py
+
+"""
+登入簽出的 token 的 server_id 以 DB 為準（需要 PostgreSQL，見 conftest.py）：
+USER_LOGIN_CACHE 是每個 worker 各一份，別的 worker 做完 switch_server 時這裡的快取還沒清
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from app.auth import verify_token
+from conftest import TEST_DATABASE_URL
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="PET_TEST_DATABASE_URL 沒有設定")
+
+PASSWORD = "correct horse"
+
+
+@pytest.fixture(scope="module")
+def main():
+    from sqlalchemy.exc import OperationalError
+
+    from app import main
+
+    try:
+        with main.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError as e:
+        pytest.skip(f"連不上測試資料庫：{e}")
+    return main
+
+
+@pytest.fixture
+def username(main):
+    from app.passwords import hash_password_sync
+
+    name = f"t_{uuid.uuid4().hex[:12]}"
+    with main.engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO users (username, display_name, password_hash, server_id)
+                VALUES (:username, :username, :password_hash, 'A')
+            """),
+            {"username": name, "password_hash": hash_password_sync(PASSWORD)},
+        )
+    yield name
+    main.USER_LOGIN_CACHE.invalidate(name)
+    with main.engine.begin() as conn:
+        conn.execute(text("DELETE FROM users WHERE username = :u"), {"u": name})
+
+
+def login(main, username):
+    db = main.SessionLocal()
+    try:
+        return main.login(main.LoginRequest(username=username, password=PASSWORD), db=db)
+    finally:
+        db.close()
+
+
+def test_token_uses_server_id_from_db_not_login_cache(main, username):
+    first = login(main, username)
+    assert first.success and first.data.server_id == "A"
+    assert main.USER_LOGIN_CACHE.get(username) is not main.MISSING
+
+    # 另一個 worker 做了 switch_server：DB 改了，這個 worker 的 USER_LOGIN_CACHE 沒被清
+    with main.engine.begin() as conn:
+        conn.execute(text("UPDATE users SET server_id = 'B' WHERE username = :u"), {"u": username})
+
+    second = login(main, username)
+    assert second.success and second.data.server_id == "B"
+    assert verify_token(second.data.token).server_id == "B"
+
+
+def test_wrong_password_still_rejected(main, username):
+    db = main.SessionLocal()
+    try:
+        result = main.login(main.LoginRequest(username=username, password="nope"), db=db)
+    finally:
+        db.close()
+    assert not result.success and result.error.code == "INVALID_CREDENTIALS"
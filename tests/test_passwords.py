@@ -0,0 +1,64 @@
+# tests/test_passwords.py
+
+"""
+密碼雜湊 pool：等太久回 HashingBusy（不是 500）；名額要等 worker 真的做完才還；
+worker 死掉的 pool 要丟掉重建
+"""
+
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from app import passwords
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    monkeypatch.setattr(passwords, "_inflight", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(passwords, "HASH_TIMEOUT", 0.2)
+    yield
+    passwords.shutdown_pool()
+
+
+def test_timeout_raises_hashing_busy(one_slot):
+    with pytest.raises(passwords.HashingBusy):
+        passwords._run("verify", time.sleep, 1.0)
+
+
+def test_slot_held_until_worker_finishes(one_slot):
+    # 先讓 pool 起來，不然第一次 spawn worker 的時間會算進下面的 timeout
+    passwords._run("hash", time.sleep, 0)
+
+    with pytest.raises(passwords.HashingBusy):
+        passwords._run("verify", time.sleep, 1.0)
+    # 上一個還在 worker 裡跑：這個要馬上被拒絕，不能再排進 pool
+    started = time.perf_counter()
+    with pytest.raises(passwords.HashingBusy):
+        passwords._run("verify", time.sleep, 0)
+    assert time.perf_counter() - started < 0.1
+
+    time.sleep(1.2)
+    assert passwords._run("verify", time.sleep, 0) is None
+
+
+def test_broken_pool_is_discarded_on_submit(one_slot):
+    passwords._run("hash", time.sleep, 0)
+    pool = passwords._pool
+    # 沒有請求在等的時候 worker 被砍：下一次 submit 才會丟 BrokenProcessPool
+    for process in list(pool._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+    deadline = time.monotonic() + 5
+    while not pool._broken and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool._broken
+
+    with pytest.raises(passwords.HashingBusy):
+        passwords._run("verify", time.sleep, 0)
+    assert passwords._pool is None
+
+    # 名額有還、下一個請求重建 pool
+    assert passwords._run("verify", time.sleep, 0) is None
+    assert passwords._pool is not pool
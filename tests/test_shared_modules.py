@@ -0,0 +1,63 @@
+# tests/test_shared_modules.py
+
+"""
+backend 與 ws-server 分開部署，metrics.py / auth.py 各自帶一份：
+這裡比對兩份的程式碼（不含 docstring / 檔頭註解 / import），改了一邊忘了另一邊就會失敗
+"""
+
+import ast
+import os
+
+from conftest import ROOT
+
+BACKEND = os.path.join(ROOT, "backend", "app")
+WS_COMMON = os.path.join(ROOT, "ws-server", "common")
+
+
+def _definitions(path: str) -> dict:
+    """top-level 的 def / class / 常數 → 去掉 docstring 後的 AST dump"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            body = node.body
+            if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+                    and isinstance(body[0].value.value, str):
+                node.body = body[1:] or [ast.Pass()]
+    result = {}
+    for node in tree.body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            result[node.name] = ast.dump(node)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    result[target.id] = ast.dump(node)
+    return result
+
+
+def _assert_same(name: str, required: set) -> None:
+    backend = _definitions(os.path.join(BACKEND, name))
+    ws = _definitions(os.path.join(WS_COMMON, name))
+    shared = backend.keys() & ws.keys()
+    assert required <= shared, f"{name} 少了共用的定義：{sorted(required - shared)}"
+    different = sorted(key for key in shared if backend[key] != ws[key])
+    assert not different, f"backend/app/{name} 與 ws-server/common/{name} 不一致：{different}"
+
+
+def test_metrics_copies_in_sync():
+    backend = _definitions(os.path.join(BACKEND, "metrics.py"))
+    ws = _definitions(os.path.join(WS_COMMON, "metrics.py"))
+    assert backend.keys() == ws.keys()
+    _assert_same("metrics.py", set(backend))
+
+
+def test_auth_copies_in_sync():
+    _assert_same("auth.py", {"AuthError", "TokenClaims", "issue_token", "verify_token", "_sign", "_required_secret", "TOKEN_SECRET"})
+
+
+def test_battle_bonus_matches_backend():
+    from app.main import BATTLE_WIN_BONUS as backend_bonus
+    from common.db import BATTLE_WIN_BONUS as ws_bonus
+
+    assert ws_bonus == backend_bonus
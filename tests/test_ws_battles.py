@@ -0,0 +1,90 @@
+# tests/test_ws_battles.py
+
+"""
+ws-server 的對戰結算：正常結束與斷線判負都要寫進 battle_writer，計分跟後端 /api/battle/result 一樣
+（勝者 +BATTLE_WIN_BONUS；平手 winner_user_id 是 None、雙方都不加分）
+"""
+
+import asyncio
+import os
+
+import pytest
+
+# ws-server 不連 DB（要在 import common.shard 之前設定）
+os.environ["WS_DATABASE_URL"] = ""
+
+from common import shard  # noqa: E402
+from common.db import BATTLE_WIN_BONUS  # noqa: E402
+from common.protocol import BattlePayload, BattleUpdatePayload  # noqa: E402
+
+
+class RecordingWriter:
+    def __init__(self) -> None:
+        self.rows = []
+
+    def put(self, row) -> bool:
+        self.rows.append(row)
+        return True
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    recorder = RecordingWriter()
+    monkeypatch.setattr(shard, "battle_writer", recorder)
+    return recorder
+
+
+@pytest.fixture
+def room():
+    room = shard.manager.create_battle("A", 1, 2)
+    room.state = "running"
+    yield room
+    shard.manager.finish_battle(room.battle_id)
+
+
+def result_of(room):
+    asyncio.run(shard.handle_battle_result("A", room.player1_id, BattlePayload(battle_id=room.battle_id)))
+
+
+def test_win_scores_bonus(writer, room):
+    room.scores = {1: 9, 2: 4}
+    result_of(room)
+    assert writer.rows == [(room.battle_id, "A", 1, 2, 9, 4, 1, BATTLE_WIN_BONUS, 0)]
+    assert shard.manager.get_battle(room.battle_id) is None
+
+
+def test_tie_has_no_winner(writer, room):
+    room.scores = {1: 6, 2: 6}
+    result_of(room)
+    assert writer.rows == [(room.battle_id, "A", 1, 2, 6, 6, None, 0, 0)]
+
+
+def test_forfeit_on_disconnect_is_persisted(writer, room):
+    room.scores = {1: 8, 2: 3}
+    asyncio.run(shard.handle_battle_disconnect("A", 1))
+    # 斷線的是 player1：不管分數，player2 勝
+    assert writer.rows == [(room.battle_id, "A", 1, 2, 8, 3, 2, 0, BATTLE_WIN_BONUS)]
+    assert shard.manager.get_battle(room.battle_id) is None
+
+
+def test_disconnect_before_start_is_not_scored(writer, room):
+    room.state = "waiting"
+    asyncio.run(shard.handle_battle_disconnect("A", 1))
+    assert writer.rows == []
+
+
+@pytest.mark.parametrize("outsider", [3, 1])
+def test_outsider_cannot_update_or_settle(writer, room, outsider):
+    # 3：同 server 的第三人；1 但從別台 server 送來：都不是這場的玩家
+    server_id = "A" if outsider == 3 else "B"
+    room.scores = {1: 2, 2: 5}
+    update = BattleUpdatePayload(battle_id=room.battle_id, score=999, state="finished")
+    asyncio.run(shard.handle_battle_update(server_id, outsider, update))
+    asyncio.run(shard.handle_battle_ready(server_id, outsider, BattlePayload(battle_id=room.battle_id)))
+    asyncio.run(shard.handle_battle_result(server_id, outsider, BattlePayload(battle_id=room.battle_id)))
+
+    assert room.scores == {1: 2, 2: 5}
+    assert room.state == "running"
+    assert room.ready == {1: False, 2: False}
+    assert writer.rows == []
+    assert shard.manager.get_battle(room.battle_id) is room
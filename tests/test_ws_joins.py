@@ -0,0 +1,71 @@
+# tests/test_ws_joins.py
+
+"""
+join 廣播的合併（JoinCoalescer）：時間窗內的 join 只送一次、閒置時不排任何 timer、廣播失敗不重試
+"""
+
+import asyncio
+import os
+
+# ws-server 不連 DB（要在 import common.shard 之前設定）
+os.environ["WS_DATABASE_URL"] = ""
+
+from common import shard  # noqa: E402
+
+
+def test_joins_within_window_are_broadcast_once(monkeypatch):
+    batches = []
+
+    async def fake_broadcast(batch):
+        batches.append(list(batch))
+
+    monkeypatch.setattr(shard, "broadcast_player_joins", fake_broadcast)
+
+    async def scenario():
+        coalescer = shard.JoinCoalescer(0.01)
+        assert coalescer.handle is None
+        for user_id in (1, 2, 3):
+            coalescer.add(("A", user_id))
+        await asyncio.sleep(0.05)
+        assert coalescer.handle is None and coalescer.pending == []
+        coalescer.add(("A", 4))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert batches == [[("A", 1), ("A", 2), ("A", 3)], [("A", 4)]]
+
+
+def test_failed_broadcast_is_not_retried(monkeypatch):
+    calls = []
+
+    async def failing_broadcast(batch):
+        calls.append(list(batch))
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(shard, "broadcast_player_joins", failing_broadcast)
+
+    async def scenario():
+        coalescer = shard.JoinCoalescer(0.01)
+        coalescer.add(("A", 1))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert calls == [[("A", 1)]]
+
+
+def test_stop_drops_pending_joins(monkeypatch):
+    calls = []
+
+    async def fake_broadcast(batch):
+        calls.append(batch)
+
+    monkeypatch.setattr(shard, "broadcast_player_joins", fake_broadcast)
+
+    async def scenario():
+        coalescer = shard.JoinCoalescer(0.01)
+        coalescer.add(("A", 1))
+        coalescer.stop()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert calls == []
@@ -0,0 +1,78 @@
+# tests/test_ws_positions.py
+
+"""
+位置以 server 為準：JSON 路徑跟 binary 一樣擋掉 NaN / inf，join_lobby 帶的位置跟移動一樣拉回地圖內
+"""
+
+import asyncio
+import os
+import struct
+
+import pytest
+
+# ws-server 不連 DB（要在 import common.shard 之前設定）
+os.environ["WS_DATABASE_URL"] = ""
+
+from common import shard  # noqa: E402
+from common.protocol import OP_UPDATE_POSITION, MessageRejected, decode_binary  # noqa: E402
+
+SERVER_ID = "A"
+USER_ID = 901
+
+
+def decode_json(msg_type, payload):
+    route = shard.router.get(msg_type)
+    return route.decode(payload)
+
+
+@pytest.mark.parametrize("msg_type", ["update_position", "pet_state_update", "join_lobby"])
+@pytest.mark.parametrize("bad", ['"nan"', '"inf"', '"-Infinity"', "1e999"])
+def test_json_rejects_non_finite_coordinates(msg_type, bad):
+    with pytest.raises(MessageRejected) as exc:
+        decode_json(msg_type, f'{{"x": {bad}, "y": 10}}'.encode())
+    assert exc.value.reason == "invalid"
+
+
+def test_json_accepts_numeric_strings():
+    payload = decode_json("update_position", b'{"x": "12.5", "y": 3}')
+    assert (payload.x, payload.y) == (12.5, 3.0)
+
+
+def test_binary_rejects_non_finite_coordinates():
+    frame = struct.pack("<Bff", OP_UPDATE_POSITION, float("nan"), 1.0)
+    with pytest.raises(MessageRejected) as exc:
+        decode_binary(frame)
+    assert exc.value.reason == "invalid"
+
+
+@pytest.fixture
+def lobby(monkeypatch):
+    monkeypatch.setattr(shard, "join_coalescer", shard.JoinCoalescer(60))
+    corrections = []
+
+    async def record(server_id, user_id, reason, x, y, cx, cy):
+        corrections.append((reason, cx, cy))
+
+    monkeypatch.setattr(shard, "correct_position", record)
+    yield corrections
+    shard.join_coalescer.stop()
+    shard.manager.lobby_player_states.get(SERVER_ID, {}).pop(USER_ID, None)
+    shard.manager.last_position_at.pop((SERVER_ID, USER_ID), None)
+
+
+def join(payload_json):
+    payload = decode_json("join_lobby", payload_json)
+    asyncio.run(shard.handle_join_lobby(SERVER_ID, USER_ID, payload))
+    return shard.manager.get_player_state(SERVER_ID, USER_ID)
+
+
+def test_join_position_is_clamped(lobby):
+    state = join(b'{"x": 5000, "y": -30}')
+    assert (state.x, state.y) == (float(shard.WORLD_WIDTH), 0.0)
+    assert lobby == [("bounds", float(shard.WORLD_WIDTH), 0.0)]
+
+
+def test_join_position_inside_world_is_kept(lobby):
+    state = join(b'{"x": 40, "y": 60}')
+    assert (state.x, state.y) == (40.0, 60.0)
+    assert lobby == []
@@ -0,0 +1,46 @@
+# tests/test_ws_ratelimit.py
+
+"""
+未知 type、解不開、太大的 frame 也要扣額度（共用 ratelimit.INVALID bucket），持續亂送的連線會被斷線
+"""
+
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+# ws-server 不連 DB（要在 import common.shard 之前設定）
+os.environ["WS_DATABASE_URL"] = ""
+
+from common import ratelimit, shard  # noqa: E402
+from common.auth import issue_token  # noqa: E402
+
+BAD_FRAMES = {
+    "unknown_type": '{"type": "no_such_event"}',
+    "invalid": "{not json",
+    "too_large": '{"type": "chat_message", "payload": {"content": "' + "x" * (shard.router.max_bytes + 1) + '"}}',
+}
+
+
+def test_invalid_bucket_counts_toward_disconnect():
+    limiter = ratelimit.ConnectionLimiter(limits={ratelimit.INVALID: (1, 2)}, max_drops=3, window=60)
+    results = [limiter.allow(ratelimit.INVALID) for _ in range(5)]
+    assert results == [True, True, False, False, False]
+    assert limiter.should_disconnect
+
+
+@pytest.mark.parametrize("kind", sorted(BAD_FRAMES))
+def test_flood_of_bad_frames_disconnects(kind):
+    rate, burst = ratelimit.LIMITS[ratelimit.INVALID]
+    frames = int(burst) + ratelimit.MAX_DROPS + 5
+
+    # 不跑 lifespan（writer / listener 不用啟動）
+    client = TestClient(shard.app)
+    token = issue_token(902, shard.SERVER_ID)
+    with pytest.raises(WebSocketDisconnect) as excinfo:
+        with client.websocket_connect(f"/ws/?token={token}") as ws:
+            for _ in range(frames):
+                ws.send_text(BAD_FRAMES[kind])
+            ws.receive_text()
+    assert excinfo.value.code == 1008
@@ -0,0 +1,81 @@
+# tests/test_ws_writers.py
+
+"""
+BatchWriter：資料本身寫不進去時拆批次，只丟壞掉的那幾筆；連線類錯誤照舊整批重試
+"""
+
+import asyncio
+
+import asyncpg
+import pytest
+
+from common import writers
+from common.db import is_bad_data_error
+
+
+class FakeTable:
+    """整批寫入（一個 statement）：只要有一筆是壞的整批都失敗"""
+
+    def __init__(self, bad=(), transient_failures=0) -> None:
+        self.bad = set(bad)
+        self.transient_failures = transient_failures
+        self.rows = []
+        self.calls = 0
+
+    async def insert(self, batch) -> None:
+        self.calls += 1
+        if self.transient_failures:
+            self.transient_failures -= 1
+            raise asyncpg.PostgresConnectionError("connection lost")
+        if self.bad & set(batch):
+            raise asyncpg.ForeignKeyViolationError("violates foreign key constraint")
+        self.rows.extend(batch)
+
+
+def make_writer(table, **kwargs):
+    writer = writers.BatchWriter(
+        "test", table.insert, lambda *args, **kw: None, is_bad_data=is_bad_data_error, **kwargs,
+    )
+    writers._writers.remove(writer)
+    return writer
+
+
+def flush(writer, batch):
+    asyncio.run(writer._flush(batch))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    async def sleep(_delay):
+        return None
+
+    monkeypatch.setattr(writers.asyncio, "sleep", sleep)
+
+
+@pytest.mark.parametrize("bad", [{3}, {0, 7}, {0, 1, 2, 3, 4, 5, 6, 7}])
+def test_bad_rows_are_dropped_alone(bad):
+    table = FakeTable(bad=bad)
+    flush(make_writer(table), list(range(8)))
+    assert table.rows == [row for row in range(8) if row not in bad]
+
+
+def test_connection_errors_retry_the_whole_batch():
+    table = FakeTable(transient_failures=2)
+    flush(make_writer(table, max_retries=5), list(range(8)))
+    assert table.rows == list(range(8))
+    assert table.calls == 3
+
+
+def test_connection_errors_are_not_split():
+    table = FakeTable(transient_failures=100)
+    flush(make_writer(table, max_retries=3), list(range(8)))
+    assert table.rows == []
+    assert table.calls == 3
+
+
+def test_bad_data_classification():
+    assert is_bad_data_error(asyncpg.ForeignKeyViolationError("fk"))
+    assert is_bad_data_error(asyncpg.DataError("bad value"))
+    assert not is_bad_data_error(asyncpg.PostgresConnectionError("gone"))
+    assert not is_bad_data_error(asyncpg.QueryCanceledError("statement timeout"))
+    assert not is_bad_data_error(OSError("refused"))
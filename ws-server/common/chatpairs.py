@@ -0,0 +1,119 @@
+# ws-server/common/chatpairs.py
+
+"""
+聊天配對（chat_request_accept 之後兩人才能互傳 chat_message）
+
+以前是一個全域的 Set[(user1, user2)]：不分 server、斷線也不清，process 跑越久越大。
+ChatApprovalStore：
+
+- 以 (server_id, 較小 user_id, 較大 user_id) 為 key，不同 shard 互不影響
+- adjacency map：{(server_id, user_id): {對方 user_id, ...}}，玩家離開時 O(degree) 清掉他所有配對
+- TTL：有在聊天（is_approved 查到）就延長；太久沒講話的配對過期
+- LRU：最多 max_pairs 組，超過擠掉最久沒用的
+
+所有配對的 TTL 一樣、每次使用都移到最後，OrderedDict 的順序就是到期順序：
+清過期的只要從最前面開始看，不用掃整張表。
+
+環境變數：
+- WS_CHAT_PAIR_TTL_S    配對多久沒用就過期，預設 1800
+- WS_CHAT_PAIR_MAX      每台最多保留幾組配對，預設 50000
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple
+
+CHAT_PAIR_TTL_SECONDS = float(os.environ.get("WS_CHAT_PAIR_TTL_S", "1800"))
+CHAT_PAIR_MAX = int(os.environ.get("WS_CHAT_PAIR_MAX", "50000"))
+
+PairKey = Tuple[str, int, int]
+
+
+def _pair_key(server_id: str, user1_id: int, user2_id: int) -> PairKey:
+    if user1_id > user2_id:
+        user1_id, user2_id = user2_id, user1_id
+    return (server_id, user1_id, user2_id)
+
+
+class ChatApprovalStore:
+    def __init__(self, ttl: float = CHAT_PAIR_TTL_SECONDS, max_pairs: int = CHAT_PAIR_MAX) -> None:
+        self.ttl = ttl
+        self.max_pairs = max_pairs
+        # pair → 到期時間（time.monotonic()），最舊的在最前面
+        self._pairs: "OrderedDict[PairKey, float]" = OrderedDict()
+        # (server_id, user_id) → 已配對的對方
+        self._peers: Dict[Tuple[str, int], Set[int]] = {}
+
+    def approve(self, server_id: str, user1_id: int, user2_id: int) -> PairKey:
+        now = time.monotonic()
+        key = _pair_key(server_id, user1_id, user2_id)
+        self._pairs[key] = now + self.ttl
+        self._pairs.move_to_end(key)
+        self._peers.setdefault((server_id, user1_id), set()).add(user2_id)
+        self._peers.setdefault((server_id, user2_id), set()).add(user1_id)
+        self.prune(now)
+        while len(self._pairs) > self.max_pairs:
+            oldest, _ = self._pairs.popitem(last=False)
+            self._unlink(oldest)
+        return key
+
+    def is_approved(self, server_id: str, user1_id: int, user2_id: int) -> bool:
+        """查到就延長 TTL（還在聊天的配對不會過期）"""
+        key = _pair_key(server_id, user1_id, user2_id)
+        expires_at = self._pairs.get(key)
+        if expires_at is None:
+            return False
+        now = time.monotonic()
+        if expires_at <= now:
+            del self._pairs[key]
+            self._unlink(key)
+            return False
+        self._pairs[key] = now + self.ttl
+        self._pairs.move_to_end(key)
+        return True
+
+    def drop_user(self, server_id: str, user_id: int) -> int:
+        """玩家離開：清掉他的所有配對（對方那邊的 adjacency 也一起清），回傳清掉幾組"""
+        peers = self._peers.pop((server_id, user_id), None)
+        if not peers:
+            return 0
+        for peer_id in peers:
+            self._pairs.pop(_pair_key(server_id, user_id, peer_id), None)
+            self._discard_peer(server_id, peer_id, user_id)
+        return len(peers)
+
+    def prune(self, now: float | None = None) -> int:
+        """從最舊的開始清過期的配對"""
+        if now is None:
+            now = time.monotonic()
+        removed = 0
+        while self._pairs:
+            key, expires_at = next(iter(self._pairs.items()))
+            if expires_at > now:
+                break
+            del self._pairs[key]
+            self._unlink(key)
+            removed += 1
+        return removed
+
+    def pairs(self, server_id: str) -> List[Tuple[int, int]]:
+        """這台還有效的配對（重啟交接的 snapshot 用）"""
+        self.prune()
+        return [(u1, u2) for sid, u1, u2 in self._pairs if sid == server_id]
+
+    def _unlink(self, key: PairKey) -> None:
+        server_id, user1_id, user2_id = key
+        self._discard_peer(server_id, user1_id, user2_id)
+        self._discard_peer(server_id, user2_id, user1_id)
+
+    def _discard_peer(self, server_id: str, user_id: int, peer_id: int) -> None:
+        peers = self._peers.get((server_id, user_id))
+        if peers is None:
+            return
+        peers.discard(peer_id)
+        if not peers:
+            del self._peers[(server_id, user_id)]
+
+    def __len__(self) -> int:
+        return len(self._pairs)
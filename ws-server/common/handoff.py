@@ -0,0 +1,77 @@
+# ws-server/common/handoff.py
+
+"""
+ws-server 重啟時的狀態交接（drain → snapshot → 新 process restore）
+
+大廳位置、聊天配對、對戰房間都只在 ConnectionManager 的記憶體裡，重啟就全部消失；
+這裡負責把 snapshot 寫到本機檔案、新 process 啟動時讀回來：
+
+- save_snapshot：msgspec 編成 JSON，先寫暫存檔再 os.replace，寫到一半當掉也不會留下壞檔
+- load_snapshot：讀完就刪掉（之後 crash 重啟不會又還原一次舊狀態）；
+  超過 max_age 秒的視為過期（例如停機很久才啟動），直接丟掉
+
+snapshot 的型別由呼叫端決定（要有 saved_at: float，time.time()）。
+
+什麼時候 drain：
+- uvicorn 收到 SIGTERM：install_sigterm_hook 把 uvicorn 原本的 handler 包起來，
+  先在 event loop 上呼叫 on_drain（存 snapshot），uvicorn 之後才會用 1012 關掉所有連線
+- 部署腳本也可以先呼叫 POST /internal/drain，再送 SIGTERM
+"""
+
+import os
+import signal
+import threading
+import time
+from typing import Callable, Optional, Type, TypeVar
+
+import msgspec
+
+T = TypeVar("T")
+
+
+def save_snapshot(path: str, snapshot: object) -> int:
+    """寫入 snapshot，回傳 bytes 數"""
+    data = msgspec.json.encode(snapshot)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def load_snapshot(path: str, snapshot_type: Type[T], max_age: float) -> Optional[T]:
+    """沒有檔案 / 過期回傳 None；格式不對會丟 msgspec.ValidationError / DecodeError（檔案一樣會被刪掉）"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    snapshot = msgspec.json.decode(data, type=snapshot_type)
+    if time.time() - snapshot.saved_at > max_age:  # type: ignore[attr-defined]
+        return None
+    return snapshot
+
+
+def install_sigterm_hook(loop, on_drain: Callable[[str], None]) -> bool:
+    """
+    在 uvicorn 的 SIGTERM handler 前面插一段：先排 on_drain("sigterm") 到 event loop 上，
+    再交給 uvicorn（uvicorn 每 0.1 秒才檢查一次 should_exit，on_drain 一定先跑）。
+    不在 main thread（例如 TestClient）時裝不了，回傳 False。
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handler(sig, frame) -> None:
+        loop.call_soon_threadsafe(on_drain, "sigterm")
+        if callable(previous):
+            previous(sig, frame)
+
+    signal.signal(signal.SIGTERM, handler)
+    return True
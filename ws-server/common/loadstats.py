@@ -0,0 +1,87 @@
+# ws-server/common/loadstats.py
+
+"""
+ws shard 的即時負載統計（給 GET / 回報，後端 placement 用來分配玩家）
+
+- LoopLagMonitor：背景 task 每 interval 秒 sleep 一次，實際醒來比預期晚多少就是 event loop lag
+  （有 handler 做同步重活時，所有玩家都會被卡住這麼久）；每次醒來也更新 last_beat，
+  watchdog 的背景 thread 看 last_beat 多久沒動就知道 loop 正卡在同步程式碼裡
+- RateCounter：最近 window 秒的每秒事件數，熱路徑只做一次整數除法 + list 寫入
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.05, window: int = 200) -> None:
+        self.interval = interval
+        # 最近 window 次量測（預設 200 * 0.05s = 最近 10 秒）
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+        # 最後一次醒來的 time.monotonic()（給別的 thread 讀）
+        self.last_beat = time.monotonic()
+        # 每次量到 lag 時呼叫（例如 watchdog 寫 histogram）
+        self.on_sample: Optional[Callable[[float], None]] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_beat = time.monotonic()
+            self._samples.append(lag)
+            if self.on_sample is not None:
+                self.on_sample(lag)
+
+    def start(self) -> None:
+        if self._task is None:
+            self.last_beat = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def last(self) -> float:
+        return self._samples[-1] if self._samples else 0.0
+
+    @property
+    def max_recent(self) -> float:
+        return max(self._samples) if self._samples else 0.0
+
+
+class RateCounter:
+    """最近 window 秒的事件數 / 秒（每秒一格的環狀陣列）"""
+
+    def __init__(self, window: int = 10) -> None:
+        self.window = window
+        # 每格：(秒數, 次數)
+        self._buckets: List[Tuple[int, int]] = [(0, 0)] * window
+
+    def mark(self, amount: int = 1) -> None:
+        second = int(time.monotonic())
+        index = second % self.window
+        bucket_second, count = self._buckets[index]
+        if bucket_second == second:
+            self._buckets[index] = (second, count + amount)
+        else:
+            self._buckets[index] = (second, amount)
+
+    def per_second(self) -> float:
+        # 不算「目前這一秒」（還沒滿），取前 window - 1 個完整秒的平均
+        now = int(time.monotonic())
+        total = sum(
+            count for second, count in self._buckets
+            if now - self.window < second < now
+        )
+        return total / (self.window - 1)
@@ -0,0 +1,155 @@
+# ws-server/common/logs.py
+
+"""
+ws-server 共用 logging 設定
+
+- event loop 只負責把 LogRecord 丟進 queue（QueueHandler），真正的格式化 / stdout 寫入
+  由 QueueListener 的背景 thread 做，stdout 是 pipe 時也不會卡住 event loop
+- 延遲格式化：訊息用 "%s" 樣板 + args，被 level 擋掉或被抽樣丟掉的事件完全不做字串格式化
+  （注意：args 要傳「不會再被改動」的值，格式化是稍後在背景 thread 才做）
+- 高頻事件（例如 BATTLE_UPDATE）可以抽樣：每 N 筆只留 1 筆
+- PET_LOG_FORMAT=json 時輸出一行一個 JSON，方便丟給 log 收集器
+
+環境變數：
+- PET_LOG_LEVEL    預設 INFO
+- PET_LOG_FORMAT   text（預設）/ json
+- PET_LOG_SAMPLE   例如 "BATTLE_UPDATE=20,OTHER_PET_MOVED=50"
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Dict, Optional
+
+# 整個 process 共用一條 queue + 一個 listener thread
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    標準 QueueHandler.prepare() 會在呼叫端先把訊息格式化好；
+    這裡是同一個 process 內的 queue，不需要 pickle，直接把 record 原樣丟過去，
+    格式化留給 listener thread。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _service_name(record: logging.LogRecord) -> str:
+    # logger 名稱是 pet.<name>，例如 pet.wsA
+    return record.name.rpartition(".")[2]
+
+
+class TextFormatter(logging.Formatter):
+    """跟原本 print 的格式一樣：[wsA][EVENT] message"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = getattr(record, "event", record.levelname)
+        text = f"[{_service_name(record)}][{event}] {record.getMessage()}"
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "service": _service_name(record),
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _parse_sample_rates(raw: str) -> Dict[str, int]:
+    rates: Dict[str, int] = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        event, _, every = item.partition("=")
+        try:
+            rates[event.strip()] = max(1, int(every))
+        except ValueError:
+            continue
+    return rates
+
+
+class EventLogger:
+    """
+    包一層 logging.Logger：
+    - level 先擋（isEnabledFor），被擋掉的事件連 LogRecord 都不建立
+    - 高頻事件依 sample_rates 每 N 筆留 1 筆（用計數器，不用 random）
+    """
+
+    def __init__(self, logger: logging.Logger, sample_rates: Dict[str, int]) -> None:
+        self.logger = logger
+        self.sample_rates = sample_rates
+        self._seen: Dict[str, int] = {}
+
+    def __call__(self, event: str, message: str, *args: object, level: int = logging.INFO) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        every = self.sample_rates.get(event)
+        if every is not None:
+            seen = self._seen.get(event, 0)
+            self._seen[event] = seen + 1
+            if seen % every:
+                return
+        # 直接 makeRecord + handle，略過 Logger.log 裡的 findCaller（逐層找呼叫端 frame，很貴）
+        logger = self.logger
+        record = logger.makeRecord(
+            logger.name, level, "", 0, message, args, None, extra={"event": event},
+        )
+        logger.handle(record)
+
+
+def setup_logging(name: str, default_samples: Optional[Dict[str, int]] = None) -> EventLogger:
+    """
+    建立 pet.<name> logger，掛上 QueueHandler，並確保 QueueListener 背景 thread 有在跑。
+    同一個 process 重複呼叫只會有一個 listener。
+    """
+    global _listener
+
+    level_name = os.environ.get("PET_LOG_LEVEL", "INFO").upper()
+    fmt = os.environ.get("PET_LOG_FORMAT", "text").lower()
+    sample_rates = dict(default_samples or {})
+    sample_rates.update(_parse_sample_rates(os.environ.get("PET_LOG_SAMPLE", "")))
+
+    # 不需要的 LogRecord 欄位不收集，省下每筆 record 的 thread / process 查詢
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    logger = logging.getLogger(f"pet.{name}")
+    logger.setLevel(getattr(logging, level_name, logging.INFO))
+    logger.propagate = False
+
+    if not logger.handlers:
+        logger.addHandler(_DeferredQueueHandler(_queue))
+
+    if _listener is None:
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        _listener = logging.handlers.QueueListener(_queue, stream)
+        _listener.start()
+        atexit.register(stop_logging)
+
+    return EventLogger(logger, sample_rates)
+
+
+def stop_logging() -> None:
+    """把 queue 裡剩下的 log 寫完再停掉背景 thread（shutdown 時呼叫）。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
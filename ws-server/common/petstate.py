@@ -0,0 +1,246 @@
+# ws-server/common/petstate.py
+
+"""
+大廳裡的寵物狀態以 PostgreSQL 為準（energy / status / score 不再相信前端送來的值）
+
+- PetStateCache：read-through 快取。join_lobby 時查一次（沒命中才打 DB，同一位玩家同時有
+  多個查詢只會打一次），之後靠 pet_events 的通知更新，不會每則訊息都查 DB
+- PetEventListener：用一條獨立的 asyncpg 連線 LISTEN pet_events；
+  backend（Pi 回報 / 對戰結果）、cron（體力衰減）、ws-server 自己的對戰結果寫入，
+  都在同一個 transaction 裡 pg_notify，commit 後才送到這裡，不會看到沒寫進去的值
+
+pet_events 的 payload（JSON）：
+    {"event": "pet_changed", "source": "pi", "user_id": 7, "pet_id": 3, "energy": 80, "status": "ACTIVE", "score": 42}
+    {"event": "pets_invalidated", "source": "decay"}        # 整批改過：大廳裡的人重新查一次
+
+LISTEN 斷線期間的通知會漏掉，所以每次（重新）連上都當成一次 pets_invalidated。
+
+環境變數：
+- WS_PET_CACHE_TTL_S      快取最多用多久（通知漏掉時的保險），預設 300
+- WS_PET_CACHE_SIZE       最多快取幾位玩家，預設 10000
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+import asyncpg
+import msgspec
+
+from common import db
+from common.metrics import Counter
+
+CHANNEL = "pet_events"
+CACHE_TTL_SECONDS = float(os.environ.get("WS_PET_CACHE_TTL_S", "300"))
+CACHE_MAX_SIZE = int(os.environ.get("WS_PET_CACHE_SIZE", "10000"))
+# LISTEN 連線沒事時多久 ping 一次（連線悄悄斷掉時才發現得了）
+LISTEN_PING_SECONDS = 30.0
+LISTEN_RETRY_SECONDS = (1, 2, 5, 10, 30)
+
+PET_CACHE_REQUESTS = Counter(
+    "pet_ws_pet_cache_requests_total",
+    "寵物狀態快取查詢次數（hit / miss / not_found / error）",
+    ("result",),
+)
+PET_EVENTS = Counter(
+    "pet_ws_pet_events_total",
+    "收到的 pet_events 通知數（依 event / source）",
+    ("event", "source"),
+)
+
+
+class PetRecord(NamedTuple):
+    user_id: int
+    pet_id: int
+    pet_name: str
+    display_name: str
+    energy: int
+    status: str
+    score: int
+
+
+class PetEvent(msgspec.Struct, gc=False):
+    event: str
+    source: str = ""
+    user_id: Optional[int] = None
+    pet_id: Optional[int] = None
+    energy: Optional[int] = None
+    status: Optional[str] = None
+    score: Optional[int] = None
+
+
+_event_decoder = msgspec.json.Decoder(PetEvent)
+
+
+class PetStateCache:
+    def __init__(
+        self,
+        log: Callable[..., None],
+        ttl: float = CACHE_TTL_SECONDS,
+        max_size: int = CACHE_MAX_SIZE,
+        enabled: bool = True,
+    ) -> None:
+        self.log = log
+        self.ttl = ttl
+        self.max_size = max_size
+        self.enabled = enabled
+        # user_id -> (過期時間, PetRecord)
+        self._items: "OrderedDict[int, Tuple[float, PetRecord]]" = OrderedDict()
+        # 正在查 DB 的 user_id：同時進來的 join 共用同一個查詢
+        self._loading: Dict[int, "asyncio.Future[Optional[PetRecord]]"] = {}
+
+    async def get(self, user_id: int) -> Optional[PetRecord]:
+        """回傳 DB 裡的狀態；DB 關閉 / 查不到 / 查詢失敗回傳 None（呼叫端自己決定怎麼退回）"""
+        if not self.enabled:
+            return None
+        entry = self._items.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._items.move_to_end(user_id)
+            PET_CACHE_REQUESTS.inc("hit")
+            return entry[1]
+
+        pending = self._loading.get(user_id)
+        if pending is not None:
+            PET_CACHE_REQUESTS.inc("hit")
+            return await asyncio.shield(pending)
+
+        PET_CACHE_REQUESTS.inc("miss")
+        future: "asyncio.Future[Optional[PetRecord]]" = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        record: Optional[PetRecord] = None
+        try:
+            records = await self.load([user_id])
+            record = records.get(user_id)
+            if record is None:
+                PET_CACHE_REQUESTS.inc("not_found")
+        except Exception as e:  # noqa: BLE001
+            PET_CACHE_REQUESTS.inc("error")
+            self.log("PET_CACHE_ERROR", "查詢 user_id=%s 的寵物狀態失敗：%r", user_id, e)
+        finally:
+            del self._loading[user_id]
+            future.set_result(record)
+        return record
+
+    async def load(self, user_ids: Iterable[int]) -> Dict[int, PetRecord]:
+        """一次查詢多位玩家並寫入快取（pets_invalidated 時重新整理整個大廳用）"""
+        user_ids = list(user_ids)
+        if not self.enabled or not user_ids:
+            return {}
+        rows = await db.fetch_pets(user_ids)
+        records = {row[0]: PetRecord(*row) for row in rows}
+        for record in records.values():
+            self.put(record)
+        return records
+
+    def put(self, record: PetRecord) -> None:
+        self._items[record.user_id] = (time.monotonic() + self.ttl, record)
+        self._items.move_to_end(record.user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def apply(self, event: PetEvent) -> Optional[PetRecord]:
+        """pet_changed：有快取就套用新值並回傳，沒有就不管（下次 join 再查）"""
+        entry = self._items.get(event.user_id)
+        if entry is None:
+            return None
+        record = entry[1]
+        record = record._replace(
+            energy=record.energy if event.energy is None else event.energy,
+            status=record.status if event.status is None else event.status,
+            score=record.score if event.score is None else event.score,
+        )
+        self.put(record)
+        return record
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class PetEventListener:
+    """
+    LISTEN pet_events，收到的通知依序交給 on_event（一次一則，順序跟 commit 順序一致）
+    on_event 是 async：例如 pets_invalidated 要查 DB 重新整理大廳
+    """
+
+    def __init__(
+        self,
+        log: Callable[..., None],
+        on_event: Callable[[PetEvent], Awaitable[None]],
+        enabled: bool = True,
+    ) -> None:
+        self.log = log
+        self.on_event = on_event
+        self.enabled = enabled
+        self.queue: "asyncio.Queue[PetEvent]" = asyncio.Queue()
+        self._listen_task: Optional[asyncio.Task] = None
+        self._dispatch_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if not self.enabled or self._listen_task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._listen_task = loop.create_task(self._listen())
+        self._dispatch_task = loop.create_task(self._dispatch())
+
+    async def stop(self) -> None:
+        for task in (self._listen_task, self._dispatch_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._listen_task = None
+        self._dispatch_task = None
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        try:
+            event = _event_decoder.decode(payload)
+        except msgspec.DecodeError as e:
+            self.log("PET_EVENT_INVALID", "無法解析的 pet_events 通知：%s（%s）", payload[:200], e)
+            return
+        PET_EVENTS.inc(event.event, event.source or "-")
+        self.queue.put_nowait(event)
+
+    async def _listen(self) -> None:
+        attempt = 0
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(db.DATABASE_URL)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: closed.set())
+                await conn.add_listener(CHANNEL, self._on_notify)
+                attempt = 0
+                self.log("PET_EVENTS_LISTEN", "開始 LISTEN %s", CHANNEL)
+                # 斷線期間可能漏掉通知：大廳裡的人全部重新查一次
+                self.queue.put_nowait(PetEvent(event="pets_invalidated", source="listen"))
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), timeout=LISTEN_PING_SECONDS)
+                    except asyncio.TimeoutError:
+                        await conn.execute("SELECT 1", timeout=5)
+            except asyncio.CancelledError:
+                if conn is not None:
+                    await conn.close(timeout=1)
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.log("PET_EVENTS_ERROR", "LISTEN %s 失敗：%r", CHANNEL, e)
+            if conn is not None and not conn.is_closed():
+                conn.terminate()
+            delay = LISTEN_RETRY_SECONDS[min(attempt, len(LISTEN_RETRY_SECONDS) - 1)]
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _dispatch(self) -> None:
+        while True:
+            event = await self.queue.get()
+            try:
+                await self.on_event(event)
+            except Exception as e:  # noqa: BLE001
+                self.log("PET_EVENT_ERROR", "處理 pet_events（%s）失敗：%r", event.event, e)
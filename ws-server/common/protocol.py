@@ -0,0 +1,334 @@
+# ws-server/common/protocol.py
+
+"""
+WebSocket 訊息格式（msgspec Struct）與 type → handler 的 dispatch table
+
+前端送來的每個 frame 都是：
+    {"type": "...", "server_id": "A", "user_id": 7, "payload": {...}}
+
+解碼分兩段：
+1. 先檢查長度，超過 WS_MAX_MESSAGE_BYTES 直接丟掉，不 parse
+2. 只解 envelope（type / user_id），payload 先留成 msgspec.Raw（不建 dict）
+3. type 有註冊才用該 type 預先編好的 Decoder 把 payload 解成 Struct
+   （型別檢查 + 轉型在 C 裡做完，handler 不用再 int(payload.get(...))）
+
+strict=False：前端有些 id 是從 dataset 拿的字串（"5"），照樣轉成 int；
+型別不對（例如 energy 送 "abc"）整個訊息視為 invalid。
+Struct 沒宣告的欄位（例如 battle_result 帶的 score）直接略過。
+
+用法：
+    router = MessageRouter()
+
+    @router.on("chat_request", ToUserPayload)
+    async def handle_chat_request(server_id: str, user_id: int, payload: ToUserPayload) -> None:
+        ...
+
+    envelope = router.decode_envelope(raw)      # MessageRejected: too_large / invalid
+    route = router.get(envelope.type)           # None：未知 type
+    payload = route.decode(envelope.payload)    # MessageRejected: invalid
+    await route.handler(server_id, user_id, payload)
+
+二進位子協定（pet.bin.v2）：
+- handshake 時前端在 Sec-WebSocket-Protocol 提供 ["pet.bin.v2", "pet.json.v1"]，
+  server 選了 pet.bin.v2 後，最高頻的三種訊息改走固定格式的 binary frame，其餘照舊是 JSON text frame
+- 舊前端不帶子協定 → 全部 JSON，完全相容
+- 格式（little-endian，第一個 byte 是 opcode；server_id 由連線決定，不放進 frame）：
+
+    client → server
+      0x01 update_position   <B f32 x, f32 y>                                   9 bytes
+      0x02 battle_update     <B i32 score, u8 state> + battle_id (UTF-8 到結尾)   6 + len(battle_id)
+    server → client
+      0x81 other_pet_moved   <B u32 user_id, f32 x, f32 y, u32 ts>               17 bytes
+      0x82 battle_update     <B u32 user_id, i32 score, u8 state> + battle_id    10 + len(battle_id)
+
+  state：0 waiting / 1 running / 2 finished；不在表裡的 state（或超出範圍的數值）那則就退回 JSON
+  ts：server 的毫秒時間取低 32 bits（JSON 版本也一樣），前端用來內插其他玩家的位置
+  v1 → v2：other_pet_moved 加上 ts（v1 沒有正式上線過，不保留相容）
+  前端對應的 encode / decode 在 frontend/js/websocket_client.js，兩邊要一起改
+
+壓縮的大型 snapshot（跟子協定無關，前端在 join_lobby 帶 compress="deflate-raw" 才會收到）：
+      0x90 compressed JSON   <B> + deflate-raw(JSON 文字)
+  只用在 lobby_state 這種大 frame（>= WS_COMPRESS_MIN_BYTES）；小訊息壓縮只是白花 CPU。
+  uvicorn 預設對「每一則」訊息都做 permessage-deflate（包含 9 bytes 的座標），
+  用了這個之後 ws shard 可以用 --ws-per-message-deflate false 啟動省下那份 CPU。
+"""
+
+import math
+import os
+import struct
+import zlib
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple, Union
+
+import msgspec
+
+# 用字元數判斷（receive_text 拿到的是 str），中文字會比實際 bytes 少算，當作粗略上限即可
+MAX_MESSAGE_BYTES = int(os.environ.get("WS_MAX_MESSAGE_BYTES", "16384"))
+COMPRESS_MIN_BYTES = int(os.environ.get("WS_COMPRESS_MIN_BYTES", "4096"))
+COMPRESS_LEVEL = int(os.environ.get("WS_COMPRESS_LEVEL", "6"))
+
+EMPTY_PAYLOAD = msgspec.Raw(b"{}")
+NULL_PAYLOAD = msgspec.Raw(b"null")
+
+
+class MessageRejected(Exception):
+    """reason 直接當 pet_ws_messages_rejected_total 的 label"""
+
+    def __init__(self, reason: str, detail: str) -> None:
+        super().__init__(detail)
+        self.reason = reason
+        self.detail = detail
+
+
+# ---------------------------------------------------------
+# 訊息格式（gc=False：只有純量欄位，不會形成循環參照）
+# ---------------------------------------------------------
+def _require_finite(x: Optional[float], y: Optional[float]) -> None:
+    """
+    strict=False 會把 "nan" / "inf" 字串轉成 float，NaN 會讓移動檢查的比較全部變 False，
+    跟 binary 路徑一樣在 decode 時擋掉（__post_init__ 的 ValueError 會變成 msgspec.ValidationError）
+    """
+    if (x is not None and not math.isfinite(x)) or (y is not None and not math.isfinite(y)):
+        raise ValueError("non-finite coordinate")
+
+
+class Envelope(msgspec.Struct, gc=False):
+    type: str
+    user_id: Optional[int] = None
+    payload: msgspec.Raw = EMPTY_PAYLOAD
+
+
+class JoinLobbyPayload(msgspec.Struct, gc=False):
+    display_name: Optional[str] = None
+    pet_id: Optional[int] = None
+    pet_name: Optional[str] = None
+    energy: int = 100
+    status: Optional[str] = None
+    score: int = 0
+    x: Optional[float] = None
+    y: Optional[float] = None
+    # 前端能解壓（DecompressionStream）時帶 "deflate-raw"，大型 snapshot 改送壓縮過的 binary frame
+    compress: Optional[str] = None
+    # 斷線續連：上一條連線 session_started 拿到的 token + 最後收到的 seq（見 common/session.py）
+    resume_token: Optional[str] = None
+    last_seq: int = 0
+
+    def __post_init__(self) -> None:
+        _require_finite(self.x, self.y)
+
+
+class PetStatePayload(msgspec.Struct, gc=False):
+    # None = 這次沒帶，沿用大廳裡原本的值
+    energy: Optional[int] = None
+    status: Optional[str] = None
+    score: Optional[int] = None
+    x: Optional[float] = None
+    y: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        _require_finite(self.x, self.y)
+
+
+class PositionPayload(msgspec.Struct, gc=False):
+    x: Optional[float] = None
+    y: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        _require_finite(self.x, self.y)
+
+
+class ToUserPayload(msgspec.Struct, gc=False):
+    to_user_id: Optional[int] = None
+
+
+class FromUserPayload(msgspec.Struct, gc=False):
+    from_user_id: Optional[int] = None
+
+
+class ChatMessagePayload(msgspec.Struct, gc=False):
+    to_user_id: Optional[int] = None
+    content: str = ""
+
+
+class BattlePayload(msgspec.Struct, gc=False):
+    battle_id: Optional[str] = None
+
+
+class BattleUpdatePayload(msgspec.Struct, gc=False):
+    battle_id: Optional[str] = None
+    score: int = 0
+    state: str = "running"
+
+
+class LobbyPlayer(msgspec.Struct, gc=False):
+    """
+    大廳裡一位玩家的狀態（manager.lobby_player_states 的值，取代原本 9 個字串 key 的 dict）
+
+    Struct 是 slots，一位玩家約 120 bytes（dict 約 300，見 bench/bench_lobby_state.py）；handler 直接改欄位。
+    送出時 encode_json 在 C 裡直接轉成 {"user_id": ..., "x": ...}，前端看到的格式跟以前一樣。
+    """
+    user_id: int
+    display_name: str
+    pet_id: int
+    pet_name: str
+    energy: int
+    status: str
+    score: int
+    x: float
+    y: float
+
+
+# ---------------------------------------------------------
+# dispatch table
+# ---------------------------------------------------------
+Handler = Callable[[str, int, Any], Awaitable[None]]
+
+
+class Route(NamedTuple):
+    msg_type: str
+    decoder: msgspec.json.Decoder
+    handler: Handler
+
+    def decode(self, raw: msgspec.Raw) -> Any:
+        # payload 沒帶 / 帶 null 都當成空物件（欄位全用預設值）
+        if raw is EMPTY_PAYLOAD or raw == NULL_PAYLOAD:
+            raw = EMPTY_PAYLOAD
+        try:
+            return self.decoder.decode(raw)
+        except msgspec.DecodeError as e:
+            raise MessageRejected("invalid", f"{self.msg_type} payload: {e}") from None
+
+
+class MessageRouter:
+    def __init__(self, max_bytes: int = MAX_MESSAGE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._routes: Dict[str, Route] = {}
+        self._envelope_decoder = msgspec.json.Decoder(Envelope, strict=False)
+
+    def on(self, msg_type: str, payload_type: type) -> Callable[[Handler], Handler]:
+        """註冊 handler：handler(server_id, user_id, payload_struct)"""
+
+        def register(handler: Handler) -> Handler:
+            if msg_type in self._routes:
+                raise ValueError(f"duplicate handler for {msg_type!r}")
+            decoder = msgspec.json.Decoder(payload_type, strict=False)
+            self._routes[msg_type] = Route(msg_type, decoder, handler)
+            return handler
+
+        return register
+
+    def decode_envelope(self, raw: Union[str, bytes]) -> Envelope:
+        if len(raw) > self.max_bytes:
+            raise MessageRejected("too_large", f"{len(raw)} > {self.max_bytes}")
+        try:
+            return self._envelope_decoder.decode(raw)
+        except msgspec.DecodeError as e:
+            raise MessageRejected("invalid", str(e)) from None
+
+    def get(self, msg_type: str) -> Optional[Route]:
+        return self._routes.get(msg_type)
+
+    def __contains__(self, msg_type: object) -> bool:
+        return msg_type in self._routes
+
+    @property
+    def types(self):
+        return self._routes.keys()
+
+
+# ---------------------------------------------------------
+# 二進位子協定 pet.bin.v2
+# ---------------------------------------------------------
+SUBPROTOCOL_BINARY = "pet.bin.v2"
+SUBPROTOCOL_JSON = "pet.json.v1"
+
+OP_UPDATE_POSITION = 0x01
+OP_BATTLE_UPDATE = 0x02
+OP_OTHER_PET_MOVED = 0x81
+OP_BATTLE_UPDATE_OUT = 0x82
+OP_COMPRESSED_JSON = 0x90
+
+COMPRESS_DEFLATE_RAW = "deflate-raw"
+
+BATTLE_STATES = ("waiting", "running", "finished")
+_BATTLE_STATE_CODES = {state: code for code, state in enumerate(BATTLE_STATES)}
+
+_POSITION_IN = struct.Struct("<Bff")
+_BATTLE_UPDATE_IN = struct.Struct("<BiB")
+_PET_MOVED_OUT = struct.Struct("<BIffI")
+_BATTLE_UPDATE_OUT = struct.Struct("<BIiB")
+
+_U32_MAX = 0xFFFFFFFF
+_I32_MIN, _I32_MAX = -(2 ** 31), 2 ** 31 - 1
+
+
+def choose_subprotocol(offered) -> Optional[str]:
+    """handshake 時前端提供的子協定清單 → server 選用的（None = 舊前端，不回 header）"""
+    if SUBPROTOCOL_BINARY in offered:
+        return SUBPROTOCOL_BINARY
+    if SUBPROTOCOL_JSON in offered:
+        return SUBPROTOCOL_JSON
+    return None
+
+
+def decode_binary(data: bytes, max_bytes: int = MAX_MESSAGE_BYTES) -> Tuple[str, Any]:
+    """binary frame → (msg_type, payload Struct)，跟 JSON 路徑解出來的 payload 同型別"""
+    if len(data) > max_bytes:
+        raise MessageRejected("too_large", f"{len(data)} > {max_bytes}")
+    if not data:
+        raise MessageRejected("invalid", "empty binary frame")
+    op = data[0]
+    try:
+        if op == OP_UPDATE_POSITION:
+            _, x, y = _POSITION_IN.unpack(data)
+            if not (math.isfinite(x) and math.isfinite(y)):
+                raise MessageRejected("invalid", "binary update_position: non-finite coordinate")
+            return "update_position", PositionPayload(x=x, y=y)
+        if op == OP_BATTLE_UPDATE:
+            _, score, state = _BATTLE_UPDATE_IN.unpack_from(data)
+            battle_id = data[_BATTLE_UPDATE_IN.size:].decode("utf-8")
+            return "battle_update", BattleUpdatePayload(
+                battle_id=battle_id or None,
+                score=score,
+                state=BATTLE_STATES[state],
+            )
+    except (struct.error, UnicodeDecodeError, IndexError) as e:
+        raise MessageRejected("invalid", f"binary op=0x{op:02x}: {e}") from None
+    raise MessageRejected("unknown_type", f"binary op=0x{op:02x}")
+
+
+_json_encoder = msgspec.json.Encoder()
+
+
+def encode_json(msg: Any) -> str:
+    """server → client 的 JSON text frame；msg 裡可以直接放 LobbyPlayer（json.dumps 不認得 Struct）"""
+    return _json_encoder.encode(msg).decode("utf-8")
+
+
+def encode_binary(msg: dict) -> Optional[bytes]:
+    """server → client 的訊息能用 binary 就回傳 bytes，不支援的 type / 欄位超出範圍回傳 None（改送 JSON）"""
+    msg_type = msg.get("type")
+    payload = msg.get("payload") or {}
+    try:
+        if msg_type == "other_pet_moved":
+            player = payload["player"]
+            user_id = player["user_id"]
+            if not 0 <= user_id <= _U32_MAX:
+                return None
+            return _PET_MOVED_OUT.pack(OP_OTHER_PET_MOVED, user_id, player["x"], player["y"], player["ts"])
+        if msg_type == "battle_update":
+            user_id = payload["user_id"]
+            score = payload["score"]
+            state = _BATTLE_STATE_CODES.get(payload["state"])
+            if state is None or not 0 <= user_id <= _U32_MAX or not _I32_MIN <= score <= _I32_MAX:
+                return None
+            head = _BATTLE_UPDATE_OUT.pack(OP_BATTLE_UPDATE_OUT, user_id, score, state)
+            return head + payload["battle_id"].encode("utf-8")
+    except (KeyError, TypeError, struct.error):
+        return None
+    return None
+
+
+def encode_compressed(text: str, level: int = COMPRESS_LEVEL) -> bytes:
+    """JSON 文字 → 0x90 + deflate-raw（瀏覽器用 DecompressionStream("deflate-raw") 解）"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return bytes((OP_COMPRESSED_JSON,)) + compressor.compress(text.encode("utf-8")) + compressor.flush()
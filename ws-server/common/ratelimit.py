@@ -0,0 +1,137 @@
+# ws-server/common/ratelimit.py
+
+"""
+每條連線、每種 msg_type 一個 token bucket
+
+在 websocket_endpoint 解完 envelope（只有 type，payload 還是 Raw）之後、解 payload 之前檢查，
+超過的 frame 直接丟掉，不解 payload、不進 handler、不記 log。
+未知 type、解不開、太大的 frame 共用 INVALID 這個 bucket，一樣算進斷線的計數。
+短時間內被丟太多次的連線（WS_RATE_MAX_DROPS 次 / WS_RATE_DROP_WINDOW_S 秒）直接斷線。
+
+bucket 存在連線自己的 ConnectionLimiter 裡（websocket_endpoint 的區域變數），
+連線結束就跟著消失，不用另外清；每則訊息只有一次 dict 查詢 + 幾個浮點運算。
+
+環境變數：
+- WS_RATE_LIMITS         覆寫個別 type，格式 "chat_message=5/10,battle_update=20/40"（每秒 / burst）
+- WS_RATE_DEFAULT        沒列出的 type，預設 "10/20"
+- WS_RATE_MAX_DROPS      視窗內被丟幾則就斷線，預設 50
+- WS_RATE_DROP_WINDOW_S  視窗長度（秒），預設 10
+"""
+
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+# (每秒補幾個 token, bucket 容量)
+Limit = Tuple[float, float]
+
+# 未知 type / invalid / too_large 的 frame 共用的 bucket 名稱
+INVALID = "invalid"
+
+# 依前端實際送的頻率抓的預設值（留幾倍餘裕，正常操作不會碰到）
+DEFAULT_LIMITS: Dict[str, Limit] = {
+    "join_lobby": (1, 3),
+    # 前端移動中每 100ms 送一次，方向改變時多送一次
+    "update_position": (25, 30),
+    "pet_state_update": (2, 5),
+    "chat_request": (2, 5),
+    "chat_request_accept": (2, 5),
+    "chat_message": (5, 10),
+    "battle_invite": (1, 3),
+    "battle_accept": (1, 3),
+    "battle_ready": (2, 5),
+    # 小恐龍每過一個障礙送一次
+    "battle_update": (10, 20),
+    "battle_result": (2, 5),
+    # 正常的前端不會送壞訊息：偶爾一則（版本不一致）不斷線，持續亂送的很快就超過
+    INVALID: (1, 5),
+}
+
+
+def parse_limit(text: str) -> Limit:
+    """ "5/10" → (5.0, 10.0)；只給一個數字時 burst = rate """
+    rate, _, burst = text.strip().partition("/")
+    rate_value = float(rate)
+    burst_value = float(burst) if burst else rate_value
+    if rate_value <= 0 or burst_value < 1:
+        raise ValueError(f"invalid rate limit {text!r}")
+    return rate_value, burst_value
+
+
+def load_limits(overrides: str = "", default: str = "10/20") -> Tuple[Dict[str, Limit], Limit]:
+    limits = dict(DEFAULT_LIMITS)
+    for item in overrides.split(","):
+        if not item.strip():
+            continue
+        msg_type, _, value = item.partition("=")
+        limits[msg_type.strip()] = parse_limit(value)
+    return limits, parse_limit(default)
+
+
+LIMITS, DEFAULT_LIMIT = load_limits(
+    os.environ.get("WS_RATE_LIMITS", ""),
+    os.environ.get("WS_RATE_DEFAULT", "10/20"),
+)
+MAX_DROPS = int(os.environ.get("WS_RATE_MAX_DROPS", "50"))
+DROP_WINDOW_SECONDS = float(os.environ.get("WS_RATE_DROP_WINDOW_S", "10"))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        tokens = self.tokens + (now - self.updated) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        self.updated = now
+        if tokens < 1.0:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1.0
+        return True
+
+
+class ConnectionLimiter:
+    """一條連線的所有 bucket + 被丟訊息的計數（固定視窗）"""
+
+    __slots__ = ("limits", "default", "buckets", "drops", "window_start", "max_drops", "window")
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Limit]] = None,
+        default: Optional[Limit] = None,
+        max_drops: int = MAX_DROPS,
+        window: float = DROP_WINDOW_SECONDS,
+    ) -> None:
+        self.limits = LIMITS if limits is None else limits
+        self.default = DEFAULT_LIMIT if default is None else default
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.drops = 0
+        self.window_start = 0.0
+        self.max_drops = max_drops
+        self.window = window
+
+    def allow(self, msg_type: str) -> bool:
+        """msg_type 要是已註冊的 type 或 INVALID（未知 type 都算在 INVALID，bucket 數量有上限）"""
+        now = time.monotonic()
+        bucket = self.buckets.get(msg_type)
+        if bucket is None:
+            rate, burst = self.limits.get(msg_type, self.default)
+            bucket = self.buckets[msg_type] = TokenBucket(rate, burst, now)
+        if bucket.take(now):
+            return True
+        if now - self.window_start > self.window:
+            self.window_start = now
+            self.drops = 0
+        self.drops += 1
+        return False
+
+    @property
+    def should_disconnect(self) -> bool:
+        return self.drops >= self.max_drops
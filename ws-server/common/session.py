@@ -0,0 +1,77 @@
+# ws-server/common/session.py
+
+"""
+斷線續連（resume）：網路抖一下不用重新 join、不會被判負
+
+- join_lobby 時建立 ResumeSession，送 session_started（resume_token）給前端
+- 之後送給這位玩家的每個 frame 都記一個 seq（從 1 開始，session_started / session_resumed 不算），
+  最近的 frame 留在有上限的 buffer 裡；frame 是送出去的原樣（broadcast 時所有人共用同一份編碼結果）
+- 連線不正常斷掉（RESUMABLE_CLOSE_CODES）時不清理，保留大廳位置與對戰座位 RESUME_GRACE_SECONDS 秒；
+  這段期間送給他的 frame 只記不送
+- 前端重連後 join_lobby 帶 resume_token + last_seq（自己數收到幾個 frame），
+  server 補送 last_seq 之後的 frame；token 不對、漏掉的已經被擠出 buffer 就退回一般 join（完整 lobby_state）
+- 寬限期過了才照原本流程清理（對戰判負、退出大廳、player_left）
+
+frame 不帶 seq：前後端各自數，binary 格式與 broadcast 只編碼一次都不用改。
+
+環境變數：
+- WS_RESUME_GRACE_S         斷線後保留多久，預設 20
+- WS_RESUME_BUFFER          每位玩家最多留幾個 frame，預設 256
+- WS_RESUME_BUFFER_BYTES    每位玩家最多留多少 bytes（大型 lobby_state 很快就會把舊的擠掉），預設 65536
+"""
+
+import asyncio
+import hmac
+import os
+import secrets
+from collections import deque
+from typing import Deque, List, Optional, Union
+
+RESUME_GRACE_SECONDS = float(os.environ.get("WS_RESUME_GRACE_S", "20"))
+RESUME_BUFFER_SIZE = int(os.environ.get("WS_RESUME_BUFFER", "256"))
+RESUME_BUFFER_BYTES = int(os.environ.get("WS_RESUME_BUFFER_BYTES", "65536"))
+
+# 1006：沒收到 close frame 就斷了（網路中斷；uvicorn 的 websockets-sansio 實作回報成 1005）；1011：心跳逾時
+# 1000 / 1001 是前端自己關的（登出、換頁、關分頁），照舊馬上清理
+RESUMABLE_CLOSE_CODES = frozenset((1005, 1006, 1011))
+
+Frame = Union[str, bytes]
+
+
+class ResumeSession:
+    __slots__ = ("token", "seq", "frames", "buffered_bytes", "max_frames", "max_bytes", "expire_handle")
+
+    def __init__(self, max_frames: int = RESUME_BUFFER_SIZE, max_bytes: int = RESUME_BUFFER_BYTES) -> None:
+        self.token = secrets.token_urlsafe(18)
+        # 最後一個送出（或斷線期間記下）的 frame 的 seq
+        self.seq = 0
+        self.frames: Deque[Frame] = deque()
+        self.buffered_bytes = 0
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        # 斷線中：寬限期到了要跑的清理
+        self.expire_handle: Optional[asyncio.TimerHandle] = None
+
+    def record(self, frame: Frame) -> None:
+        self.seq += 1
+        self.frames.append(frame)
+        self.buffered_bytes += len(frame)
+        while self.frames and (len(self.frames) > self.max_frames or self.buffered_bytes > self.max_bytes):
+            self.buffered_bytes -= len(self.frames.popleft())
+
+    def matches(self, token: Optional[str]) -> bool:
+        return bool(token) and hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    def replay_from(self, last_seq: int) -> Optional[List[Frame]]:
+        """前端收到 last_seq 為止，回傳之後的 frame；有些已經被擠出 buffer（或 last_seq 不合理）回傳 None"""
+        missed = self.seq - last_seq
+        if missed < 0 or missed > len(self.frames):
+            return None
+        if missed == 0:
+            return []
+        return list(self.frames)[-missed:]
+
+    def cancel_expire(self) -> None:
+        if self.expire_handle is not None:
+            self.expire_handle.cancel()
+            self.expire_handle = None
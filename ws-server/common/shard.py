@@ -0,0 +1,1947 @@
+# ws-server/common/shard.py
+
+"""
+一台 ws shard 的全部邏輯（大廳 / 聊天 / 對戰 / 重啟交接 / 斷線續連 + FastAPI app）
+
+wsA / wsB / wsC 的 main.py 只是進入點：設定 WS_SERVER_ID 再 import 這裡的 app，
+uvicorn 照舊在各自目錄下跑 main:app。所有 module-level 狀態（manager、writer、metrics）
+都是這個 process 的，一個 process 只跑一台 shard。
+"""
+
+from fastapi import FastAPI, Header, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Callable, Dict, Tuple, List, Optional, Sequence, Set
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import asyncio
+import logging
+import os
+import time
+import math
+import random
+import tempfile
+
+import msgspec
+
+from common.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from common.metrics import REGISTRY, Counter, Gauge, Histogram
+from common.logs import setup_logging
+from common.auth import AuthError, check_internal_token, verify_token
+from common.db import (
+    BATTLE_WIN_BONUS,
+    close_pool,
+    db_enabled,
+    insert_battle_results,
+    insert_chat_messages,
+    is_bad_data_error,
+)
+from common.writers import BatchWriter
+from common.loadstats import LoopLagMonitor, RateCounter
+from common.watchdog import Watchdog
+from common import handoff, ratelimit
+from common.chatpairs import ChatApprovalStore
+from common.petstate import PetEvent, PetEventListener, PetStateCache
+from common.session import (
+    RESUMABLE_CLOSE_CODES,
+    RESUME_GRACE_SECONDS,
+    Frame,
+    ResumeSession,
+)
+from common.protocol import (
+    BattlePayload,
+    BattleUpdatePayload,
+    ChatMessagePayload,
+    FromUserPayload,
+    JoinLobbyPayload,
+    COMPRESS_DEFLATE_RAW,
+    COMPRESS_MIN_BYTES,
+    MessageRejected,
+    MessageRouter,
+    PetStatePayload,
+    SUBPROTOCOL_BINARY,
+    PositionPayload,
+    ToUserPayload,
+    choose_subprotocol,
+    decode_binary,
+    encode_binary,
+    encode_compressed,
+    encode_json,
+    LobbyPlayer,
+)
+
+# 這個 process 負責哪一台 shard（wsA / wsB / wsC 的 main.py 在 import 前設定）
+SERVER_ID = os.environ.get("WS_SERVER_ID", "A")
+
+WORLD_WIDTH = 200
+WORLD_HEIGHT = 200
+
+# lobby_state 每個 frame 最多帶幾位玩家（大廳很大時分段送，其餘用 lobby_state_chunk）
+LOBBY_CHUNK_SIZE = int(os.environ.get("WS_LOBBY_CHUNK_SIZE", "100"))
+# 這段時間內的 join 合併成一則 players_joined 廣播（重連潮時 N 個人不用各廣播一次）
+JOIN_COALESCE_SECONDS = int(os.environ.get("WS_JOIN_COALESCE_MS", "50")) / 1000
+
+# 位置以 server 為準：每秒最多能走多遠（前端是 60 units/s，留一點餘裕給網路抖動）
+MAX_MOVE_SPEED = float(os.environ.get("WS_MAX_MOVE_SPEED", "90"))
+# 速度檢查額外容忍的距離（封包擠在一起到時，elapsed 會比實際移動時間短）
+MOVE_SLACK = float(os.environ.get("WS_MOVE_SLACK", "15"))
+# 同一人兩次 update_position 最短間隔（前端每 100ms 送一次，比這更密的直接丟掉）
+POSITION_MIN_INTERVAL = int(os.environ.get("WS_POSITION_MIN_INTERVAL_MS", "20")) / 1000
+# 速度檢查最多回看多久：停很久再動，也不能一次瞬移過大半張地圖
+MOVE_MAX_ELAPSED = 1.0
+# 寵物體力變化（pet_energy_changed）除了本人，也推給這個距離內的大廳玩家（world units）
+NEARBY_RADIUS = float(os.environ.get("WS_NEARBY_RADIUS", "60"))
+
+# 重啟交接（見 common/handoff.py）：snapshot 檔案位置、多舊就不還原
+SNAPSHOT_PATH = os.environ.get(
+    "WS_SNAPSHOT_PATH",
+    os.path.join(tempfile.gettempdir(), f"pet-ws-{SERVER_ID}.snapshot.json"),
+)
+SNAPSHOT_MAX_AGE = float(os.environ.get("WS_SNAPSHOT_MAX_AGE_S", "120"))
+# 還原後等多久：還沒回來的玩家、雙方都沒回來的對戰房間就丟掉
+RESTORE_GRACE_SECONDS = float(os.environ.get("WS_RESTORE_GRACE_S", "60"))
+# server_restart 叫前端等多久再重連：每條連線在 0 ~ 這個值之間隨機，避免新 process 一起來就被重連潮打爆
+RESTART_JITTER_MS = int(os.environ.get("WS_RESTART_JITTER_MS", "5000"))
+
+# 事件 type → handler 的 dispatch table（handler 用 @router.on 註冊，見 common/protocol.py）
+# 沒註冊的 type 一律記成 "unknown"，避免 metrics label 被亂送的 type 灌爆
+router = MessageRouter()
+
+
+# ---------------------------------------------------------
+# Log 函式
+# ---------------------------------------------------------
+# 寫入 stdout 由背景 thread 處理；高頻事件預設抽樣（可用 PET_LOG_SAMPLE 覆寫）
+log = setup_logging(
+    f"ws{SERVER_ID}",
+    default_samples={
+        "PET_STATE_UPDATE": 10,
+        "BATTLE_UPDATE": 20,
+        "SEND_ERROR": 50,
+        # 壞訊息本身就有 invalid bucket 擋著，這裡再抽樣，避免很多連線一起亂送時洗版
+        "WS_BAD_MESSAGE": 20,
+        "WS_UNKNOWN_TYPE": 20,
+    },
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await chat_writer.start()
+    await battle_writer.start()
+    loop_lag.start()
+    watchdog.start()
+    pet_events.start()
+    restore_snapshot()
+    handoff.install_sigterm_hook(asyncio.get_running_loop(), begin_drain)
+    try:
+        yield
+    finally:
+        await pet_events.stop()
+        watchdog.stop()
+        await loop_lag.stop()
+        # graceful shutdown：先把還在 queue 裡的聊天紀錄 / 對戰結果寫完再關 DB 連線
+        join_coalescer.stop()
+        await chat_writer.stop()
+        await battle_writer.stop()
+        await close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+UserKey = Tuple[str, int]
+
+
+# ---------------------------------------------------------
+# 指標（/metrics）
+# ---------------------------------------------------------
+WS_MESSAGES_IN = Counter(
+    "pet_ws_messages_in_total",
+    "收到的 WebSocket 訊息數（依 type）",
+    ("server", "type"),
+)
+WS_MESSAGES_OUT = Counter(
+    "pet_ws_messages_out_total",
+    "送出的 WebSocket 訊息數（依 type，每個收件者算一次）",
+    ("server", "type"),
+)
+WS_MESSAGES_REJECTED = Counter(
+    "pet_ws_messages_rejected_total",
+    "解碼前 / 解碼時就被丟掉的訊息數（too_large / invalid / unknown_type）",
+    ("server", "reason"),
+)
+WS_RATE_LIMITED = Counter(
+    "pet_ws_rate_limited_total",
+    "超過 token bucket 被丟掉的訊息數（不解 payload）",
+    ("server", "type"),
+)
+WS_RATE_LIMIT_DISCONNECTS = Counter(
+    "pet_ws_rate_limit_disconnects_total",
+    "短時間內被丟太多訊息而被斷線的連線數",
+    ("server",),
+)
+WS_RESUMES = Counter(
+    "pet_ws_resumes_total",
+    "斷線續連結果（detached / resumed / rejected / expired）",
+    ("server", "result"),
+)
+WS_RESUME_REPLAYED = Counter(
+    "pet_ws_resume_replayed_frames_total",
+    "續連時補送的 frame 數",
+    ("server",),
+)
+WS_POSITION_CORRECTED = Counter(
+    "pet_ws_position_corrected_total",
+    "位置被 server 修正的次數（bounds：超出地圖 / speed：移動太快）",
+    ("server", "reason"),
+)
+WS_SNAPSHOT_BYTES = Counter(
+    "pet_ws_snapshot_bytes_total",
+    "lobby_state snapshot 實際送出的 bytes（raw / deflate）",
+    ("server", "encoding"),
+)
+WS_BROADCAST_FANOUT = Histogram(
+    "pet_ws_broadcast_fanout",
+    "每次 broadcast 實際送出的連線數",
+    ("server",),
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+
+
+@dataclass
+class BattleRoom:
+    battle_id: str
+    server_id: str
+    player1_id: int
+    player2_id: int
+    # 遊戲中即時更新用
+    scores: Dict[int, int] = field(default_factory=dict)
+    # waiting / running
+    state: str = "waiting"
+    # 雙方 ready 狀態
+    ready: Dict[int, bool] = field(default_factory=dict)
+    # ⭐ 新增：雙方送上來的「最終分數」
+    results: Dict[int, int] = field(default_factory=dict)
+
+    def has_player(self, server_id: str, user_id: int) -> bool:
+        return server_id == self.server_id and user_id in (self.player1_id, self.player2_id)
+
+
+class ShardSnapshot(msgspec.Struct):
+    """重啟前存下來、新 process 啟動時還原的狀態（JSON，dict 的 int key 由 msgspec 轉回來）"""
+    server_id: str
+    saved_at: float
+    players: List[LobbyPlayer]
+    battles: List[BattleRoom]
+    chat_approved_pairs: List[Tuple[int, int]]
+
+
+class ConnectionManager:
+    def __init__(self) -> None:
+        self.active_connections: Dict[UserKey, WebSocket] = {}
+        self.lobby_users: Dict[str, Set[int]] = {}
+        # server_id → {user_id: LobbyPlayer}，dict 保持 join 順序，snapshot 不用每次排序
+        self.lobby_player_states: Dict[str, Dict[int, LobbyPlayer]] = {}
+        self.battles: Dict[str, BattleRoom] = {}
+        # 聊天配對：依 server 分開、有 TTL / 上限，玩家離開時一起清（見 common/chatpairs.py）
+        self.chat_approvals = ChatApprovalStore()
+        self.last_position_broadcast: Dict[UserKey, float] = {}
+        # 最後一次接受位置的 time.monotonic()（速度檢查用，join_lobby 時開始算）
+        self.last_position_at: Dict[UserKey, float] = {}
+        # 協商到 pet.bin.v2 的連線：支援的訊息改送 binary frame
+        self.binary_connections: Set[UserKey] = set()
+        # join_lobby 時說自己能解壓的連線：大型 snapshot 改送 deflate-raw
+        self.compressed_connections: Set[UserKey] = set()
+        # 重啟中：不收新連線，斷線也不判負、不廣播 player_left（狀態已經存進 snapshot）
+        self.draining = False
+        # 從 snapshot 還原、還沒重新 join 的玩家（join_lobby 時拿回位置）
+        self.restored_players: Dict[UserKey, LobbyPlayer] = {}
+        self.restored_battle_ids: Set[str] = set()
+        # 斷線續連：每位已 join 的玩家一個 session；detached = 斷線中、還在寬限期內的
+        self.sessions: Dict[UserKey, ResumeSession] = {}
+        self.detached: Dict[UserKey, ResumeSession] = {}
+
+    # ------------------ 重啟交接 ------------------ #
+    def snapshot(self, server_id: str) -> ShardSnapshot:
+        return ShardSnapshot(
+            server_id=server_id,
+            saved_at=time.time(),
+            players=self.get_lobby_players(server_id),
+            battles=[room for room in self.battles.values() if room.server_id == server_id],
+            chat_approved_pairs=self.chat_approvals.pairs(server_id),
+        )
+
+    def restore(self, snapshot: ShardSnapshot) -> None:
+        for room in snapshot.battles:
+            self.battles[room.battle_id] = room
+        for user1_id, user2_id in snapshot.chat_approved_pairs:
+            self.chat_approvals.approve(snapshot.server_id, user1_id, user2_id)
+        self.restored_players = {(snapshot.server_id, p.user_id): p for p in snapshot.players}
+        self.restored_battle_ids = {room.battle_id for room in snapshot.battles}
+
+    def expire_restored(self) -> None:
+        """還原的寬限期過了：沒回來的玩家不再保留位置，雙方都沒回來的對戰房間收掉"""
+        expired_players = len(self.restored_players)
+        for server_id, user_id in self.restored_players:
+            self.chat_approvals.drop_user(server_id, user_id)
+        self.restored_players.clear()
+        expired_battles = 0
+        for battle_id in self.restored_battle_ids:
+            room = self.battles.get(battle_id)
+            if room is None:
+                continue
+            if (
+                (room.server_id, room.player1_id) not in self.active_connections
+                and (room.server_id, room.player2_id) not in self.active_connections
+            ):
+                self.finish_battle(battle_id)
+                expired_battles += 1
+        self.restored_battle_ids.clear()
+        log(
+            "RESTORE_EXPIRED",
+            "寬限期結束：%s 位玩家沒有回來，收掉 %s 個對戰房間",
+            expired_players, expired_battles,
+        )
+
+    # ------------------ 基本連線管理 ------------------ #
+    def connect(self, server_id: str, user_id: int, websocket: WebSocket, binary: bool = False) -> None:
+        key: UserKey = (server_id, user_id)
+        self.active_connections[key] = websocket
+        if binary:
+            self.binary_connections.add(key)
+        else:
+            self.binary_connections.discard(key)
+        if server_id not in self.lobby_users:
+            self.lobby_users[server_id] = set()
+        self.lobby_users[server_id].add(user_id)
+        log("CONNECT", "server=%s, user_id=%s 加入連線與大廳", server_id, user_id)
+
+    def disconnect(self, server_id: str, user_id: int) -> None:
+        key: UserKey = (server_id, user_id)
+        self.active_connections.pop(key, None)
+        if server_id in self.lobby_users:
+            self.lobby_users[server_id].discard(user_id)
+        if server_id in self.lobby_player_states:
+            self.lobby_player_states[server_id].pop(user_id, None)
+        self.last_position_broadcast.pop(key, None)
+        self.last_position_at.pop(key, None)
+        self.binary_connections.discard(key)
+        self.compressed_connections.discard(key)
+        self._drop_session(key)
+        self.chat_approvals.drop_user(server_id, user_id)
+        log("DISCONNECT", "server=%s, user_id=%s 離線並退出大廳", server_id, user_id)
+
+    # ------------------ 斷線續連（見 common/session.py） ------------------ #
+    def _drop_session(self, key: UserKey) -> None:
+        session = self.sessions.pop(key, None)
+        if session is not None:
+            session.cancel_expire()
+        self.detached.pop(key, None)
+
+    async def start_session(self, server_id: str, user_id: int) -> None:
+        """一般 join：換一個新的 session（舊的、還在寬限期內的直接丟掉，人已經回來了）"""
+        key: UserKey = (server_id, user_id)
+        self._drop_session(key)
+        session = self.sessions[key] = ResumeSession()
+        await self.send_control(server_id, user_id, {
+            "type": "session_started",
+            "server_id": server_id,
+            "user_id": user_id,
+            "payload": {
+                "resume_token": session.token,
+                "resume_grace_ms": int(RESUME_GRACE_SECONDS * 1000),
+            },
+        })
+
+    def detach(self, server_id: str, user_id: int, on_expire: Callable[[], None]) -> bool:
+        """連線斷了但先不清理：大廳位置、對戰座位都留著，寬限期到了才呼叫 on_expire"""
+        key: UserKey = (server_id, user_id)
+        session = self.sessions.get(key)
+        if session is None:
+            return False
+        self.active_connections.pop(key, None)
+        self.last_position_at.pop(key, None)
+        self.detached[key] = session
+        session.expire_handle = asyncio.get_running_loop().call_later(RESUME_GRACE_SECONDS, on_expire)
+        return True
+
+    async def resume(
+        self,
+        server_id: str,
+        user_id: int,
+        websocket: WebSocket,
+        binary: bool,
+        token: str,
+        last_seq: int,
+    ) -> Optional[int]:
+        """
+        token 對、漏掉的 frame 都還在 buffer 裡：補送 last_seq 之後的 frame 再接上新連線，回傳補送幾個；
+        不能續連回傳 None（呼叫端改走一般 join）
+        """
+        key: UserKey = (server_id, user_id)
+        session = self.sessions.get(key)
+        # buffer 裡的 binary frame 是照舊連線的子協定編的，子協定不同就不能補送
+        if session is None or not session.matches(token) or binary != (key in self.binary_connections):
+            return None
+        if session.replay_from(last_seq) is None:
+            return None
+
+        # 舊連線可能還沒發現自己斷了：先當成斷線中，補送期間新的 frame 只記不送，補完才接上，順序不會亂
+        # 寬限期的計時先不取消：補送途中新連線又斷掉，照樣會被清理
+        self.active_connections.pop(key, None)
+        self.detached[key] = session
+        sent = last_seq
+        try:
+            await websocket.send_text(encode_json({
+                "type": "session_resumed",
+                "server_id": server_id,
+                "user_id": user_id,
+                "payload": {"last_seq": last_seq, "seq": session.seq},
+            }))
+            while sent < session.seq:
+                frames = session.replay_from(sent)
+                if frames is None:
+                    return None
+                for frame in frames:
+                    if isinstance(frame, bytes):
+                        await websocket.send_bytes(frame)
+                    else:
+                        await websocket.send_text(frame)
+                sent += len(frames)
+        except (RuntimeError, WebSocketDisconnect):
+            return None
+        if self.sessions.get(key) is not session:
+            # 補送途中寬限期到了、已經清理掉
+            return None
+
+        session.cancel_expire()
+        self.detached.pop(key, None)
+        self.active_connections[key] = websocket
+        self.last_position_at[key] = time.monotonic()
+        return sent - last_seq
+
+    async def send_control(self, server_id: str, user_id: int, msg: dict) -> None:
+        """session_started / session_resumed：不記 seq、不進 replay buffer"""
+        ws = self.active_connections.get((server_id, user_id))
+        if ws is None:
+            return
+        WS_MESSAGES_OUT.inc(server_id, msg.get("type", "unknown"))
+        try:
+            await ws.send_text(encode_json(msg))
+        except (RuntimeError, WebSocketDisconnect):
+            log("SEND_ERROR", "server=%s, user_id=%s 傳送失敗，略過", server_id, user_id)
+
+    async def _deliver(self, key: UserKey, ws: WebSocket | None, frame: Frame) -> None:
+        """
+        送出一個 frame，同時記進這位玩家的 replay buffer；斷線中（ws=None）只記不送
+        對方剛好在斷線：已經關閉丟 RuntimeError，關到一半 starlette 丟 WebSocketDisconnect(1006)，呼叫端兩種都要接
+        """
+        session = self.sessions.get(key)
+        if session is not None:
+            session.record(frame)
+        if ws is None:
+            return
+        if isinstance(frame, bytes):
+            await ws.send_bytes(frame)
+        else:
+            await ws.send_text(frame)
+
+    def get_online_users(self, server_id: str) -> List[int]:
+        return sorted(self.lobby_users.get(server_id, set()))
+
+    def get_ws(self, server_id: str, user_id: int):
+        return self.active_connections.get((server_id, user_id))
+
+    async def evict(self, server_id: str, user_id: int, new_server_id: str) -> bool:
+        """
+        使用者換到別的 shard：先通知前端，再關掉連線。
+        清理（對戰判負、退出大廳、player_left）交給 websocket_endpoint 收到斷線後照原流程處理。
+        """
+        ws = self.get_ws(server_id, user_id)
+        if ws is None:
+            return False
+        await self.send_json(server_id, user_id, {
+            "type": "server_moved",
+            "server_id": server_id,
+            "user_id": user_id,
+            "payload": {"new_server_id": new_server_id},
+        })
+        try:
+            await ws.close(code=4001)
+        except RuntimeError:
+            pass
+        log("EVICT", "server=%s, user_id=%s 已搬到 server=%s，關閉舊連線", server_id, user_id, new_server_id)
+        return True
+
+    async def send_json(self, server_id: str, to_user_id: int, msg: dict) -> None:
+        key: UserKey = (server_id, to_user_id)
+        ws = self.active_connections.get(key)
+        if ws is None and key not in self.detached:
+            return
+        WS_MESSAGES_OUT.inc(server_id, msg.get("type", "unknown"))
+        try:
+            data = encode_binary(msg) if key in self.binary_connections else None
+            await self._deliver(key, ws, data if data is not None else encode_json(msg))
+        except (RuntimeError, WebSocketDisconnect):
+            log("SEND_ERROR", "server=%s, user_id=%s 傳送失敗，略過", server_id, to_user_id)
+
+    def set_compression(self, server_id: str, user_id: int, enabled: bool) -> None:
+        key: UserKey = (server_id, user_id)
+        if enabled:
+            self.compressed_connections.add(key)
+        else:
+            self.compressed_connections.discard(key)
+
+    async def send_snapshot(self, server_id: str, to_user_id: int, msg: dict) -> None:
+        """大型 snapshot（lobby_state）：對方能解壓且夠大才壓縮，其餘同 send_json"""
+        key: UserKey = (server_id, to_user_id)
+        ws = self.active_connections.get(key)
+        if ws is None and key not in self.detached:
+            return
+        WS_MESSAGES_OUT.inc(server_id, msg.get("type", "unknown"))
+        text = encode_json(msg)
+        try:
+            if key in self.compressed_connections and len(text) >= COMPRESS_MIN_BYTES:
+                data = encode_compressed(text)
+                WS_SNAPSHOT_BYTES.inc(server_id, "deflate", amount=len(data))
+                await self._deliver(key, ws, data)
+            else:
+                WS_SNAPSHOT_BYTES.inc(server_id, "raw", amount=len(text))
+                await self._deliver(key, ws, text)
+        except (RuntimeError, WebSocketDisconnect):
+            log("SEND_ERROR", "server=%s, user_id=%s 傳送失敗，略過", server_id, to_user_id)
+
+    async def multicast(self, server_id: str, user_ids: Sequence[int], msg: dict) -> None:
+        """送給指定的幾個人（JSON 只編碼一次）；不在線上的略過"""
+        text: str | None = None
+        sent = 0
+        for uid in user_ids:
+            key: UserKey = (server_id, uid)
+            ws = self.active_connections.get(key)
+            if ws is None and key not in self.detached:
+                continue
+            if text is None:
+                text = encode_json(msg)
+            try:
+                await self._deliver(key, ws, text)
+                sent += 1
+            except (RuntimeError, WebSocketDisconnect):
+                log("SEND_ERROR", "server=%s, user_id=%s 傳送失敗，略過", server_id, uid)
+        if sent:
+            WS_MESSAGES_OUT.inc(server_id, msg.get("type", "unknown"), amount=sent)
+
+    async def broadcast_in_server(
+        self,
+        server_id: str,
+        msg: dict,
+        exclude: int | None = None,
+    ) -> None:
+        fanout = 0
+        # 每種格式只編碼一次，所有收件者共用
+        text: str | None = None
+        data: bytes | None = None
+        binary_ok = True
+        targets: List[Tuple[UserKey, WebSocket | None]] = list(self.active_connections.items())
+        if self.detached:
+            # 斷線中的玩家：只記進 replay buffer，續連時補送
+            targets.extend((key, None) for key in self.detached)
+        for key, ws in targets:
+            sid, uid = key
+            if sid != server_id:
+                continue
+            if exclude is not None and uid == exclude:
+                continue
+            fanout += 1
+            try:
+                if binary_ok and key in self.binary_connections:
+                    if data is None:
+                        data = encode_binary(msg)
+                        binary_ok = data is not None
+                    if binary_ok:
+                        await self._deliver(key, ws, data)
+                        continue
+                if text is None:
+                    text = encode_json(msg)
+                await self._deliver(key, ws, text)
+            except (RuntimeError, WebSocketDisconnect):
+                log("SEND_ERROR", "server=%s, user_id=%s 傳送失敗，略過", sid, uid)
+                continue
+        WS_BROADCAST_FANOUT.observe(fanout, server_id)
+        if fanout:
+            WS_MESSAGES_OUT.inc(server_id, msg.get("type", "unknown"), amount=fanout)
+
+    # ------------------ 大廳玩家資訊 ------------------ #
+    def upsert_lobby_player(self, server_id: str, player: LobbyPlayer) -> None:
+        if server_id not in self.lobby_player_states:
+            self.lobby_player_states[server_id] = {}
+        self.lobby_player_states[server_id][player.user_id] = player
+
+    def get_lobby_players(self, server_id: str) -> List[LobbyPlayer]:
+        # join 順序（前端自己會排排行榜），不用每次 sorted
+        return list(self.lobby_player_states.get(server_id, {}).values())
+
+    def get_player_state(self, server_id: str, user_id: int) -> LobbyPlayer | None:
+        return self.lobby_player_states.get(server_id, {}).get(user_id)
+
+    def get_nearby_user_ids(self, server_id: str, x: float, y: float, radius: float) -> List[int]:
+        r2 = radius * radius
+        return [
+            uid for uid, p in self.lobby_player_states.get(server_id, {}).items()
+            if (p.x - x) * (p.x - x) + (p.y - y) * (p.y - y) <= r2
+        ]
+
+    def get_player_energy(self, server_id: str, user_id: int) -> int | None:
+        state = self.get_player_state(server_id, user_id)
+        if state is None:
+            return None
+        return state.energy
+
+    # ------------------ 聊天配對 ------------------ #
+    def approve_chat_pair(self, server_id: str, user1_id: int, user2_id: int) -> None:
+        pair = self.chat_approvals.approve(server_id, user1_id, user2_id)
+        log("CHAT_APPROVED", "pair=%s 已允許聊天", pair)
+
+    def is_chat_approved(self, server_id: str, from_user_id: int, to_user_id: int) -> bool:
+        return self.chat_approvals.is_approved(server_id, from_user_id, to_user_id)
+
+    # ------------------ 對戰房間 ------------------ #
+    def create_battle(self, server_id: str, player1_id: int, player2_id: int) -> BattleRoom:
+        ts = int(time.time() * 1000)
+        battle_id = f"{min(player1_id, player2_id)}_{max(player1_id, player2_id)}_{ts}"
+        room = BattleRoom(
+            battle_id=battle_id,
+            server_id=server_id,
+            player1_id=player1_id,
+            player2_id=player2_id,
+            scores={player1_id: 0, player2_id: 0},
+            ready={player1_id: False, player2_id: False},
+        )
+        self.battles[battle_id] = room
+        log(
+            "BATTLE_CREATE",
+            "server=%s, battle_id=%s, player1=%s, player2=%s",
+            server_id, battle_id, player1_id, player2_id,
+        )
+        return room
+
+    def get_battle(self, battle_id: str) -> BattleRoom | None:
+        return self.battles.get(battle_id)
+
+    def finish_battle(self, battle_id: str) -> None:
+        self.battles.pop(battle_id, None)
+        log("BATTLE_FINISH", "battle_id=%s 已移除", battle_id)
+
+    def find_battle_by_user(self, server_id: str, user_id: int) -> BattleRoom | None:
+        for room in self.battles.values():
+            if room.server_id != server_id:
+                continue
+            if user_id in (room.player1_id, room.player2_id):
+                return room
+        return None
+
+
+manager = ConnectionManager()
+
+# 聊天紀錄 write-behind：handle_chat_message 只 put，不等 DB
+chat_writer: BatchWriter = BatchWriter(
+    "chat",
+    insert_chat_messages,
+    log,
+    batch_size=int(os.environ.get("WS_CHAT_BATCH_SIZE", "200")),
+    flush_interval=int(os.environ.get("WS_CHAT_FLUSH_MS", "250")) / 1000,
+    max_queue=int(os.environ.get("WS_CHAT_QUEUE_SIZE", "10000")),
+    enabled=db_enabled(),
+    is_bad_data=is_bad_data_error,
+)
+
+# 對戰結果 write-behind：battle_id 當 idempotency key，重試不會重複加分
+battle_writer: BatchWriter = BatchWriter(
+    "battle_result",
+    insert_battle_results,
+    log,
+    batch_size=100,
+    flush_interval=0.2,
+    max_retries=8,
+    enabled=db_enabled(),
+    is_bad_data=is_bad_data_error,
+)
+
+
+async def broadcast_player_joins(batch: Sequence[UserKey]) -> None:
+    """
+    合併 JOIN_COALESCE_SECONDS 內的 join：
+    - 只有一人：照舊送 player_joined（不送給他自己）
+    - 多人：送一則 players_joined 給大廳所有人（前端略過自己那筆）
+    玩家資料在送出當下才讀，期間已離開的人不送。
+    """
+    by_server: Dict[str, Dict[int, None]] = {}
+    for server_id, user_id in batch:
+        by_server.setdefault(server_id, {})[user_id] = None
+
+    for server_id, user_ids in by_server.items():
+        players = [
+            state for state in (manager.get_player_state(server_id, uid) for uid in user_ids)
+            if state is not None
+        ]
+        if not players:
+            continue
+        if len(players) == 1:
+            user_id = players[0].user_id
+            await manager.broadcast_in_server(server_id, {
+                "type": "player_joined",
+                "server_id": server_id,
+                "user_id": user_id,
+                "payload": {"player": players[0]},
+            }, exclude=user_id)
+        else:
+            await manager.broadcast_in_server(server_id, {
+                "type": "players_joined",
+                "server_id": server_id,
+                "payload": {"players": players},
+            })
+
+
+class JoinCoalescer:
+    """
+    join 廣播的 debounce：第一個 join 進來時排一個 call_later，JOIN_COALESCE_SECONDS 後把累積的一起送。
+    沒人 join 時完全不醒來；廣播失敗只記 log 不重試（玩家資料過一下就舊了，重送沒有意義）。
+    """
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.pending: List[UserKey] = []
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, key: UserKey) -> None:
+        self.pending.append(key)
+        if self.handle is None:
+            self.handle = asyncio.get_running_loop().call_later(self.delay, self._fire)
+
+    def _fire(self) -> None:
+        self.handle = None
+        batch, self.pending = self.pending, []
+        self.task = asyncio.create_task(self._flush(batch))
+
+    async def _flush(self, batch: List[UserKey]) -> None:
+        try:
+            await broadcast_player_joins(batch)
+        except Exception as e:
+            log("JOIN_BROADCAST_FAILED", "count=%s error=%s", len(batch), e, level=logging.WARNING)
+
+    def stop(self) -> None:
+        """關機時不送了：連線都要斷了"""
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.pending = []
+
+
+join_coalescer = JoinCoalescer(JOIN_COALESCE_SECONDS)
+
+WS_CONNECTIONS = Gauge(
+    "pet_ws_connections",
+    "目前的 WebSocket 連線數",
+    ("server",),
+    callback=lambda: {(SERVER_ID,): len(manager.active_connections)},
+)
+WS_BATTLE_ROOMS = Gauge(
+    "pet_ws_battle_rooms",
+    "目前存活的對戰房間數",
+    ("server",),
+    callback=lambda: {(SERVER_ID,): len(manager.battles)},
+)
+WS_CHAT_APPROVED_PAIRS = Gauge(
+    "pet_ws_chat_approved_pairs",
+    "目前保留的聊天配對數（含還沒清掉的過期配對）",
+    ("server",),
+    callback=lambda: {(SERVER_ID,): len(manager.chat_approvals)},
+)
+
+# 目前生效的 rate limit（WS_RATE_LIMITS / WS_RATE_DEFAULT 覆寫後的結果，見 common/ratelimit.py）
+WS_RATE_LIMIT_RATE = Gauge(
+    "pet_ws_rate_limit_per_second",
+    "每條連線、每種 type 每秒可送幾則",
+    ("server", "type"),
+    callback=lambda: {
+        (SERVER_ID, t): ratelimit.LIMITS.get(t, ratelimit.DEFAULT_LIMIT)[0]
+        for t in (*router.types, ratelimit.INVALID)
+    },
+)
+WS_RATE_LIMIT_BURST = Gauge(
+    "pet_ws_rate_limit_burst",
+    "每條連線、每種 type 一次最多可連送幾則",
+    ("server", "type"),
+    callback=lambda: {
+        (SERVER_ID, t): ratelimit.LIMITS.get(t, ratelimit.DEFAULT_LIMIT)[1]
+        for t in (*router.types, ratelimit.INVALID)
+    },
+)
+
+# 即時負載：GET / 回報給後端 placement（分配新玩家 / 伺服器選擇頁）
+loop_lag = LoopLagMonitor()
+messages_in_rate = RateCounter()
+
+WS_LOOP_LAG = Gauge(
+    "pet_ws_event_loop_lag_seconds",
+    "event loop 最近 10 秒內最大的延遲",
+    ("server",),
+    callback=lambda: {(SERVER_ID,): loop_lag.max_recent},
+)
+
+# 慢 handler 偵測：每種 msg_type 的 dispatch 計時 + loop 卡住時抓 stack（見 common/watchdog.py）
+watchdog = Watchdog(SERVER_ID, log, loop_lag)
+
+# =========================================================
+# 寵物狀態：以 DB 為準（見 common/petstate.py）
+# =========================================================
+# join_lobby 時 read-through 查 energy / status / score，之後靠 pet_events 通知更新；
+# DB 關閉（WS_DATABASE_URL=""，本機 / 壓測）時才退回用前端送來的值
+pet_cache = PetStateCache(log, enabled=db_enabled())
+
+
+def apply_pet_state(
+    server_id: str,
+    user_id: int,
+    energy: int | None,
+    status: str | None,
+    score: int | None,
+) -> LobbyPlayer | None:
+    """把 DB 的新值寫進大廳裡的玩家；不在大廳或沒有任何改變回傳 None"""
+    state = manager.get_player_state(server_id, user_id)
+    if state is None:
+        return None
+    changed = False
+    if energy is not None and energy != state.energy:
+        state.energy = energy
+        changed = True
+    if status is not None and status != state.status:
+        state.status = status
+        changed = True
+    if score is not None and score != state.score:
+        state.score = score
+        changed = True
+    return state if changed else None
+
+
+async def handle_pet_event(event: PetEvent) -> None:
+    if event.event == "pets_invalidated":
+        # 整批改過（體力衰減 / LISTEN 重連）：清掉快取，大廳裡的人一次查回來
+        pet_cache.clear()
+        user_ids = list(manager.lobby_player_states.get(SERVER_ID, {}))
+        records = await pet_cache.load(user_ids)
+        changed = 0
+        for record in records.values():
+            state = apply_pet_state(SERVER_ID, record.user_id, record.energy, record.status, record.score)
+            if state is not None:
+                changed += 1
+                await push_pet_energy_changed(SERVER_ID, state, event.source)
+        log(
+            "PET_EVENTS_REFRESH",
+            "source=%s，重新載入大廳 %s 位玩家的寵物狀態，%s 位有變化",
+            event.source, len(records), changed,
+        )
+        return
+
+    if event.event != "pet_changed" or event.user_id is None:
+        return
+    record = pet_cache.apply(event)
+    if record is not None:
+        state = apply_pet_state(SERVER_ID, event.user_id, record.energy, record.status, record.score)
+    else:
+        state = apply_pet_state(SERVER_ID, event.user_id, event.energy, event.status, event.score)
+    if state is not None:
+        await push_pet_energy_changed(SERVER_ID, state, event.source)
+
+
+async def push_pet_energy_changed(server_id: str, state: LobbyPlayer, source: str) -> None:
+    """
+    DB 裡的寵物狀態變了（Pi 回報 / 體力衰減 / 對戰積分）：推給本人 + 附近的玩家，
+    前端不用再重新整理或打 /api/pet/status 才看得到
+    """
+    recipients = manager.get_nearby_user_ids(server_id, state.x, state.y, NEARBY_RADIUS)
+    await manager.multicast(server_id, recipients, {
+        "type": "pet_energy_changed",
+        "server_id": server_id,
+        "user_id": state.user_id,
+        "payload": {
+            "user_id": state.user_id,
+            "energy": state.energy,
+            "status": state.status,
+            "score": state.score,
+            "source": source,
+        },
+    })
+
+
+pet_events = PetEventListener(log, handle_pet_event, enabled=db_enabled())
+
+# =========================================================
+# 事件處理：大廳 / 位置 / 聊天
+# =========================================================
+
+
+@router.on("join_lobby", JoinLobbyPayload)
+async def handle_join_lobby(server_id: str, user_id: int, payload: JoinLobbyPayload) -> None:
+    # manager.connect 已經在 websocket_endpoint 做了（handler 拿不到 websocket）
+    restored = manager.restored_players.pop((server_id, user_id), None)
+    x = payload.x
+    y = payload.y
+    if (x is None or y is None) and restored is not None:
+        # ws-server 剛重啟：回到重啟前的位置
+        x, y = restored.x, restored.y
+    if x is None or y is None:
+        x = random.randint(0, WORLD_WIDTH)
+        y = random.randint(0, WORLD_HEIGHT)
+    # 前端帶的位置跟 update_position 一樣要拉回地圖內（NaN / inf 在 decode 時就擋掉了）
+    cx, cy = clamp_to_world(x, y)
+
+    # energy / status / score 以 DB 為準（聊天、對戰的體力門檻都看這裡），前端帶的只在 DB 關閉時使用
+    pet = await pet_cache.get(user_id)
+    if pet is not None:
+        player_info = LobbyPlayer(
+            user_id=user_id,
+            display_name=pet.display_name,
+            pet_id=pet.pet_id,
+            pet_name=pet.pet_name,
+            energy=pet.energy,
+            status=pet.status,
+            score=pet.score,
+            x=cx,
+            y=cy,
+        )
+    else:
+        if pet_cache.enabled:
+            log("PET_STATE_FALLBACK", "user_id=%s 查不到 DB 的寵物狀態，暫用前端送來的值", user_id)
+        player_info = LobbyPlayer(
+            user_id=user_id,
+            display_name=payload.display_name or f"Player{user_id}",
+            pet_id=payload.pet_id or 0,
+            pet_name=payload.pet_name or "MyPet",
+            energy=payload.energy,
+            status=payload.status or "ACTIVE",
+            # ⭐ 大廳裡也有紀錄積分
+            score=payload.score,
+            x=cx,
+            y=cy,
+        )
+    manager.upsert_lobby_player(server_id, player_info)
+    manager.last_position_at[(server_id, user_id)] = time.monotonic()
+    manager.set_compression(server_id, user_id, payload.compress == COMPRESS_DEFLATE_RAW)
+    if cx != x or cy != y:
+        await correct_position(server_id, user_id, "bounds", x, y, cx, cy)
+
+    log(
+        "JOIN_LOBBY_POS",
+        "server=%s, user_id=%s, x=%s, y=%s",
+        server_id, user_id, player_info.x, player_info.y,
+        level=logging.DEBUG,
+    )
+
+    players = manager.get_lobby_players(server_id)
+    log(
+        "JOIN_LOBBY",
+        "server=%s, user_id=%s, players_count=%s",
+        server_id, user_id, len(players),
+    )
+
+    # 大廳很大時分段送：第一段是 lobby_state，之後是 lobby_state_chunk，has_more=false 表示送完
+    # 每段之間讓出 event loop，一次大 snapshot 不會卡住其他玩家
+    total = len(players)
+    for start in range(0, max(total, 1), LOBBY_CHUNK_SIZE):
+        chunk = players[start:start + LOBBY_CHUNK_SIZE]
+        has_more = start + LOBBY_CHUNK_SIZE < total
+        await manager.send_snapshot(server_id, user_id, {
+            "type": "lobby_state" if start == 0 else "lobby_state_chunk",
+            "server_id": server_id,
+            "user_id": user_id,
+            "payload": {
+                "players": chunk,
+                "total": total,
+                "has_more": has_more,
+            },
+        })
+        if has_more:
+            await asyncio.sleep(0)
+
+    join_coalescer.add((server_id, user_id))
+
+
+@router.on("pet_state_update", PetStatePayload)
+async def handle_pet_state_update(server_id: str, user_id: int, payload: PetStatePayload) -> None:
+    state = manager.get_player_state(server_id, user_id)
+    if state is None:
+        return
+    # 有 DB 時 energy / status / score 只聽 pet_events，前端送來的忽略（只剩座標有用）
+    if not pet_cache.enabled:
+        if payload.energy is not None:
+            state.energy = payload.energy
+        if payload.status is not None:
+            state.status = payload.status
+        if payload.score is not None:
+            state.score = payload.score
+    if payload.x is not None and payload.y is not None:
+        await apply_move(server_id, user_id, state, payload.x, payload.y)
+
+    # 只記純量欄位：格式化是之後在背景 thread 做，不能把會被改動的 Struct 丟進去
+    log(
+        "PET_STATE_UPDATE",
+        "server=%s, user_id=%s, energy=%s, status=%s, score=%s",
+        server_id, user_id, state.energy, state.status, state.score,
+        level=logging.DEBUG,
+    )
+
+    msg = {
+        "type": "pet_state_update",
+        "server_id": server_id,
+        "user_id": user_id,
+        "payload": {
+            "player": state,
+        },
+    }
+    await manager.broadcast_in_server(server_id, msg)
+
+
+def clamp_to_world(x: float, y: float) -> Tuple[float, float]:
+    """超出地圖的座標拉回邊界"""
+    return min(max(float(x), 0.0), float(WORLD_WIDTH)), min(max(float(y), 0.0), float(WORLD_HEIGHT))
+
+
+async def correct_position(
+    server_id: str, user_id: int, reason: str, x: float, y: float, cx: float, cy: float
+) -> None:
+    """用 position_corrected 把 server 認定的位置告訴本人，前端直接拉回去"""
+    WS_POSITION_CORRECTED.inc(server_id, reason)
+    log(
+        "POSITION_CORRECTED",
+        "server=%s, user_id=%s, reason=%s, (%.1f, %.1f) -> (%.1f, %.1f)",
+        server_id, user_id, reason, x, y, cx, cy,
+        level=logging.DEBUG,
+    )
+    await manager.send_json(server_id, user_id, {
+        "type": "position_corrected",
+        "server_id": server_id,
+        "user_id": user_id,
+        "payload": {"x": cx, "y": cy, "reason": reason},
+    })
+
+
+async def apply_move(server_id: str, user_id: int, state: LobbyPlayer, x: float, y: float) -> None:
+    """
+    把 client 回報的位置寫進 state，位置以 server 為準：
+    - 超出地圖的拉回邊界（bounds）
+    - 跟上一個接受的位置比，距離超過 MAX_MOVE_SPEED * 經過時間 + MOVE_SLACK 的，
+      沿原方向縮到上限（speed）
+    有修正的話，用 position_corrected 把 server 認定的位置告訴本人，前端直接拉回去
+    """
+    key: UserKey = (server_id, user_id)
+    now = time.monotonic()
+    reason = None
+
+    cx, cy = clamp_to_world(x, y)
+    if cx != x or cy != y:
+        reason = "bounds"
+
+    last_x = state.x
+    last_y = state.y
+    last_at = manager.last_position_at.get(key)
+    if last_at is not None:
+        elapsed = min(now - last_at, MOVE_MAX_ELAPSED)
+        limit = MAX_MOVE_SPEED * elapsed + MOVE_SLACK
+        dx = cx - last_x
+        dy = cy - last_y
+        distance = math.hypot(dx, dy)
+        if distance > limit:
+            scale = limit / distance
+            cx = last_x + dx * scale
+            cy = last_y + dy * scale
+            reason = "speed"
+
+    state.x = cx
+    state.y = cy
+    manager.last_position_at[key] = now
+
+    if reason is not None:
+        await correct_position(server_id, user_id, reason, x, y, cx, cy)
+
+
+@router.on("update_position", PositionPayload)
+async def handle_update_position(server_id: str, user_id: int, payload: PositionPayload) -> None:
+    x = payload.x
+    y = payload.y
+
+    if x is None or y is None:
+        return
+
+    now = time.time()
+    key: UserKey = (server_id, user_id)
+    last_ts = manager.last_position_broadcast.get(key, 0.0)
+    if now - last_ts < POSITION_MIN_INTERVAL:
+        return
+    manager.last_position_broadcast[key] = now
+
+    state = manager.get_player_state(server_id, user_id)
+    if state is None:
+        return
+    await apply_move(server_id, user_id, state, x, y)
+
+    msg = {
+        "type": "other_pet_moved",
+        "server_id": server_id,
+        "user_id": user_id,
+        "payload": {
+            "player": {
+                "user_id": user_id,
+                "x": state.x,
+                "y": state.y,
+                # server 收到的時間（ms，只留低 32 bits），前端照這個時間軸做插值
+                "ts": int(now * 1000) & 0xFFFFFFFF,
+            }
+        },
+    }
+    await manager.broadcast_in_server(server_id, msg, exclude=user_id)
+
+
+@router.on("chat_request", ToUserPayload)
+async def handle_chat_request(server_id: str, from_user_id: int, payload: ToUserPayload) -> None:
+    to_user_id = payload.to_user_id
+    if to_user_id is None:
+        log("CHAT_REQ_ERROR", "缺少 to_user_id，忽略 chat_request")
+        return
+
+    if manager.get_ws(server_id, to_user_id) is None:
+        log(
+            "CHAT_REQ_OFFLINE",
+            "server=%s, from=%s, to=%s 對方不在線，無法送出聊天請求",
+            server_id, from_user_id, to_user_id,
+        )
+        error_msg = {
+            "type": "chat_not_allowed",
+            "server_id": server_id,
+            "user_id": from_user_id,
+            "payload": {
+                "reason": "TARGET_OFFLINE",
+                "message": "對方目前不在線上，無法發送聊天邀請。",
+            },
+        }
+        await manager.send_json(server_id, from_user_id, error_msg)
+        return
+
+    log(
+        "CHAT_REQUEST",
+        "server=%s, from=%s, to=%s",
+        server_id, from_user_id, to_user_id,
+    )
+
+    msg = {
+        "type": "chat_request",
+        "server_id": server_id,
+        "user_id": from_user_id,
+        "payload": {
+            "from_user_id": from_user_id,
+            "to_user_id": to_user_id,
+        },
+    }
+    await manager.send_json(server_id, to_user_id, msg)
+
+
+@router.on("chat_request_accept", FromUserPayload)
+async def handle_chat_request_accept(server_id: str, accept_user_id: int, payload: FromUserPayload) -> None:
+    from_user_id = payload.from_user_id
+    if from_user_id is None:
+        log("CHAT_ACCEPT_ERROR", "缺少 from_user_id，忽略 chat_request_accept")
+        return
+
+    manager.approve_chat_pair(server_id, accept_user_id, from_user_id)
+
+    log(
+        "CHAT_REQUEST_ACCEPT",
+        "server=%s, from=%s, accepted_by=%s",
+        server_id, from_user_id, accept_user_id,
+    )
+
+    for uid in (accept_user_id, from_user_id):
+        msg = {
+            "type": "chat_approved",
+            "server_id": server_id,
+            "user_id": uid,
+            "payload": {
+                "user_id_1": from_user_id,
+                "user_id_2": accept_user_id,
+            },
+        }
+        await manager.send_json(server_id, uid, msg)
+
+
+@router.on("chat_message", ChatMessagePayload)
+async def handle_chat_message(server_id: str, user_id: int, payload: ChatMessagePayload) -> None:
+    content = payload.content
+    to_user_id = payload.to_user_id
+    if to_user_id is None:
+        log("CHAT_ERROR", "缺少 to_user_id，忽略此訊息")
+        return
+
+    energy = manager.get_player_energy(server_id, user_id)
+    if energy is not None and energy <= 30:
+        log(
+            "CHAT_BLOCKED_ENERGY",
+            "server=%s, from=%s, to=%s, energy=%s (休眠，禁止聊天)",
+            server_id, user_id, to_user_id, energy,
+        )
+        error_msg = {
+            "type": "chat_not_allowed",
+            "server_id": server_id,
+            "user_id": user_id,
+            "payload": {
+                "reason": "LOW_ENERGY",
+                "message": "您的小寵物正在休眠狀態，無法聊天。",
+            },
+        }
+        await manager.send_json(server_id, user_id, error_msg)
+        return
+
+    if not manager.is_chat_approved(server_id, user_id, to_user_id):
+        log(
+            "CHAT_BLOCKED",
+            "server=%s, from=%s, to=%s 尚未同意聊天，拒絕傳送",
+            server_id, user_id, to_user_id,
+        )
+        error_msg = {
+            "type": "chat_not_allowed",
+            "server_id": server_id,
+            "user_id": user_id,
+            "payload": {
+                "reason": "CHAT_NOT_APPROVED",
+                "message": "對方尚未同意與你聊天。",
+            },
+        }
+        await manager.send_json(server_id, user_id, error_msg)
+        return
+
+    if manager.get_ws(server_id, to_user_id) is None:
+        log(
+            "CHAT_TARGET_OFFLINE",
+            "server=%s, from=%s, to=%s 對方不在線",
+            server_id, user_id, to_user_id,
+        )
+        error_msg = {
+            "type": "chat_not_allowed",
+            "server_id": server_id,
+            "user_id": user_id,
+            "payload": {
+                "reason": "TARGET_OFFLINE",
+                "message": "對方目前不在線上。",
+            },
+        }
+        await manager.send_json(server_id, user_id, error_msg)
+        return
+
+    log(
+        "CHAT",
+        "server=%s, from=%s, to=%s, content=%r",
+        server_id, user_id, to_user_id, content,
+    )
+
+    chat_msg = {
+        "type": "chat_message",
+        "server_id": server_id,
+        "user_id": user_id,
+        "payload": {
+            "from_user_id": user_id,
+            "to_user_id": to_user_id,
+            "content": content,
+        },
+    }
+
+    await manager.send_json(server_id, user_id, chat_msg)
+    await manager.send_json(server_id, to_user_id, chat_msg)
+
+    # 送出後才排進背景寫入（/api/chat/history 查得到）
+    chat_writer.put((user_id, to_user_id, server_id, content, datetime.now(timezone.utc)))
+
+
+# =========================================================
+# 對戰流程：邀請 / 接受 / ready / 更新分數 / 最後結果
+# =========================================================
+
+@router.on("battle_invite", ToUserPayload)
+async def handle_battle_invite(server_id: str, user_id: int, payload: ToUserPayload) -> None:
+    to_user_id = payload.to_user_id
+    if to_user_id is None:
+        log("BATTLE_INVITE_ERROR", "缺少 to_user_id，忽略 battle_invite")
+        return
+
+    inviter_energy = manager.get_player_energy(server_id, user_id)
+    if inviter_energy is not None and inviter_energy < 70:
+        log(
+            "BATTLE_INVITE_BLOCKED_ENERGY",
+            "server=%s, inviter=%s, energy=%s (<70，不可對戰)",
+            server_id, user_id, inviter_energy,
+        )
+        msg = {
+            "type": "battle_not_allowed",
+            "server_id": server_id,
+            "user_id": user_id,
+            "payload": {
+                "reason": "INVITER_LOW_ENERGY",
+                "message": "您的小寵物疲累或休眠，無法發起對戰。",
+            },
+        }
+        await manager.send_json(server_id, user_id, msg)
+        return
+
+    if manager.get_ws(server_id, to_user_id) is None:
+        log(
+            "BATTLE_INVITE_OFFLINE",
+            "server=%s, inviter=%s, to=%s 對方不在線，無法發出對戰邀請",
+            server_id, user_id, to_user_id,
+        )
+        msg = {
+            "type": "battle_not_allowed",
+            "server_id": server_id,
+            "user_id": user_id,
+            "payload": {
+                "reason": "TARGET_OFFLINE",
+                "message": "對方目前不在線上，無法發起對戰。",
+            },
+        }
+        await manager.send_json(server_id, user_id, msg)
+        return
+
+    log("BATTLE_INVITE", "server=%s, from=%s, to=%s", server_id, user_id, to_user_id)
+
+    invite_msg = {
+        "type": "battle_invite",
+        "server_id": server_id,
+        "user_id": user_id,
+        "payload": {
+            "from_user_id": user_id,
+            "to_user_id": to_user_id,
+        },
+    }
+    await manager.send_json(server_id, to_user_id, invite_msg)
+
+
+@router.on("battle_accept", FromUserPayload)
+async def handle_battle_accept(server_id: str, accept_user_id: int, payload: FromUserPayload) -> None:
+    from_user_id = payload.from_user_id
+    if from_user_id is None:
+        log("BATTLE_ACCEPT_ERROR", "缺少 from_user_id，忽略 battle_accept")
+        return
+
+    p1_energy = manager.get_player_energy(server_id, from_user_id)
+    p2_energy = manager.get_player_energy(server_id, accept_user_id)
+
+    if (p1_energy is not None and p1_energy < 70) or (p2_energy is not None and p2_energy < 70):
+        log(
+            "BATTLE_ACCEPT_BLOCKED_ENERGY",
+            "server=%s, A(user=%s, energy=%s), B(user=%s, energy=%s) 中有人 <70，不可對戰",
+            server_id, from_user_id, p1_energy, accept_user_id, p2_energy,
+        )
+
+        msg_a = {
+            "type": "battle_not_allowed",
+            "server_id": server_id,
+            "user_id": from_user_id,
+            "payload": {
+                "reason": "LOW_ENERGY",
+                "message": "雙方必須保持精神飽滿（體力 ≥ 70）才可以開始對戰。",
+            },
+        }
+        msg_b = {
+            "type": "battle_not_allowed",
+            "server_id": server_id,
+            "user_id": accept_user_id,
+            "payload": {
+                "reason": "LOW_ENERGY",
+                "message": "雙方必須保持精神飽滿（體力 ≥ 70）才可以開始對戰。",
+            },
+        }
+        await manager.send_json(server_id, from_user_id, msg_a)
+        await manager.send_json(server_id, accept_user_id, msg_b)
+        return
+
+    room = manager.create_battle(server_id, from_user_id, accept_user_id)
+
+    log(
+        "BATTLE_ACCEPT",
+        "server=%s, from=%s, accepted_by=%s, battle_id=%s",
+        server_id, from_user_id, accept_user_id, room.battle_id,
+    )
+
+    battle_start_payload = {
+        "battle_id": room.battle_id,
+        "player1_id": room.player1_id,
+        "player2_id": room.player2_id,
+    }
+
+    for pid in (room.player1_id, room.player2_id):
+        msg = {
+            "type": "battle_start",
+            "server_id": server_id,
+            "user_id": pid,
+            "payload": battle_start_payload,
+        }
+        await manager.send_json(server_id, pid, msg)
+
+
+def log_battle_outsider(msg_type: str, server_id: str, user_id: int, room: BattleRoom) -> None:
+    """不是這場對戰的兩位玩家送來的 battle_* 一律忽略：不能改分數、ready、state，也不能結算"""
+    log(
+        "BATTLE_NOT_PLAYER",
+        "server=%s, user_id=%s 不是 battle %s 的玩家（%s vs %s），忽略 %s",
+        server_id, user_id, room.battle_id, room.player1_id, room.player2_id, msg_type,
+        level=logging.WARNING,
+    )
+
+
+@router.on("battle_ready", BattlePayload)
+async def handle_battle_ready(server_id: str, user_id: int, payload: BattlePayload) -> None:
+    """雙方在 game.html 點『開始』 → 送 battle_ready，兩邊都 ready 後送 battle_go。"""
+    battle_id = payload.battle_id
+
+    if not battle_id:
+        log("BATTLE_READY_ERROR", "缺少 battle_id")
+        return
+
+    room = manager.get_battle(battle_id)
+    if not room:
+        log("BATTLE_READY_ERROR", "battle_id 不存在")
+        return
+    if not room.has_player(server_id, user_id):
+        log_battle_outsider("battle_ready", server_id, user_id, room)
+        return
+
+    room.ready[user_id] = True
+    log("BATTLE_READY", "user %s 已準備好 battle %s", user_id, battle_id)
+
+    if all(room.ready.values()):
+        log("BATTLE_GO", "battle %s 雙方都準備好了，發送 battle_go", battle_id)
+
+        msg = {
+            "type": "battle_go",
+            "server_id": server_id,
+            "payload": {
+                "battle_id": battle_id,
+                "player1_id": room.player1_id,
+                "player2_id": room.player2_id,
+            }
+        }
+
+        await manager.send_json(server_id, room.player1_id, msg)
+        await manager.send_json(server_id, room.player2_id, msg)
+
+
+@router.on("battle_update", BattleUpdatePayload)
+async def handle_battle_update(server_id: str, user_id: int, payload: BattleUpdatePayload) -> None:
+    battle_id = payload.battle_id
+    if battle_id is None:
+        log("BATTLE_UPDATE_ERROR", "缺少 battle_id，忽略 battle_update")
+        return
+    score = payload.score
+    state = payload.state
+
+    room = manager.get_battle(battle_id)
+    if room is None:
+        log("BATTLE_UPDATE", "battle_id=%s 不存在，略過", battle_id)
+        return
+    if not room.has_player(server_id, user_id):
+        log_battle_outsider("battle_update", server_id, user_id, room)
+        return
+
+    room.scores[user_id] = score
+    room.state = state
+
+    log(
+        "BATTLE_UPDATE",
+        "battle_id=%s, user_id=%s, score=%s, state=%s",
+        battle_id, user_id, score, state,
+        level=logging.DEBUG,
+    )
+
+    update_msg = {
+        "type": "battle_update",
+        "server_id": server_id,
+        "user_id": user_id,
+        "payload": {
+            "battle_id": battle_id,
+            "user_id": user_id,   # 給前端多一個保險
+            "score": score,       # ★ 改成「單一分數」
+            "state": state,
+        },
+    }
+    await manager.send_json(server_id, room.player1_id, update_msg)
+    await manager.send_json(server_id, room.player2_id, update_msg)
+
+
+@router.on("battle_result", BattlePayload)
+async def handle_battle_result(server_id: str, user_id: int, payload: BattlePayload) -> None:
+    battle_id = payload.battle_id
+    if battle_id is None:
+        log("BATTLE_RESULT_ERROR", "缺少 battle_id")
+        return
+
+    room = manager.get_battle(battle_id)
+
+    if room is None:
+        log("BATTLE_RESULT", "battle_id=%s 不存在", battle_id)
+        return
+    if not room.has_player(server_id, user_id):
+        log_battle_outsider("battle_result", server_id, user_id, room)
+        return
+
+    # 從 server 儲存的 scores 取分數，高的贏；平手沒有勝者
+    p1 = room.player1_id
+    p2 = room.player2_id
+    s1 = room.scores.get(p1, 0)
+    s2 = room.scores.get(p2, 0)
+    if s1 > s2:
+        winner = p1
+    elif s2 > s1:
+        winner = p2
+    else:
+        winner = None
+
+    result_msg = settle_battle(room, winner)
+    log(
+        "BATTLE_RESULT",
+        "battle_id=%s, player1=%s (%s), player2=%s (%s), winner=%s",
+        battle_id, p1, s1, p2, s2, winner,
+    )
+
+    await manager.send_json(server_id, p1, result_msg)
+    await manager.send_json(server_id, p2, result_msg)
+
+    manager.finish_battle(battle_id)
+
+
+def settle_battle(room: BattleRoom, winner: Optional[int]) -> dict:
+    """
+    正常結束與斷線判負共用：排進背景寫入 battles + pets.score（battle_id 當 idempotency key），
+    回傳要送給雙方的 battle_result。計分跟後端 /api/battle/result 一樣（見 common/db.py 的 BATTLE_WIN_BONUS）
+    """
+    s1 = room.scores.get(room.player1_id, 0)
+    s2 = room.scores.get(room.player2_id, 0)
+    p1_points = BATTLE_WIN_BONUS if winner == room.player1_id else 0
+    p2_points = BATTLE_WIN_BONUS if winner == room.player2_id else 0
+    battle_writer.put((
+        room.battle_id,
+        room.server_id,
+        room.player1_id,
+        room.player2_id,
+        s1,
+        s2,
+        winner,
+        p1_points,
+        p2_points,
+    ))
+    return {
+        "type": "battle_result",
+        "server_id": room.server_id,
+        "user_id": winner,
+        "payload": {
+            "battle_id": room.battle_id,
+            "winner_user_id": winner,
+            "player1_id": room.player1_id,
+            "player2_id": room.player2_id,
+            "player1_score": s1,
+            "player2_score": s2,
+            "winner_points": BATTLE_WIN_BONUS if winner is not None else 0,
+            "loser_points": 0,
+        },
+    }
+
+
+async def handle_battle_disconnect(server_id: str, user_id: int) -> None:
+    """
+    某一邊在對戰中突然斷線時的處理：
+    - waiting：只是大家剛跳轉、還沒正式開始 → 直接收房間 or 只 log，看你需要
+    - running：才會把斷線方判定為落敗，加積分給另外一方。
+    """
+    room = manager.find_battle_by_user(server_id, user_id)
+    if room is None:
+        log(
+            "BATTLE_DISCONNECT",
+            "server=%s, disconnect_user=%s, 但找不到 battle 房間，略過",
+            server_id, user_id,
+        )
+        return
+
+    if room.state == "waiting":
+        log(
+            "BATTLE_DISCONNECT_WAITING",
+            "server=%s, disconnect_user=%s, battle_id=%s (waiting，多半是從 lobby 切到 game.html，不判輸贏)",
+            server_id, user_id, room.battle_id,
+        )
+        # 這裡可以選擇要不要 finish_battle，看你設計
+        # manager.finish_battle(room.battle_id)
+        return
+
+    if room.state != "running":
+        log(
+            "BATTLE_DISCONNECT",
+            "server=%s, disconnect_user=%s, battle_id=%s (state=%s，不判輸贏，只結束房間)",
+            server_id, user_id, room.battle_id, room.state,
+        )
+        manager.finish_battle(room.battle_id)
+        return
+
+    # 正常 running 中斷線 → 另一方勝利（跟正常結束一樣寫進 DB、加分）
+    winner_user_id = room.player2_id if user_id == room.player1_id else room.player1_id
+    result_msg = settle_battle(room, winner_user_id)
+
+    log(
+        "BATTLE_DISCONNECT",
+        "server=%s, disconnect_user=%s, winner=%s, battle_id=%s",
+        server_id, user_id, winner_user_id, room.battle_id,
+    )
+
+    await manager.send_json(server_id, room.player1_id, result_msg)
+    await manager.send_json(server_id, room.player2_id, result_msg)
+
+    manager.finish_battle(room.battle_id)
+
+
+# =========================================================
+# 重啟交接：drain → snapshot → 叫前端重連；新 process 啟動時還原
+# =========================================================
+
+
+def begin_drain(reason: str) -> bool:
+    """
+    進入 drain：之後不收新連線，斷線不判負；當下的狀態同步寫進 snapshot（不 await，中間不會被改）。
+    SIGTERM（見 handoff.install_sigterm_hook）與 POST /internal/drain 都走這裡，只會做一次。
+    """
+    if manager.draining:
+        return False
+    manager.draining = True
+    snapshot = manager.snapshot(SERVER_ID)
+    try:
+        size = handoff.save_snapshot(SNAPSHOT_PATH, snapshot)
+    except OSError as e:
+        log("DRAIN_SNAPSHOT_ERROR", "寫入 snapshot %s 失敗：%r", SNAPSHOT_PATH, e, level=logging.ERROR)
+    else:
+        log(
+            "DRAIN",
+            "開始 drain（%s）：%s 位玩家、%s 個對戰、%s 組聊天配對寫入 %s（%s bytes）",
+            reason, len(snapshot.players), len(snapshot.battles),
+            len(snapshot.chat_approved_pairs), SNAPSHOT_PATH, size,
+        )
+    # SIGTERM：uvicorn 接著會用 1012 關掉所有連線，這裡只先通知前端多久後重連
+    asyncio.get_running_loop().create_task(announce_restart(close=reason != "sigterm"))
+    return True
+
+
+async def announce_restart(close: bool) -> int:
+    """每條連線送 server_restart（各自隨機的重連延遲）；close=True 時送完就用 1012 關掉"""
+    keys = [key for key in list(manager.active_connections) if key[0] == SERVER_ID]
+    for server_id, user_id in keys:
+        try:
+            await manager.send_json(server_id, user_id, {
+                "type": "server_restart",
+                "server_id": server_id,
+                "user_id": user_id,
+                "payload": {"reconnect_after_ms": random.randint(0, RESTART_JITTER_MS)},
+            })
+            ws = manager.get_ws(server_id, user_id)
+            if close and ws is not None:
+                await ws.close(code=1012)
+        except (RuntimeError, WebSocketDisconnect):
+            # SIGTERM 時 uvicorn 可能已經先把連線關了
+            pass
+    return len(keys)
+
+
+def restore_snapshot() -> None:
+    try:
+        snapshot = handoff.load_snapshot(SNAPSHOT_PATH, ShardSnapshot, SNAPSHOT_MAX_AGE)
+    except (OSError, msgspec.DecodeError) as e:
+        log("RESTORE_ERROR", "讀取 snapshot %s 失敗，不還原：%r", SNAPSHOT_PATH, e, level=logging.ERROR)
+        return
+    if snapshot is None:
+        return
+    if snapshot.server_id != SERVER_ID:
+        log("RESTORE_ERROR", "snapshot 是 server=%s 的，不還原", snapshot.server_id, level=logging.ERROR)
+        return
+    manager.restore(snapshot)
+    log(
+        "RESTORE",
+        "從 snapshot 還原（%.1f 秒前）：%s 位玩家、%s 個對戰、%s 組聊天配對，等 %s 秒讓玩家重連",
+        time.time() - snapshot.saved_at, len(snapshot.players), len(snapshot.battles),
+        len(snapshot.chat_approved_pairs), RESTORE_GRACE_SECONDS,
+    )
+    asyncio.get_running_loop().call_later(RESTORE_GRACE_SECONDS, manager.expire_restored)
+
+
+# =========================================================
+# 斷線續連 / 斷線清理
+# =========================================================
+
+
+async def resume_session(
+    server_id: str,
+    user_id: int,
+    websocket: WebSocket,
+    binary: bool,
+    payload: JoinLobbyPayload,
+) -> bool:
+    replayed = await manager.resume(server_id, user_id, websocket, binary, payload.resume_token, payload.last_seq)
+    if replayed is None:
+        WS_RESUMES.inc(server_id, "rejected")
+        log(
+            "WS_RESUME_REJECTED",
+            "server=%s, user_id=%s 無法續連（session 已結束 / token 不符 / 漏掉的訊息已不在 buffer），改走一般 join",
+            server_id, user_id,
+        )
+        return False
+    WS_RESUMES.inc(server_id, "resumed")
+    WS_RESUME_REPLAYED.inc(server_id, amount=replayed)
+    log("WS_RESUME", "server=%s, user_id=%s 續連成功，補送 %s 個 frame", server_id, user_id, replayed)
+    return True
+
+
+async def expire_session(server_id: str, user_id: int) -> None:
+    if (server_id, user_id) not in manager.detached:
+        return
+    WS_RESUMES.inc(server_id, "expired")
+    log("WS_RESUME_EXPIRED", "server=%s, user_id=%s 寬限期內沒有續連", server_id, user_id)
+    if manager.draining:
+        manager.disconnect(server_id, user_id)
+        return
+    await finish_disconnect(server_id, user_id)
+
+
+async def finish_disconnect(server_id: str, user_id: int) -> None:
+    """真的離開了：對戰判負、退出大廳、通知其他人"""
+    await handle_battle_disconnect(server_id, user_id)
+    manager.disconnect(server_id, user_id)
+    log("WS_DISCONNECT", "server=%s, user_id=%s 斷線", server_id, user_id)
+
+    player_left_msg = {
+        "type": "player_left",
+        "server_id": server_id,
+        "user_id": user_id,
+        "payload": {},
+    }
+    await manager.broadcast_in_server(server_id, player_left_msg, exclude=user_id)
+
+
+# =========================================================
+# FastAPI 路由：health_check + WebSocket 主入口
+# =========================================================
+
+@app.get("/")
+async def health_check():
+    # 後端的 placement 會定期來問（最多每 2 秒一次）：分配新玩家 / 換伺服器時的容量依據
+    log("HEALTH_CHECK", "收到 / 請求", level=logging.DEBUG)
+    return {
+        "message": f"ws{SERVER_ID} server running",
+        "server_id": SERVER_ID,
+        "connections": len(manager.active_connections),
+        "lobby_size": len(manager.lobby_player_states.get(SERVER_ID, {})),
+        "battles": len(manager.battles),
+        "loop_lag_ms": round(loop_lag.max_recent * 1000, 2),
+        "messages_per_sec": round(messages_in_rate.per_second(), 2),
+        "draining": manager.draining,
+    }
+
+
+@app.post("/internal/evict", include_in_schema=False)
+async def internal_evict(body: dict, x_internal_token: str | None = Header(default=None)):
+    """後端 switch_server 成功後呼叫：把已經搬走的 user 從這台踢掉"""
+    if not check_internal_token(x_internal_token):
+        return JSONResponse(status_code=403, content={"success": False})
+    try:
+        user_id = int(body["user_id"])
+    except (KeyError, TypeError, ValueError):
+        return JSONResponse(status_code=400, content={"success": False})
+    evicted = await manager.evict(SERVER_ID, user_id, str(body.get("new_server_id", "")))
+    return {"success": True, "evicted": evicted}
+
+
+@app.post("/internal/drain", include_in_schema=False)
+async def internal_drain(x_internal_token: str | None = Header(default=None)):
+    """部署時在送 SIGTERM 之前呼叫：存 snapshot、叫所有前端稍後重連並關掉連線"""
+    if not check_internal_token(x_internal_token):
+        return JSONResponse(status_code=403, content={"success": False})
+    started = begin_drain("internal")
+    return {"success": True, "started": started, "connections": len(manager.active_connections)}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 抓取用（text exposition format）"""
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+async def charge_rate_limit(
+    websocket: WebSocket,
+    server_id: str,
+    user_id: int,
+    limiter: ratelimit.ConnectionLimiter,
+    bucket: str,
+) -> bool:
+    """
+    扣這條連線 bucket 的額度：有額度回 True；超過的回 False（frame 直接丟掉）。
+    短時間內被丟太多則的連線直接斷線（raise WebSocketDisconnect）。
+    """
+    if limiter.allow(bucket):
+        return True
+    WS_RATE_LIMITED.inc(server_id, bucket)
+    if limiter.should_disconnect:
+        WS_RATE_LIMIT_DISCONNECTS.inc(server_id)
+        log(
+            "WS_RATE_LIMIT_KICK",
+            "user_id=%s 在 %.0f 秒內被丟了 %s 則訊息（最後一則算在 %s），斷線",
+            user_id, limiter.window, limiter.drops, bucket,
+            level=logging.WARNING,
+        )
+        await websocket.close(code=1008)
+        raise WebSocketDisconnect(1008)
+    return False
+
+
+@app.websocket("/ws/")
+async def websocket_endpoint(websocket: WebSocket):
+    # handshake 就驗 token（/ws/?token=...）：身分以 token 為準，不查 DB，
+    # 之後訊息裡帶的 user_id 只用來比對，不再拿來綁定連線
+    server_id = SERVER_ID
+    token = websocket.query_params.get("token")
+    try:
+        if not token:
+            raise AuthError("UNAUTHORIZED", "missing token")
+        claims = verify_token(token)
+    except AuthError as e:
+        log("WS_AUTH_FAIL", "handshake 驗證失敗：%s", e.code)
+        await websocket.close(code=1008)
+        return
+
+    # token 的 server_id 是 switch_server 分配的 shard；連錯台就拒絕（前端要先呼叫 switch_server）
+    # 先 accept 再關：handshake 階段關閉前端只會看到 1006，accept 後才收得到 4003
+    # （前端有提供子協定時 accept 一定要選一個，不然瀏覽器直接判定 handshake 失敗）
+    subprotocol = choose_subprotocol(websocket.scope.get("subprotocols") or ())
+    binary = subprotocol == SUBPROTOCOL_BINARY
+    if claims.server_id != server_id:
+        log("WS_WRONG_SERVER", "user_id=%s 屬於 server=%s，拒絕連到 server=%s", claims.user_id, claims.server_id, server_id)
+        await websocket.accept(subprotocol=subprotocol)
+        await websocket.close(code=4003)
+        return
+
+    user_id: int = claims.user_id
+    if manager.draining:
+        # 重啟中：1012 = service restart，前端會稍後重連（到時候是新 process）
+        await websocket.accept(subprotocol=subprotocol)
+        await websocket.close(code=1012)
+        return
+
+    await websocket.accept(subprotocol=subprotocol)
+    log("WS_ACCEPT", "新的 WebSocket 連線，token user_id=%s，subprotocol=%s", user_id, subprotocol)
+    joined = False
+    limiter = ratelimit.ConnectionLimiter()
+
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+
+            # text frame：JSON envelope，payload 等確定要處理時才解
+            # binary frame（pet.bin.v2）：固定格式，一次解完，身分以連線為準
+            envelope = None
+            payload = None
+            try:
+                data = frame.get("bytes")
+                if data is not None:
+                    msg_type, payload = decode_binary(data, router.max_bytes)
+                else:
+                    envelope = router.decode_envelope(frame.get("text") or "")
+                    msg_type = envelope.type
+            except MessageRejected as e:
+                # 解不開 / 太大的 frame 共用 invalid bucket，一直送的一樣會被斷線
+                WS_MESSAGES_REJECTED.inc(server_id, e.reason)
+                if await charge_rate_limit(websocket, server_id, user_id, limiter, ratelimit.INVALID):
+                    log("WS_BAD_MESSAGE", "user_id=%s 訊息被拒（%s）：%s", user_id, e.reason, e.detail)
+                continue
+
+            route = router.get(msg_type)
+            type_label = msg_type if route is not None else "unknown"
+            messages_in_rate.mark()
+            WS_MESSAGES_IN.inc(server_id, type_label)
+
+            # 超過這條連線這個 type 的額度：payload 不解直接丟；一直超過的斷線
+            # 未知 type 算在 invalid bucket（bucket 數量有上限）
+            bucket = msg_type if route is not None else ratelimit.INVALID
+            if not await charge_rate_limit(websocket, server_id, user_id, limiter, bucket):
+                continue
+
+            if envelope is not None and envelope.user_id is not None and envelope.user_id != user_id:
+                log(
+                    "WS_IMPERSONATE",
+                    "token user_id=%s，但 %s 帶 user_id=%r，忽略",
+                    user_id, msg_type, envelope.user_id,
+                )
+                continue
+
+            # 未知 type 不解 payload
+            if route is None:
+                WS_MESSAGES_REJECTED.inc(server_id, "unknown_type")
+                log("WS_UNKNOWN_TYPE", "未知事件 type=%r，略過", msg_type[:64])
+                continue
+
+            if msg_type != "join_lobby" and not joined:
+                log("WS_NO_USER", "尚未 join_lobby 的連線收到 %s，忽略", msg_type)
+                continue
+
+            started = watchdog.begin(type_label)
+            try:
+                try:
+                    if envelope is not None:
+                        payload = route.decode(envelope.payload)
+                except MessageRejected as e:
+                    WS_MESSAGES_REJECTED.inc(server_id, e.reason)
+                    if await charge_rate_limit(websocket, server_id, user_id, limiter, ratelimit.INVALID):
+                        log("WS_BAD_MESSAGE", "user_id=%s 訊息被拒（%s）：%s", user_id, e.reason, e.detail)
+                    continue
+
+                if msg_type == "join_lobby":
+                    if payload.resume_token and await resume_session(server_id, user_id, websocket, binary, payload):
+                        joined = True
+                        continue
+                    manager.connect(server_id, user_id, websocket, binary=binary)
+                    await manager.start_session(server_id, user_id)
+                    joined = True
+                await route.handler(server_id, user_id, payload)
+            finally:
+                watchdog.end(type_label, started)
+
+    except WebSocketDisconnect as e:
+        if not joined:
+            return
+        if manager.get_ws(server_id, user_id) is not websocket:
+            # 已經有新連線接手（續連 / 重新 join），這條舊連線不用清理
+            log("WS_SUPERSEDED", "server=%s, user_id=%s 舊連線斷線（已由新連線接手）", server_id, user_id)
+            return
+        if manager.draining:
+            # 重啟造成的斷線：狀態已經在 snapshot 裡，對戰不判負、不廣播 player_left
+            manager.disconnect(server_id, user_id)
+            return
+        if e.code in RESUMABLE_CLOSE_CODES and manager.detach(
+            server_id, user_id, lambda: asyncio.create_task(expire_session(server_id, user_id)),
+        ):
+            WS_RESUMES.inc(server_id, "detached")
+            log(
+                "WS_DETACH",
+                "server=%s, user_id=%s 連線中斷（code=%s），保留 %s 秒等續連",
+                server_id, user_id, e.code, RESUME_GRACE_SECONDS,
+            )
+            return
+        await finish_disconnect(server_id, user_id)
@@ -0,0 +1,129 @@
+# ws-server/common/watchdog.py
+
+"""
+event loop watchdog：找出「大廳偶爾整個卡住」是哪個 handler 造成的
+
+所有 handler 都跑在同一個 asyncio loop 上，任何同步的重活（大 dict 複製、json.dumps、sorted、
+print 到塞住的 pipe…）都會讓全部玩家一起卡住。這裡做三件事：
+
+1. loop lag：LoopLagMonitor 每 50ms 醒來一次，lag 寫進 histogram
+2. 每個 msg_type 的 dispatch 計時（begin / end），寫進 per-type histogram；
+   超過門檻的記一筆 SLOW_HANDLER（這是 wall time，含 await 送資料的時間）
+3. 背景 thread 盯著 loop 的心跳：超過門檻沒跳，代表 loop 正卡在同步程式碼裡，
+   用 sys._current_frames() 抓 loop thread 當下的 stack 記一筆 LOOP_STALL
+   （同一次卡住最多抓 MAX_STACKS_PER_STALL 次，避免洗版）
+
+環境變數：
+- WS_SLOW_HANDLER_MS   門檻，預設 100
+- WS_WATCHDOG          設成 0 關掉 stack 取樣 thread（計時 / histogram 照常）
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional, Tuple
+
+from common.loadstats import LoopLagMonitor
+from common.metrics import Histogram
+
+SLOW_HANDLER_SECONDS = int(os.environ.get("WS_SLOW_HANDLER_MS", "100")) / 1000
+WATCHDOG_ENABLED = os.environ.get("WS_WATCHDOG", "1") != "0"
+MAX_STACKS_PER_STALL = 3
+
+WS_HANDLER_SECONDS = Histogram(
+    "pet_ws_handler_seconds",
+    "每種訊息 dispatch 花的時間（wall time，含 await）",
+    ("server", "type"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+WS_LOOP_LAG_SECONDS = Histogram(
+    "pet_ws_loop_lag_sample_seconds",
+    "event loop lag 量測值分布（每 50ms 一次）",
+    ("server",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+class Watchdog:
+    def __init__(self, server_id: str, log, lag_monitor: LoopLagMonitor) -> None:
+        self.server_id = server_id
+        self.log = log
+        self.lag_monitor = lag_monitor
+        lag_monitor.on_sample = self._observe_lag
+        # 目前正在 dispatch 的 (msg_type, 開始時間)；loop thread 寫、取樣 thread 讀
+        self._current: Optional[Tuple[str, float]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---------------- loop thread 這邊 ---------------- #
+    def _observe_lag(self, lag: float) -> None:
+        WS_LOOP_LAG_SECONDS.observe(lag, self.server_id)
+
+    def begin(self, msg_type: str) -> float:
+        started = time.perf_counter()
+        self._current = (msg_type, time.monotonic())
+        return started
+
+    def end(self, msg_type: str, started: float) -> None:
+        self._current = None
+        elapsed = time.perf_counter() - started
+        WS_HANDLER_SECONDS.observe(elapsed, self.server_id, msg_type)
+        if elapsed >= SLOW_HANDLER_SECONDS:
+            self.log(
+                "SLOW_HANDLER",
+                "type=%s 花了 %.1f ms（門檻 %.0f ms）",
+                msg_type, elapsed * 1000, SLOW_HANDLER_SECONDS * 1000,
+                level=logging.WARNING,
+            )
+
+    def start(self) -> None:
+        """要在 event loop 的 thread 上呼叫（lifespan 裡），才知道要盯哪條 thread"""
+        self._loop_thread_id = threading.get_ident()
+        if not WATCHDOG_ENABLED or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ws-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    # ---------------- 取樣 thread 這邊 ---------------- #
+    def _run(self) -> None:
+        poll = max(SLOW_HANDLER_SECONDS / 2, 0.01)
+        stalled_since: Optional[float] = None
+        stacks_taken = 0
+        while not self._stop.wait(poll):
+            beat = self.lag_monitor.last_beat
+            # 心跳本身每 interval 跳一次，超過 interval + 門檻沒跳才算卡住
+            if time.monotonic() - beat < self.lag_monitor.interval + SLOW_HANDLER_SECONDS:
+                stalled_since = None
+                continue
+            if stalled_since != beat:
+                stalled_since = beat
+                stacks_taken = 0
+            if stacks_taken >= MAX_STACKS_PER_STALL:
+                continue
+            stacks_taken += 1
+            self._sample_stack(time.monotonic() - beat)
+
+    def _sample_stack(self, stalled_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame, limit=25))
+        current = self._current
+        msg_type = current[0] if current else "-"
+        self.log(
+            "LOOP_STALL",
+            "event loop 已卡住 %.0f ms，dispatch 中的 type=%s，loop thread stack：\n%s",
+            stalled_for * 1000, msg_type, stack,
+            level=logging.WARNING,
+        )
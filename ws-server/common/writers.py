@@ -0,0 +1,181 @@
+# ws-server/common/writers.py
+
+"""
+非同步 write-behind 批次寫入
+
+- put() 只把資料丟進有界 queue，不 await、不碰 DB，訊息轉送不會多等任何 DB 延遲
+- 背景 task 每 flush_interval 秒或累積 batch_size 筆就寫一次（一次 round trip）
+- queue 滿了就丟掉新資料並計數（寧可少記一筆，也不拖慢 event loop）
+- 寫入失敗會退避重試；stop() 會把 queue 剩下的資料全部寫完才結束（graceful restart 不掉資料）
+- 資料本身寫不進去（is_bad_data 判定，例如 FK 違反）就不重試，把批次對半拆開各自寫，
+  最後只丟掉真的壞掉的那幾筆，同一批其他資料照常寫入
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Generic, List, Optional, Sequence, TypeVar
+
+from common.metrics import Counter, Gauge, Histogram
+
+T = TypeVar("T")
+
+WRITER_ITEMS = Counter(
+    "pet_ws_writer_items_total",
+    "背景 writer 處理的筆數（written / dropped / failed）",
+    ("writer", "result"),
+)
+WRITER_FLUSH_SECONDS = Histogram(
+    "pet_ws_writer_flush_seconds",
+    "背景 writer 每次批次寫入的時間",
+    ("writer",),
+)
+WRITER_BATCH_SIZE = Histogram(
+    "pet_ws_writer_batch_size",
+    "背景 writer 每次批次寫入的筆數",
+    ("writer",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+
+_writers: List["BatchWriter[Any]"] = []
+
+WRITER_QUEUE_DEPTH = Gauge(
+    "pet_ws_writer_queue_depth",
+    "背景 writer queue 內尚未寫入的筆數",
+    ("writer",),
+    callback=lambda: {(w.name,): w.queue.qsize() for w in _writers},
+)
+
+
+class BatchWriter(Generic[T]):
+    def __init__(
+        self,
+        name: str,
+        flush_fn: Callable[[Sequence[T]], Awaitable[None]],
+        log: Callable[..., None],
+        batch_size: int = 200,
+        flush_interval: float = 0.25,
+        max_queue: int = 10_000,
+        max_retries: int = 5,
+        enabled: bool = True,
+        is_bad_data: Optional[Callable[[Exception], bool]] = None,
+    ) -> None:
+        self.name = name
+        self.flush_fn = flush_fn
+        self.log = log
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.enabled = enabled
+        self.is_bad_data = is_bad_data
+        self.queue: "asyncio.Queue[T]" = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        _writers.append(self)
+
+    def put(self, item: T) -> bool:
+        """丟進 queue 就回傳；queue 滿或 writer 已停止時回傳 False。"""
+        if not self.enabled or self._stopping:
+            return False
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            WRITER_ITEMS.inc(self.name, "dropped")
+            self.log("WRITER_QUEUE_FULL", "writer=%s queue 已滿，丟棄一筆", self.name)
+            return False
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name=f"writer-{self.name}")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """停止收新資料，並把 queue 裡剩下的全部寫完。"""
+        self._stopping = True
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            self.log(
+                "WRITER_STOP_TIMEOUT",
+                "writer=%s 關閉逾時，尚有 %s 筆未寫入",
+                self.name, self.queue.qsize(),
+            )
+        self._task = None
+
+    async def _next_batch(self) -> List[T]:
+        batch: List[T] = []
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+            return batch
+        batch.append(first)
+
+        # 第一筆進來後，最多再等 flush_interval，或湊滿 batch_size 就寫
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List[T]) -> None:
+        delay = 0.2
+        for attempt in range(1, self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                await self.flush_fn(batch)
+            except Exception as exc:  # noqa: BLE001  DB 斷線、逾時等都重試
+                self.log(
+                    "WRITER_FLUSH_ERROR",
+                    "writer=%s 第 %s 次寫入 %s 筆失敗：%r",
+                    self.name, attempt, len(batch), exc,
+                )
+                if self.is_bad_data is not None and self.is_bad_data(exc):
+                    await self._split(batch, exc)
+                    return
+                if attempt == self.max_retries:
+                    break
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+                continue
+            WRITER_FLUSH_SECONDS.observe(time.perf_counter() - start, self.name)
+            WRITER_BATCH_SIZE.observe(len(batch), self.name)
+            WRITER_ITEMS.inc(self.name, "written", amount=len(batch))
+            return
+        WRITER_ITEMS.inc(self.name, "failed", amount=len(batch))
+
+    async def _split(self, batch: List[T], exc: Exception) -> None:
+        """重試也不會過的批次：對半拆開各自寫（各自也會重試 / 再拆），拆到剩一筆還失敗才丟掉"""
+        if len(batch) == 1:
+            WRITER_ITEMS.inc(self.name, "failed")
+            self.log(
+                "WRITER_BAD_ROW",
+                "writer=%s 丟棄一筆寫不進去的資料 %r：%r",
+                self.name, batch[0], exc,
+                level=logging.WARNING,
+            )
+            return
+        middle = len(batch) // 2
+        await self._flush(batch[:middle])
+        await self._flush(batch[middle:])
+
+    async def _run(self) -> None:
+        while True:
+            if self._stopping and self.queue.empty():
+                return
+            batch = await self._next_batch()
+            if batch:
+                await self._flush(batch)